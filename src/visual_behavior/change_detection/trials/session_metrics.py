@@ -6,7 +6,7 @@ import pandas as pd
 from ..trials import masks
 from ...utilities import get_response_rates, flatten_list
 from ...metrics import d_prime
-from ...translator.core.annotate import assign_trial_description
+from ...translator.core.annotate import get_trial_descriptions
 
 
 def discrim(
@@ -48,43 +48,24 @@ def flashwise_lick_probability(session_trials, flash_blank_duration=0.75):
         flash_blank_duration (default = 0.75): the sum of the flash display duration and the intervening gray screen (this is the same as the inter-flash-interval)
     IMPORTANT: This algorithm infers the number of flashes per unit time; it has no way of accounting for omitted flashes or exceptionally long frame intervals
     '''
-    trials = session_trials.copy()  # operate on a copy because we will add some columns to the trials. If this were a slice, we run into trouble
-
-    def get_first_lick_time(lick_times):
-        if len(lick_times) > 0:
-            return lick_times[0]
-        else:
-            return None
-
-    def get_pre_lick_flashes(row, flash_blank_duration=flash_blank_duration):
-        first_lick = row['first_lick']
-        trial_length = row['trial_length']
-        if pd.notnull(first_lick):
-            return np.floor(first_lick / flash_blank_duration)
-        else:
-            return np.floor(trial_length / flash_blank_duration)
-
-    def get_flashes_with_licks(row):
-        trial_type = row['trial_type']
-        first_lick = row['first_lick']
-        if trial_type == 'autorewarded' or trial_type == 'go':
-            # don't count licks following change or free reward presentation
-            return 0
-        elif pd.isnull(first_lick):
-            return 0
-        else:
-            return 1
-
-    # get first lick time
-    trials['first_lick'] = trials['lick_times'].map(get_first_lick_time)
+    first_lick = np.array([
+        trial_licks[0] if len(trial_licks) > 0 else np.nan
+        for trial_licks in session_trials['lick_times'].values
+    ], dtype=float)
     # reference first lick to trial start
-    trials['first_lick'] = trials['first_lick'] - trials['starttime']
-    # count pre-lick flashes
-    trials['flashes_without_licks'] = trials[['first_lick', 'trial_length']].apply(get_pre_lick_flashes, axis=1)
-    # count first post-lick flash (0 if autorewarded or if there was not lick, 1 otherwise)
-    trials['flashes_with_licks'] = trials[['first_lick', 'trial_type']].apply(get_flashes_with_licks, axis=1)
+    first_lick = first_lick - session_trials['starttime'].values
+    has_lick = ~np.isnan(first_lick)
 
-    return trials['flashes_with_licks'].sum() / (trials['flashes_with_licks'].sum() + trials['flashes_without_licks'].sum())
+    # count pre-lick flashes, up to the first lick or to the end of the trial if there was no lick
+    flashes_without_licks = np.floor(
+        np.where(has_lick, first_lick, session_trials['trial_length'].values.astype(float)) / flash_blank_duration
+    )
+    # count first post-lick flash (0 if autorewarded, on go trials or if there was no lick, 1 otherwise)
+    # licks following the change or free reward presentation are not counted
+    flashes_with_licks = has_lick & ~session_trials['trial_type'].isin(['autorewarded', 'go']).values
+
+    n_flashes_with_licks = flashes_with_licks.sum()
+    return n_flashes_with_licks / (n_flashes_with_licks + np.nansum(flashes_without_licks))
 
 
 def num_trials(session_trials):
@@ -178,22 +159,28 @@ def peak_false_alarm_rate(session_trials):
         return np.nan
 
 
+def full_trial_types(session_trials):
+    '''
+    the description of each trial (hit, miss, aborted etc.), as a categorical `full_trial_type` column
+    computed once and reused on later calls, see annotate.annotate_trial_description
+    '''
+    if 'full_trial_type' not in session_trials.columns or not isinstance(session_trials['full_trial_type'].dtype, pd.CategoricalDtype):
+        session_trials['full_trial_type'] = get_trial_descriptions(session_trials)
+    return session_trials['full_trial_type']
+
+
 def fraction_time_by_trial_type(session_trials, trial_type='aborted'):
-    session_trials['full_trial_type'] = session_trials.apply(assign_trial_description, axis=1)
-    trial_fractions = session_trials.groupby('full_trial_type')['trial_length'].sum() / session_trials['trial_length'].sum()
-    try:
-        return trial_fractions[trial_type]
-    except KeyError:
+    is_trial_type = (full_trial_types(session_trials) == trial_type).values
+    if not is_trial_type.any():
         return 0.0
+    return session_trials['trial_length'][is_trial_type].sum() / session_trials['trial_length'].sum()
 
 
 def trial_count_by_trial_type(session_trials, trial_type='hit'):
-    session_trials['full_trial_type'] = session_trials.apply(assign_trial_description, axis=1)
-    trial_count = session_trials.groupby('full_trial_type')['trial_length'].count()
-    try:
-        return trial_count[trial_type]
-    except KeyError:
+    is_trial_type = (full_trial_types(session_trials) == trial_type).values
+    if not is_trial_type.any():
         return 0.0
+    return session_trials['trial_length'][is_trial_type].count()
 
 
 def total_number_of_licks(session_trials):
@@ -3,7 +3,7 @@ import pandas as pd
 import numpy as np
 from . import session_metrics
 from ... import metrics
-from ...translator.core.annotate import annotate_epochs, annotate_change_detect
+from ...translator.core.annotate import annotate_epochs, annotate_change_detect, annotate_trial_description
 
 
 def create_summarizer(**kwargs):
@@ -24,6 +24,116 @@ def create_summarizer(**kwargs):
     return apply_func
 
 
+SUMMARY_ENGINES = ['apply', 'vectorized']
+
+# metrics that the vectorized engine derives from per-group go/catch counts
+DISCRIMINATION_METRICS = [
+    'discrim_p',
+    'response_bias',
+    'number_of_go_trials',
+    'number_of_catch_trials',
+    'hit_rate',
+    'false_alarm_rate',
+    'd_prime',
+]
+
+
+def count_discrimination_trials(trials, groupby):
+    ''' counts go, catch, hit and false alarm trials in each group with a single groupby
+
+    `trials` must have been annotated with `annotate_change_detect`
+    '''
+    contingent = trials['trial_type'].isin(['go', 'catch']).values
+    change = trials['change'].values.astype(bool)
+    detect = trials['detect'].values.astype(bool)
+
+    is_go = contingent & change
+    is_catch = contingent & ~change
+    counts = pd.DataFrame({
+        'go': is_go,
+        'catch': is_catch,
+        'hit': is_go & detect,
+        'false_alarm': is_catch & detect,
+    }, index=trials.index)
+    for key in groupby:
+        counts[key] = trials[key]
+
+    return counts.groupby(list(groupby)).agg('sum').astype(int)
+
+
+def discrimination_summary(trials, groupby, apply_trial_number_limit=False, clip_vals=[0, 1]):
+    ''' computes the discrimination metrics for each group from a single set of per-group counts
+
+    Parameters
+    ----------
+    trials : pandas DataFrame
+        dataframe of trials, annotated with `annotate_change_detect`
+    groupby : list of columns to group the trials by
+    apply_trial_number_limit : bool, optional
+        bound the hit and false alarm rates by the trial count, see `utilities.trial_number_limit`
+    clip_vals : limits on the hit and false alarm rates, also used as the d' limits
+
+    Returns
+    -------
+    pandas DataFrame
+        indexed by `groupby`, with one column for each of DISCRIMINATION_METRICS
+    '''
+    counts = count_discrimination_trials(trials, groupby)
+    go = counts['go'].values
+    catch = counts['catch'].values
+    hit = counts['hit'].values
+    false_alarm = counts['false_alarm'].values
+
+    hit_rate = metrics.response_rate_from_counts(hit, go, apply_trial_number_limit, clip_vals)
+    false_alarm_rate = metrics.response_rate_from_counts(false_alarm, catch, apply_trial_number_limit, clip_vals)
+    d_prime = metrics.d_prime_from_rates(hit_rate, false_alarm_rate, clip_vals)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        response_bias = (hit + false_alarm) / (go + catch).astype(float)
+
+    discrim_p = metrics.discrim_p_from_counts(hit, go - hit, false_alarm, catch - false_alarm)
+
+    return pd.DataFrame({
+        'discrim_p': discrim_p,
+        'response_bias': response_bias,
+        'number_of_go_trials': go,
+        'number_of_catch_trials': catch,
+        'hit_rate': hit_rate,
+        'false_alarm_rate': false_alarm_rate,
+        'd_prime': d_prime,
+    }, index=counts.index, columns=DISCRIMINATION_METRICS)
+
+
+def summarize_groups(trials, groupby, summary_metrics, engine='apply', overridden_metrics=(), **discrimination_kws):
+    ''' applies the summary metrics to each group of trials
+
+    with engine='vectorized', the metrics in DISCRIMINATION_METRICS are computed by
+    `discrimination_summary` rather than group-by-group, except those named in
+    `overridden_metrics`, whose functions were supplied by the caller and are applied as given
+    '''
+    if engine not in SUMMARY_ENGINES:
+        raise ValueError('engine must be one of {}, not {}'.format(SUMMARY_ENGINES, engine))
+
+    groupby = list(groupby)
+    if engine == 'apply':
+        return trials.groupby(groupby).apply(create_summarizer(**summary_metrics)).reset_index()
+
+    vectorized_metrics = [
+        metric for metric in DISCRIMINATION_METRICS
+        if metric in summary_metrics and metric not in overridden_metrics
+    ]
+    summary = trials.groupby(groupby).apply(create_summarizer(**{
+        metric: metric_func
+        for metric, metric_func in six.iteritems(summary_metrics)
+        if metric not in vectorized_metrics
+    }))
+    summary = summary.join(discrimination_summary(trials, groupby, **discrimination_kws)[vectorized_metrics])
+
+    summary = summary[list(summary_metrics.keys())]
+    summary.columns.name = 'metrics'
+    return summary.reset_index()
+
+
 def calc_minimum_delta_ori(session_trials):
     '''
     specialized function when a range of delta oris have been displayed
@@ -85,8 +195,11 @@ DEFAULT_SUMMARY_METRICS = dict(
 )
 
 
-def session_level_summary(trials, groupby=('mouse_id', 'behavior_session_uuid', 'startdatetime'), apply_trial_number_limit=False, **kwargs):
+def session_level_summary(trials, groupby=('mouse_id', 'behavior_session_uuid', 'startdatetime'), apply_trial_number_limit=False, engine='apply', **kwargs):
     """ computes session-level summary table
+
+    engine='vectorized' computes the discrimination metrics from per-group trial counts
+    instead of recomputing them group-by-group, see `discrimination_summary`
     """
 
     summary_metrics = DEFAULT_SUMMARY_METRICS.copy()
@@ -100,32 +213,36 @@ def session_level_summary(trials, groupby=('mouse_id', 'behavior_session_uuid',
     summary_metrics.update(trial_number_dependent_metrics)
 
     summary_metrics.update(kwargs)
-    summarizer = create_summarizer(**summary_metrics)
 
     trials = annotate_change_detect(trials)
+    trials = annotate_trial_description(trials)
 
     # print('calling label_auto_rewards')
     # trials = label_auto_rewards(trials)
     # print(trials.trial_type.unique())
 
-    session_summary = (
-        trials
-        .groupby(list(groupby))
-        .apply(summarizer)
-        .reset_index()
+    session_summary = summarize_groups(
+        trials,
+        groupby,
+        summary_metrics,
+        engine=engine,
+        overridden_metrics=kwargs.keys(),
+        apply_trial_number_limit=apply_trial_number_limit,
     )
 
     return session_summary
 
 
-def epoch_level_summary(trials, epoch_length=10.0, apply_trial_number_limit=False, clip_vals=[0, 1], **kwargs):
+def epoch_level_summary(trials, epoch_length=10.0, apply_trial_number_limit=False, clip_vals=[0, 1], engine='apply', **kwargs):
     '''
     clip_vals ensures that hit and false alarm rates cannot exceed set limits (defaults to [0,1], which will have no effect)
+    engine='vectorized' computes the discrimination metrics from per-group trial counts, see `discrimination_summary`
     '''
     trials = annotate_change_detect(trials)
+    trials = annotate_trial_description(trials)
     trials = annotate_epochs(trials, epoch_length)
 
-    summarizer = create_summarizer(
+    summary_metrics = dict(
         num_contingent_trials=session_metrics.num_contingent_trials,
         response_bias=lambda grp: session_metrics.response_bias(grp, 'detect'),
         discrim_p=lambda grp: session_metrics.discrim(grp, 'change', 'detect', metric=metrics.discrim_p),
@@ -143,11 +260,14 @@ def epoch_level_summary(trials, epoch_length=10.0, apply_trial_number_limit=Fals
         **kwargs
     )
 
-    epoch_summary = (
-        trials
-        .groupby(['mouse_id', 'behavior_session_uuid', 'startdatetime', 'epoch'])
-        .apply(summarizer)
-        .reset_index()
+    epoch_summary = summarize_groups(
+        trials,
+        ['mouse_id', 'behavior_session_uuid', 'startdatetime', 'epoch'],
+        summary_metrics,
+        engine=engine,
+        overridden_metrics=kwargs.keys(),
+        apply_trial_number_limit=apply_trial_number_limit,
+        clip_vals=clip_vals,
     )
 
     epoch_summary['mean(HR,FA)'] = (
@@ -3,6 +3,7 @@ import h5py
 import warnings
 import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 from allensdk.internal.api import PostgresQueryMixin
@@ -1419,6 +1420,47 @@ def get_well_known_file_path(wellKnownFileName, attachable_id):
     return filepath
 
 
+def get_well_known_file_paths(wellKnownFileName, attachable_ids):
+    """gets the filepaths for one type of well known file for many attachable_ids
+    with a single query
+
+    Parameters
+    ----------
+    wellKnownFileName : string
+        well known file name, in quotes, e.g. "'DemixedTracesFile'"
+    attachable_ids : list
+        ids that the well known files can be identified by
+
+    Returns
+    -------
+    dictionary
+        attachable_id: filepath, for the attachable_ids that have the well known file
+    """
+    attachable_ids = [int(attachable_id) for attachable_id in attachable_ids]
+    if len(attachable_ids) == 0:
+        return {}
+    query = '''
+    SELECT
+    wkf.attachable_id,
+    wkf.storage_directory || wkf.filename
+    AS filepath
+
+    FROM
+    well_known_files wkf
+
+    JOIN well_known_file_types wkft
+    ON wkft.id = wkf.well_known_file_type_id
+
+    WHERE
+    wkft.name = {}
+    AND wkf.attachable_id IN ({})
+    '''.format(wellKnownFileName, ','.join(str(attachable_id) for attachable_id in attachable_ids))
+
+    filepaths = mixin.select(query)
+    return {int(attachable_id): utils.correct_filepath(filepath)
+            for attachable_id, filepath in zip(filepaths['attachable_id'], filepaths['filepath'])}
+
+
 # FOR ISI EXPERIMENT ID
 def get_isi_experiment_filepath(isi_experiment_id):
     conditions.validate_id_type(isi_experiment_id, "isi_experiment_id")
@@ -1830,34 +1872,135 @@ def get_cell_matching_output_filepath(ophys_container_id):
 ### WELL KNOWN FILES ###      # noqa: E303, E266
 
 
-def load_demixed_traces_array(ophys_experiment_id):
+# well known file names for the h5 trace files of an ophys experiment
+TRACE_FILE_NAMES = {
+    'roi': "'OphysRoiTraces'",
+    'neuropil': "'OphysNeuropilTraces'",
+    'demixed': "'DemixedTracesFile'",
+    'dff': "'OphysDffTraceFile'",
+}
+
+
+def read_traces_from_h5(filepath, cell_roi_ids=None, frames=None):
+    """reads traces from a trace h5 file (roi, neuropil, demixed or dff traces),
+        reading only the rows for the requested cell_roi_ids and the requested frames from disk
+
+        Arguments:
+            filepath {str} -- path to trace h5 file with 'data' and 'roi_names' datasets
+            cell_roi_ids {list} -- cell_roi_ids to read, in the order they should be returned.
+                                    ids that are not in the file are ignored. If None, reads all rois
+            frames {slice} -- frames to read, for example slice(0, 1000). If None, reads all frames
+
+        Returns:
+            cell_roi_ids -- array of the cell_roi_ids for each row of traces_array
+            traces_array -- mxn array where m = rois and n = time
+        """
+    if frames is None:
+        frames = slice(None)
+    with h5py.File(filepath, 'r') as f:
+        roi_names = np.array([int(roi_name) for roi_name in f['roi_names'][()]])
+        if cell_roi_ids is None:
+            return roi_names, f['data'][:, frames]
+        row_for_roi = {roi_name: row for row, roi_name in enumerate(roi_names)}
+        cell_roi_ids = np.array([int(cell_roi_id) for cell_roi_id in cell_roi_ids if int(cell_roi_id) in row_for_roi], dtype=int)
+        rows = np.array([row_for_roi[cell_roi_id] for cell_roi_id in cell_roi_ids], dtype=int)
+        if len(rows) == 0:
+            return cell_roi_ids, np.empty((0,) + f['data'][0, frames].shape, dtype=f['data'].dtype)
+        # h5py selections must be in increasing order, so read the unique sorted rows then put them in the requested order
+        unique_rows, order = np.unique(rows, return_inverse=True)
+        traces_array = f['data'][unique_rows, frames]
+    return cell_roi_ids, traces_array[order]
+
+
+def load_traces_for_ophys_experiment_ids(ophys_experiment_ids, trace_type='demixed', cell_roi_ids=None, frames=None, n_workers=8):
+    """loads traces for many experiments from their LIMS well known trace files.
+        all filepaths are found with one query, then files are read concurrently,
+        reading only the requested cells and frames from each file
+
+        Arguments:
+            ophys_experiment_ids {list} -- 9 digit ophys experiment IDs
+            trace_type {str} -- one of 'roi', 'neuropil', 'demixed' or 'dff'
+            cell_roi_ids {list or dict} -- cell_roi_ids to load. either a list, in which case the ids present in each experiment
+                                            are loaded, or a dictionary of ophys_experiment_id: list of cell_roi_ids.
+                                            If None, all rois are loaded
+            frames {slice} -- frames to load. If None, all frames are loaded
+            n_workers {int} -- number of files to read at the same time
+
+        Returns:
+            dictionary -- ophys_experiment_id: (cell_roi_ids, traces_array) for each experiment that could be loaded
+        """
+    filepaths = get_well_known_file_paths(TRACE_FILE_NAMES[trace_type], ophys_experiment_ids)
+    for ophys_experiment_id in ophys_experiment_ids:
+        if int(ophys_experiment_id) not in filepaths:
+            print('no {} traces file for ophys_experiment_id {}'.format(trace_type, ophys_experiment_id))
+
+    def get_cell_roi_ids(ophys_experiment_id):
+        if isinstance(cell_roi_ids, dict):
+            return cell_roi_ids.get(ophys_experiment_id, [])
+        return cell_roi_ids
+
+    traces = {}
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = {executor.submit(read_traces_from_h5, filepath, get_cell_roi_ids(ophys_experiment_id), frames): ophys_experiment_id
+                   for ophys_experiment_id, filepath in filepaths.items()}
+        for future in as_completed(futures):
+            ophys_experiment_id = futures[future]
+            try:
+                traces[ophys_experiment_id] = future.result()
+            except Exception as e:
+                print('could not load {} traces for ophys_experiment_id {}'.format(trace_type, ophys_experiment_id))
+                print(e)
+    return {int(ophys_experiment_id): traces[int(ophys_experiment_id)] for ophys_experiment_id in ophys_experiment_ids
+            if int(ophys_experiment_id) in traces}
+
+
+def _read_traces_for_cell_roi_ids(filepath, cell_roi_ids):
+    """reads the rows of a trace h5 file for cell_roi_ids, in the requested order,
+        raising a ValueError if any of them are not in the file so that rows always line up with cell_roi_ids
+    """
+    found_cell_roi_ids, traces_array = read_traces_from_h5(filepath, cell_roi_ids)
+    missing_cell_roi_ids = sorted(set(int(cell_roi_id) for cell_roi_id in cell_roi_ids) - set(found_cell_roi_ids))
+    if len(missing_cell_roi_ids) > 0:
+        raise ValueError('cell_roi_ids {} are not in {}'.format(missing_cell_roi_ids, filepath))
+    return traces_array
+
+
+def load_demixed_traces_array(ophys_experiment_id, cell_roi_ids=None):
     """use SQL and the LIMS well known file system to find and load
             "demixed_traces.h5" then return the traces as an array
 
         Arguments:
             ophys_experiment_id {int} -- 9 digit ophys experiment ID
+            cell_roi_ids {list} -- if provided, only these rois are read from the file, in this order.
+                                    raises a ValueError if any of them are not in the file
 
         Returns:
             demixed_traces_array -- mxn array where m = rois and n = time
         """
     filepath = get_demixed_traces_filepath(ophys_experiment_id)
+    if cell_roi_ids is not None:
+        return _read_traces_for_cell_roi_ids(filepath, cell_roi_ids)
     demix_file = h5py.File(filepath, 'r')
     demixed_traces_array = np.asarray(demix_file['data'])
     demix_file.close()
     return demixed_traces_array
 
 
-def load_neuropil_traces_array(ophys_experiment_id):
+def load_neuropil_traces_array(ophys_experiment_id, cell_roi_ids=None):
     """use SQL and the LIMS well known file system to find and load
             "neuropil_traces.h5" then return the traces as an array
 
         Arguments:
             ophys_experiment_id {int} -- 9 digit ophys experiment ID
+            cell_roi_ids {list} -- if provided, only these rois are read from the file, in this order.
+                                    raises a ValueError if any of them are not in the file
 
         Returns:
             neuropil_traces_array -- mxn array where m = rois and n = time
         """
     filepath = get_neuropil_traces_filepath(ophys_experiment_id)
+    if cell_roi_ids is not None:
+        return _read_traces_for_cell_roi_ids(filepath, cell_roi_ids)
     f = h5py.File(filepath, 'r')
     neuropil_traces_array = np.asarray(f['data'])
     f.close()
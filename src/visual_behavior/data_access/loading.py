@@ -10,7 +10,10 @@ from visual_behavior.data_access import from_lims
 import visual_behavior.database as db
 
 import os
+import sys
 import glob
+from collections import OrderedDict
+from contextlib import contextmanager
 import h5py  # for loading motion corrected movie
 import numpy as np
 import pandas as pd
@@ -882,8 +885,193 @@ class BehaviorOphysDataset(BehaviorOphysExperiment):
         return cell_specimen_id
 
 
+# LRU CACHE OF LOADED OPHYS DATASETS #
+
+# default memory budget for datasets kept by get_ophys_dataset within cache_ophys_datasets, in bytes
+OPHYS_DATASET_CACHE_MAX_BYTES = 4e9
+
+
+def _get_cell_nbytes(cell):
+    if isinstance(cell, np.ndarray):
+        return int(cell.nbytes)
+    return sys.getsizeof(cell)
+
+
+def get_dataframe_nbytes(df):
+    """
+    Memory footprint of a dataframe or series, counting the contents of object columns,
+    such as the per-cell arrays of the dff_traces and events tables, rather than only their pointers.
+
+    :param df: dataframe or series
+    :return: size in bytes
+    """
+    if isinstance(df, pd.Series):
+        df = df.to_frame()
+    nbytes = int(df.index.memory_usage(deep=True))
+    for column_index in range(df.shape[1]):
+        column = df.iloc[:, column_index]
+        nbytes += int(column.memory_usage(index=False, deep=False))
+        if column.dtype == object:
+            nbytes += sum(_get_cell_nbytes(cell) for cell in column.values)
+    return nbytes
+
+
+def get_object_nbytes(obj, max_depth=4, _seen=None):
+    """
+    Estimates the memory footprint of an object by summing the size of the dataframes, series and arrays
+    it holds, following attributes, dictionaries and lists up to max_depth levels deep.
+    Used to estimate the size of SDK dataset objects, which load and hold data tables lazily as they are accessed.
+
+    :param obj: object to estimate the size of
+    :param max_depth: number of levels of nested attributes to follow
+    :return: estimated size in bytes
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return get_dataframe_nbytes(obj)
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if max_depth <= 0 or isinstance(obj, (str, bytes, int, float, bool, type(None))):
+        return 0
+    if isinstance(obj, dict):
+        children = obj.values()
+    elif isinstance(obj, (list, tuple, set)):
+        children = obj
+    elif hasattr(obj, '__dict__'):
+        children = vars(obj).values()
+    else:
+        return 0
+    return sum(get_object_nbytes(child, max_depth - 1, _seen) for child in children)
+
+
+class OphysDatasetCache(object):
+    """
+    Least recently used cache of dataset objects, bounded by their estimated memory footprint.
+    The size of a dataset is re-estimated whenever it is accessed through the cache, because SDK datasets
+    hold on to data tables as they are loaded. Sizes of the other cached datasets are kept from their last access.
+    """
+
+    def __init__(self, max_bytes=OPHYS_DATASET_CACHE_MAX_BYTES):
+        """
+        :param max_bytes: memory budget in bytes, least recently used datasets are dropped when it is exceeded. 0 disables the cache
+        """
+        self.max_bytes = max_bytes
+        self._datasets = OrderedDict()
+        self._nbytes = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self._datasets
+
+    def __len__(self):
+        return len(self._datasets)
+
+    @property
+    def nbytes(self):
+        return sum(self._nbytes.values())
+
+    def get(self, key):
+        """returns the cached dataset for key and marks it as most recently used, or None if it is not cached"""
+        if key not in self._datasets:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._datasets.move_to_end(key)
+        dataset = self._datasets[key]
+        self._nbytes[key] = get_object_nbytes(dataset)
+        self._evict(keep=key)
+        return dataset
+
+    def put(self, key, dataset):
+        if self.max_bytes <= 0:
+            return
+        self._datasets[key] = dataset
+        self._datasets.move_to_end(key)
+        self._nbytes[key] = get_object_nbytes(dataset)
+        self._evict(keep=key)
+
+    def _evict(self, keep=None):
+        # drop least recently used datasets until under budget, never dropping the dataset that was just requested
+        while self.nbytes > self.max_bytes and len(self._datasets) > 1:
+            key = next(iter(self._datasets))
+            if key == keep:
+                break
+            del self._datasets[key]
+            del self._nbytes[key]
+            self.evictions += 1
+
+    def clear(self):
+        self._datasets.clear()
+        self._nbytes.clear()
+
+    def info(self):
+        """returns a dictionary of cache statistics"""
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'n_datasets': len(self._datasets), 'nbytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+
+# cache used by get_ophys_dataset, only set within a cache_ophys_datasets context
+_ophys_dataset_cache = None
+
+
+def get_ophys_dataset_cache_info():
+    """
+    Returns hit, miss and eviction counts for the dataset cache used by get_ophys_dataset,
+    along with the number of datasets currently cached and their estimated size in bytes.
+    Returns None outside of a cache_ophys_datasets context, where datasets are not cached.
+    """
+    if _ophys_dataset_cache is None:
+        return None
+    return _ophys_dataset_cache.info()
+
+
+def clear_ophys_dataset_cache():
+    """Releases all datasets held by the cache of the current cache_ophys_datasets context, if any"""
+    if _ophys_dataset_cache is not None:
+        _ophys_dataset_cache.clear()
+
+
+@contextmanager
+def cache_ophys_datasets(max_bytes=OPHYS_DATASET_CACHE_MAX_BYTES):
+    """
+    Within this context, datasets loaded by get_ophys_dataset are shared by every function that requests them,
+    so that functions that each load the same experiments, such as container QC plots, only load each dataset once.
+    Outside of this context get_ophys_dataset loads a new dataset on every call.
+
+    All callers within the context get the same dataset object, so changes one function makes to a dataset's tables
+    are seen by the others. Copy a table before adding columns to it.
+
+    Cached datasets are released when the context exits. A nested context shares the cache of the enclosing one
+    and leaves it as it is on exit.
+
+    :param max_bytes: memory budget in bytes, least recently used datasets are dropped when it is exceeded.
+                      ignored in a nested context
+
+    Usage:
+        with loading.cache_ophys_datasets():
+            container_plots.plot_running_speed_for_container(ophys_container_id)
+            container_plots.plot_lick_rasters_for_container(ophys_container_id)
+    """
+    global _ophys_dataset_cache
+    if _ophys_dataset_cache is not None:
+        yield _ophys_dataset_cache
+        return
+    _ophys_dataset_cache = OphysDatasetCache(max_bytes=max_bytes)
+    try:
+        yield _ophys_dataset_cache
+    finally:
+        _ophys_dataset_cache.clear()
+        _ophys_dataset_cache = None
+
+
 def get_ophys_dataset(ophys_experiment_id, include_invalid_rois=False, load_from_lims=False, load_from_nwb=True,
-                      get_extended_stimulus_presentations=False, get_behavior_movie_timestamps=False):
+                      get_extended_stimulus_presentations=False, get_behavior_movie_timestamps=False, use_cache=True):
     """
     Gets behavior + ophys data for one experiment (single imaging plane), either using the SDK LIMS API,
     SDK NWB API, or using BehaviorOphysDataset wrapper which inherits the LIMS API BehaviorOphysSession object,
@@ -895,12 +1083,21 @@ def get_ophys_dataset(ophys_experiment_id, include_invalid_rois=False, load_from
         load_from_lims -- if True, loads dataset directly from BehaviorOphysSession.from_lims(). Invalid ROIs will be included.
         load_from_nwb -- if True, loads dataset directly from BehaviorOphysSession.from_nwb_path(). Invalid ROIs will not be included.
         get_extended_stimulus_presentations -- if True, adds an attribute "extended_stimulus_presentations" to the dataset object
+        use_cache -- if True and called within a cache_ophys_datasets context, returns the dataset object loaded
+                        earlier in the context for the same arguments if it is still cached. Has no effect outside of the context
 
         If both from_lims and from_nwb are set to False, an exception will be raised
 
     Returns:
         object -- BehaviorOphysSession or BehaviorOphysDataset instance, which inherits attributes & methods from SDK BehaviorOphysSession
     """
+    cache_key = (int(ophys_experiment_id), include_invalid_rois, load_from_lims, load_from_nwb,
+                 get_extended_stimulus_presentations, get_behavior_movie_timestamps)
+    cache = _ophys_dataset_cache if use_cache else None
+    if cache is not None:
+        dataset = cache.get(cache_key)
+        if dataset is not None:
+            return dataset
 
     id_type = from_lims.get_id_type(ophys_experiment_id)
     if id_type != 'ophys_experiment_id':
@@ -929,6 +1126,8 @@ def get_ophys_dataset(ophys_experiment_id, include_invalid_rois=False, load_from
         timestamps = utilities.get_timestamps(lims_data)
         dataset.behavior_movie_timestamps = timestamps['behavior_monitoring']['timestamps'].copy()
 
+    if cache is not None:
+        cache.put(cache_key, dataset)
     return dataset
 
 
@@ -1375,11 +1574,8 @@ def get_sdk_roi_masks(cell_specimen_table):
     """
 
     roi_masks = {}
-    for cell_roi_id in cell_specimen_table.cell_roi_id.values:
-        mask = cell_specimen_table[cell_specimen_table.cell_roi_id == cell_roi_id]['roi_mask'].values[0]
-        binary_mask = np.zeros(mask.shape)
-        binary_mask[mask == True] = 1
-        roi_masks[cell_roi_id] = binary_mask
+    for cell_roi_id, mask in zip(cell_specimen_table.cell_roi_id.values, cell_specimen_table['roi_mask'].values):
+        roi_masks[cell_roi_id] = (np.asarray(mask) == True).astype(float)
     return roi_masks
 
 
@@ -1387,12 +1583,12 @@ def get_segmentation_mask(ophys_experiment_id, valid_only=True):
     dataset = get_ophys_dataset(ophys_experiment_id, include_invalid_rois=True)
     cell_specimen_table = dataset.cell_specimen_table.copy()
     if valid_only:
-        roi_masks = get_sdk_roi_masks(cell_specimen_table[cell_specimen_table.valid_roi == True])
-    else:
-        roi_masks = get_sdk_roi_masks(cell_specimen_table)
+        cell_specimen_table = cell_specimen_table[cell_specimen_table.valid_roi == True]
     # flatten
-    segmentation_mask = np.sum(np.asarray(list(roi_masks.values())), axis=0)
-    segmentation_mask[segmentation_mask > 0] = 1
+    roi_masks = cell_specimen_table['roi_mask'].values
+    shape = np.asarray(roi_masks[0]).shape
+    masks_csr = utilities.get_roi_masks_csr(roi_masks, shape=shape)
+    segmentation_mask = (utilities.get_roi_count_image(masks_csr, shape) > 0).astype(float)
     return segmentation_mask
 
 
@@ -1,9 +1,12 @@
 from visual_behavior.data_access import loading as data_loading
+from visual_behavior.data_access import utilities
 
+import os
 import itertools
 import numpy as np
 import pandas as pd
 import scipy.stats as stats
+from collections import OrderedDict
 from functools import reduce
 
 # csid = cell_specimen_id
@@ -632,7 +635,10 @@ def shift_image_masks(dataframe):
     """takes a dataframe with cell specimen or roi information, and specifically
         the columns "image_mask", "x"(bbox_min_x), "y"(bbox_min_y) and shifts the
         image masks so they reflect where the ROI/Cell is within the imaging
-        FOV, adding the shifted FOV as a new column "roi_mask" to preserve the original masks
+        FOV, adding the shifted FOV as a new column "roi_mask" to preserve the original masks.
+        all masks are shifted at once through a sparse pixel matrix, see utilities.get_roi_masks_csr,
+        with the same wrap around at the edges of the FOV as shift_mask_by_row.
+        image masks must all have the shape of the FOV
 
     Arguments:
         dataframe {[type]} -- [description]
@@ -641,7 +647,14 @@ def shift_image_masks(dataframe):
         [type] -- [description]
     """
     dataframe["roi_mask"] = None
-    dataframe.loc[:, "roi_mask"] = dataframe.apply(shift_mask_by_row, axis=1)
+    image_masks = [np.asarray(mask) for mask in dataframe["image_mask"].values]
+    if len(image_masks) == 0:
+        return dataframe
+    shape = image_masks[0].shape
+    offsets = list(zip(dataframe["x"].values, dataframe["y"].values))
+    masks_csr = utilities.get_roi_masks_csr(image_masks, shape=shape, offsets=offsets)
+    for i, index in enumerate(dataframe.index):
+        dataframe.at[index, "roi_mask"] = masks_csr[i].toarray().reshape(shape).astype(image_masks[i].dtype)
     return dataframe
 
 
@@ -673,16 +686,20 @@ def shift_mask_by_row(row, col="image_mask"):
 
 def gen_multi_mask_bool(shifted_image_masks_array):
     """takes a 3d array with the shifted image masks (z,x,y) and sums them
-        over z such that the 2d array it produces has all the rois
+        over z such that the 2d array it produces has all the rois.
+        masks are combined as a sparse matrix so no 3d array is allocated
 
     Arguments:
-        shifted_image_masks_array {array} -- [description]
+        shifted_image_masks_array {array} -- 3d array, or list of 2d masks, of shifted image masks
 
     Returns:
-        array -- [description]
+        array -- number of rois covering each pixel
     """
-
-    multi_mask_bool = np.sum(shifted_image_masks_array, 0)
+    if len(shifted_image_masks_array) == 0:
+        return np.zeros((0, 0), dtype=int)
+    shape = np.asarray(shifted_image_masks_array[0]).shape
+    masks_csr = utilities.get_roi_masks_csr(shifted_image_masks_array, shape=shape)
+    multi_mask_bool = utilities.get_roi_count_image(masks_csr, shape)
     return multi_mask_bool
 
 
@@ -723,11 +740,27 @@ def gen_transparent_multi_roi_mask(shifted_image_masks_array):
         2d array -- 2d array the size of the imaging FOV for a single
                     ophys experiment FOV
     """
-    multi_mask_bool = gen_multi_mask_bool(shifted_image_masks_array)
+    multi_mask_bool = gen_multi_mask_bool(shifted_image_masks_array) > 0
     multi_mask_binary = change_mask_from_bool_to_binary(multi_mask_bool)
     return multi_mask_binary
 
 
+def gen_transparent_roi_outlines(roi_masks):
+    """outlines of all rois in a single image, 1 on the outer pixels of each roi and nan elsewhere,
+        so that all outlines can be drawn with a single imshow instead of one contour per roi
+
+    Arguments:
+        roi_masks {list} -- full FOV roi masks, such as the SDK cell_specimen_table 'roi_mask' column
+
+    Returns:
+        2d array -- 2d array the size of the imaging FOV
+    """
+    roi_masks = list(roi_masks)
+    shape = np.asarray(roi_masks[0]).shape
+    label_image = utilities.get_roi_label_image(utilities.get_roi_masks_csr(roi_masks, shape=shape), shape)
+    return change_mask_from_bool_to_binary(utilities.get_roi_outline_image(label_image))
+
+
 def gen_transparent_validity_masks(ophys_experiment_id):
     """uses the sdk cell_specimen_table and returns a dataframe with
         a single transparent mask for the all the valid cells
@@ -743,7 +776,6 @@ def gen_transparent_validity_masks(ophys_experiment_id):
                     "transparent_mask"
     """
     sdk_cell_table = data_loading.get_sdk_cell_specimen_table(ophys_experiment_id)
-    sdk_cell_table = shift_image_masks(sdk_cell_table)
 
     validity_masks_df = pd.DataFrame()
     for TF in sdk_cell_table["valid_roi"].unique():
@@ -994,6 +1026,156 @@ def container_snr_summary_table(ophys_container_id):
 # PHYSIO FOV AND INTENSITY (EXP AND CONTAINER)
 
 
+# summaries computed from each motion corrected movie, keyed by (ophys_experiment_id, subsample, full_resolution),
+# least recently used first. only the most recent MOTION_CORRECTED_MOVIE_SUMMARIES_MAX_ENTRIES are kept
+MOTION_CORRECTED_MOVIE_SUMMARIES_MAX_ENTRIES = 32
+_motion_corrected_movie_summaries = OrderedDict()
+
+
+def _get_cached_movie_summary(key):
+    if key not in _motion_corrected_movie_summaries:
+        return None
+    _motion_corrected_movie_summaries.move_to_end(key)
+    return _motion_corrected_movie_summaries[key]
+
+
+def _cache_movie_summary(key, summary):
+    _motion_corrected_movie_summaries[key] = summary
+    _motion_corrected_movie_summaries.move_to_end(key)
+    while len(_motion_corrected_movie_summaries) > MOTION_CORRECTED_MOVIE_SUMMARIES_MAX_ENTRIES:
+        _motion_corrected_movie_summaries.popitem(last=False)
+
+
+def _get_movie_summary_cache_path(cache_dir, ophys_experiment_id, subsample, full_resolution):
+    filename = '{}_motion_corrected_movie_summary_every_{}'.format(ophys_experiment_id, subsample)
+    if full_resolution:
+        filename = filename + '_full_resolution'
+    return os.path.join(cache_dir, filename + '.npz')
+
+
+def get_motion_corrected_movie_summary(ophys_experiment_id, subsample=500, full_resolution=False,
+                                       block_size=1000, cache_dir=None):
+    """reads the motion corrected movie once, in blocks of frames,
+        and computes all summaries of the movie used for QC in a single pass.
+        summaries of the most recently used experiments are cached in memory
+        (see MOTION_CORRECTED_MOVIE_SUMMARIES_MAX_ENTRIES), and on disk
+        in cache_dir if provided, so the movie is only read once.
+
+        every subsample-th frame is used for the average and max FOV
+        and the average intensity timeseries. the average intensity of each
+        of those frames is the mean of the inner portion of the frame
+        so as not to have any border motion artifacts
+
+    Arguments:
+        ophys_experiment_id {int} -- 9 digit ophys experiment ID
+
+    Keyword Arguments:
+        subsample {int} -- use every subsample-th frame for subsampled summaries (default: {500})
+        full_resolution {bool} -- also compute the mean and standard deviation
+                                  of every pixel across all frames. this reads every frame
+                                  of the movie, in blocks aligned to the hdf5 chunks (default: {False})
+        block_size {int} -- approximate number of frames read at a time when
+                            full_resolution is True (default: {1000})
+        cache_dir {str} -- directory to save and load summaries in (default: {None})
+
+    Returns:
+        dictionary -- with the following keys:
+                    "frame_numbers": frame numbers of subsampled frames
+                    "average_intensity": average intensity of each subsampled frame
+                    "average_FOV": 2d average of subsampled frames
+                    "max_FOV": 2d max of subsampled frames
+                    "mean_FOV": 2d mean of all frames (only if full_resolution)
+                    "std_FOV": 2d standard deviation of all frames (only if full_resolution)
+    """
+    key = (ophys_experiment_id, subsample, full_resolution)
+    summary = _get_cached_movie_summary(key)
+    if summary is None:
+        # a full resolution summary also contains all subsampled summaries
+        summary = _get_cached_movie_summary((ophys_experiment_id, subsample, True))
+    if summary is not None:
+        return summary
+    if cache_dir is not None:
+        cache_path = _get_movie_summary_cache_path(cache_dir, ophys_experiment_id, subsample, full_resolution)
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                summary = {name: cached[name] for name in cached.files}
+            _cache_movie_summary(key, summary)
+            return summary
+
+    motion_corrected_movie_array = data_loading.load_motion_corrected_movie(ophys_experiment_id)
+    n_frames = motion_corrected_movie_array.shape[0]
+    frame_numbers = np.arange(0, n_frames, subsample)
+
+    if full_resolution:
+        # read blocks of whole hdf5 chunks along the frame axis
+        chunk_frames = motion_corrected_movie_array.chunks[0] if motion_corrected_movie_array.chunks else 1
+        frames_per_block = max(1, int(np.ceil(block_size / chunk_frames))) * chunk_frames
+    else:
+        # only every subsample-th frame is read
+        frames_per_block = max(1, block_size // subsample) * subsample
+
+    average_intensity = []
+    subsampled_sum = None
+    max_FOV = None
+    n_total = 0
+    mean_FOV = None
+    sum_sq_FOV = None
+    for start in range(0, n_frames, frames_per_block):
+        stop = min(start + frames_per_block, n_frames)
+        if full_resolution:
+            block = motion_corrected_movie_array[start:stop]
+            subset = block[(np.arange(start, stop) % subsample) == 0]
+            # combine running mean and sum of squared differences with those of this block
+            block_n = block.shape[0]
+            block_mean = np.mean(block, axis=0, dtype=np.float64)
+            block_sum_sq = np.sum((block - block_mean) ** 2, axis=0)
+            if mean_FOV is None:
+                mean_FOV = block_mean
+                sum_sq_FOV = block_sum_sq
+            else:
+                delta = block_mean - mean_FOV
+                total = n_total + block_n
+                mean_FOV = mean_FOV + delta * block_n / total
+                sum_sq_FOV = sum_sq_FOV + block_sum_sq + delta ** 2 * n_total * block_n / total
+            n_total += block_n
+        else:
+            first = int(np.ceil(start / subsample)) * subsample
+            subset = motion_corrected_movie_array[first:stop:subsample]
+        if subset.shape[0] == 0:
+            continue
+        # takes the mean across both x & y to get a single number for the frame
+        average_intensity.append(np.mean(subset[:, 100:400, 50:400], axis=(1, 2)))
+        subset_sum = np.sum(subset, axis=0, dtype=np.float64)
+        subset_max = np.amax(subset, axis=0)
+        if subsampled_sum is None:
+            subsampled_sum = subset_sum
+            max_FOV = subset_max
+        else:
+            subsampled_sum += subset_sum
+            max_FOV = np.maximum(max_FOV, subset_max)
+
+    summary = {"frame_numbers": frame_numbers,
+               "average_intensity": np.concatenate(average_intensity),
+               "average_FOV": subsampled_sum / len(frame_numbers),
+               "max_FOV": max_FOV}
+    if full_resolution:
+        summary["mean_FOV"] = mean_FOV
+        summary["std_FOV"] = np.sqrt(sum_sq_FOV / n_total)
+
+    _cache_movie_summary(key, summary)
+    if cache_dir is not None:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        np.savez(cache_path, **summary)
+    return summary
+
+
+def clear_motion_corrected_movie_summaries():
+    """removes all motion corrected movie summaries cached in memory
+    """
+    _motion_corrected_movie_summaries.clear()
+
+
 def get_experiment_average_intensity_timeseries(ophys_experiment_id):
     """uses the LIMS wkf system to get the filepath for the
         motion_corrected_movie.h5 file Then loads the file
@@ -1013,17 +1195,8 @@ def get_experiment_average_intensity_timeseries(ophys_experiment_id):
         frame_numbers -- array of frame numbers the frame intensitites
                             were calculated for
     """
-    motion_corrected_movie_array = data_loading.load_motion_corrected_movie(ophys_experiment_id)
-
-    subset = motion_corrected_movie_array[::500, 100:400, 50:400]
-
-    # takes the mean across both x & y to get a single number for the frame
-    average_intensity = np.mean(subset, axis=(1, 2))
-
-    frame_numbers = np.arange(0, motion_corrected_movie_array.shape[0])
-    frame_numbers = frame_numbers[::500]
-
-    return average_intensity, frame_numbers
+    summary = get_motion_corrected_movie_summary(ophys_experiment_id)
+    return summary["average_intensity"], summary["frame_numbers"]
 
 
 def experiment_average_FOV_from_motion_corrected_movie(ophys_experiment_id):
@@ -1036,10 +1209,7 @@ def experiment_average_FOV_from_motion_corrected_movie(ophys_experiment_id):
     Returns:s
         2d array   -- 2d array thats the average of the motion corrected FOV
     """
-    motion_corrected_movie_array = data_loading.load_motion_corrected_movie(ophys_experiment_id)
-    subset = motion_corrected_movie_array[::500, :, :]
-    average_FOV = np.mean(subset, axis=0)
-    return average_FOV
+    return get_motion_corrected_movie_summary(ophys_experiment_id)["average_FOV"]
 
 
 def experiment_max_FOV_from_motion_corrected_movie(ophys_experiment_id):
@@ -1052,10 +1222,7 @@ def experiment_max_FOV_from_motion_corrected_movie(ophys_experiment_id):
     Returns:
         2d array   -- 2d array thats the average of the motion corrected FOV
     """
-    motion_corrected_movie_array = data_loading.load_motion_corrected_movie(ophys_experiment_id)
-    subset = motion_corrected_movie_array[::500, :, :]
-    max_FOV = np.amax(subset, axis=0)
-    return max_FOV
+    return get_motion_corrected_movie_summary(ophys_experiment_id)["max_FOV"]
 
 
 def experiment_intensity_mean_and_std(ophys_experiment_id):
@@ -1978,3 +1978,68 @@ def annotate_epoch_df(epoch_df):
     epoch_df['experience_epoch'] = epoch_df[['experience_level', 'epoch']].apply(axis=1, func=merge_experience_epoch)
 
     return epoch_df
+
+
+# ROI MASKS #
+
+
+def get_roi_masks_csr(masks, shape=None, offsets=None):
+    """
+    converts a list of ROI masks into a sparse matrix with one row per ROI and one column per pixel of the FOV,
+    so that all masks for an experiment can be combined without allocating a full FOV array per ROI
+
+    :param masks: list or array of 2D boolean ROI masks, either full FOV masks (such as SDK cell_specimen_table 'roi_mask')
+                    or masks that are shifted into place by offsets
+    :param shape: (height, width) of the FOV, defaults to the shape of the first mask
+    :param offsets: optional list of (x, y) offsets to roll each mask by, as in processing.shift_mask_by_row.
+                    pixels that are rolled past the edge of the FOV wrap around, like np.roll
+    :return: scipy.sparse.csr_matrix of shape (n_rois, height * width) with True for each pixel in each ROI
+    """
+    from scipy import sparse
+    masks = list(masks)
+    if shape is None:
+        shape = np.asarray(masks[0]).shape if len(masks) > 0 else (0, 0)
+    height, width = shape
+    indices = []
+    for i, mask in enumerate(masks):
+        rows, cols = np.nonzero(np.asarray(mask))
+        if offsets is not None:
+            x, y = offsets[i]
+            rows = (rows + int(y)) % height
+            cols = (cols + int(x)) % width
+        indices.append(rows * width + cols)
+    indptr = np.concatenate([[0], np.cumsum([len(pixels) for pixels in indices])]).astype(np.int64)
+    indices = np.concatenate(indices).astype(np.int64) if len(indices) > 0 else np.array([], dtype=np.int64)
+    data = np.ones(len(indices), dtype=bool)
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(masks), height * width))
+
+
+def get_roi_label_image(masks_csr, shape):
+    """
+    single int32 image of a set of ROI masks, where each pixel holds the 1-based row index in masks_csr of the ROI
+    that covers it, and 0 for background. where ROIs overlap, the ROI with the higher index is shown
+
+    :param masks_csr: sparse matrix of ROI masks from get_roi_masks_csr
+    :param shape: (height, width) of the FOV
+    :return: 2D int32 label image
+    """
+    labels = np.repeat(np.arange(1, masks_csr.shape[0] + 1, dtype=np.int32), np.diff(masks_csr.indptr))
+    label_image = np.zeros(shape[0] * shape[1], dtype=np.int32)
+    label_image[masks_csr.indices] = labels
+    return label_image.reshape(shape)
+
+
+def get_roi_count_image(masks_csr, shape):
+    """image with the number of ROIs covering each pixel, equal to the sum of the full FOV masks"""
+    return np.bincount(masks_csr.indices, minlength=shape[0] * shape[1]).reshape(shape)
+
+
+def get_roi_outline_image(label_image):
+    """
+    boolean image that is True on the outer pixels of each ROI in a label image,
+    meaning ROI pixels with a 4-connected neighbor that belongs to a different ROI or to the background
+    """
+    padded = np.pad(label_image, 1, mode='constant', constant_values=0)
+    center = padded[1:-1, 1:-1]
+    outlines = (center != padded[:-2, 1:-1]) | (center != padded[2:, 1:-1]) | (center != padded[1:-1, :-2]) | (center != padded[1:-1, 2:])
+    return outlines & (label_image > 0)
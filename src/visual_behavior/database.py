@@ -1,4 +1,4 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 import yaml
 import pandas as pd
 import numpy as np
@@ -597,6 +597,23 @@ def update_or_create(collection, document, keys_to_check, force_write=False):
             collection.update_one(query, {"$set": simplify_entry(document)})
 
 
+def update_or_create_many(collection, documents, keys_to_check):
+    '''
+    bulk version of update_or_create: for each document, updates the document matching the keys in `keys_to_check`
+    or inserts it if it does not exist, in a single bulk write
+    '''
+    requests = [
+        UpdateOne(
+            {key: simplify_type(document[key]) for key in keys_to_check},
+            {"$set": simplify_entry(document)},
+            upsert=True,
+        )
+        for document in documents
+    ]
+    if len(requests) > 0:
+        collection.bulk_write(requests, ordered=False)
+
+
 def get_labtracks_id_from_specimen_id(specimen_id, show_warnings=True):
     '''
     for a given mouse:
@@ -1,21 +1,28 @@
 
 import os
 import pickle
+import hashlib
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
 from numpy import linalg as linalg
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from scipy.stats import spearmanr
 from scipy.stats import kruskal
 from scipy.stats import ttest_ind
 from scipy.stats import sem
+from scipy import sparse
 from scipy.sparse import csgraph
+from scipy.sparse.linalg import eigsh
 from scipy.stats import chisquare
 
 from sklearn.metrics import silhouette_score
 from sklearn.metrics import pairwise_distances
 from sklearn.cluster import SpectralClustering
+from sklearn.base import clone
+from sklearn.metrics.pairwise import pairwise_kernels
+from sklearn.neighbors import kneighbors_graph
 
 import visual_behavior.data_access.loading as loading
 import visual_behavior.data_access.utilities as utilities
@@ -505,12 +512,267 @@ def get_feature_matrix_for_cre_line(feature_matrix, cell_metadata, cre_line, dro
     return feature_matrix_cre
 
 
+# bootstrap executor ###
+
+def get_feature_matrix_hash(X):
+    """
+    returns a hash of the values, shape and dtype of a feature matrix, used as a key for cached clustering results
+    """
+    if isinstance(X, pd.DataFrame):
+        X = X.values
+    X = np.ascontiguousarray(X)
+    feature_hash = hashlib.sha1()
+    feature_hash.update(str(X.shape).encode())
+    feature_hash.update(str(X.dtype).encode())
+    feature_hash.update(X.tobytes())
+    return feature_hash.hexdigest()
+
+
+def get_model_params_hash(model):
+    """
+    returns a hash of the parameters of a clustering model, excluding random_state and n_jobs,
+    used as a key for cached clustering results
+    """
+    params = model.get_params()
+    params.pop('random_state', None)
+    params.pop('n_jobs', None)
+    return hashlib.sha1(repr(sorted(params.items())).encode()).hexdigest()
+
+
+def get_affinity_matrix(X, model):
+    """
+    computes the affinity matrix that a SpectralClustering model computes in fit(),
+    so that it can be computed once and passed to repeated fits of a model with affinity='precomputed'
+    :param X: (ndarray) data, n observations by n features
+    :param model: SpectralClustering object
+    :return: affinity matrix, n observations by n observations (sparse if model.affinity is 'nearest_neighbors')
+    """
+    if isinstance(X, pd.DataFrame):
+        X = X.values
+    if model.affinity == 'nearest_neighbors':
+        connectivity = kneighbors_graph(X, n_neighbors=model.n_neighbors, include_self=True, n_jobs=model.n_jobs)
+        affinity_matrix = 0.5 * (connectivity + connectivity.T)
+    elif model.affinity == 'precomputed':
+        affinity_matrix = X
+    else:
+        params = model.kernel_params
+        if params is None:
+            params = {}
+        if not callable(model.affinity):
+            params['gamma'] = model.gamma
+            params['degree'] = model.degree
+            params['coef0'] = model.coef0
+        affinity_matrix = pairwise_kernels(X, metric=model.affinity, filter_params=True, **params)
+    return affinity_matrix
+
+
+def get_affinity_params_hash(model, dtype=None):
+    """
+    returns a hash of the parameters of a SpectralClustering model that determine its affinity matrix,
+    used as a key for cached affinity matrices
+    """
+    params = model.get_params()
+    affinity_params = [(key, params[key]) for key in ['affinity', 'gamma', 'degree', 'coef0', 'kernel_params', 'n_neighbors']]
+    affinity_params.append(('dtype', str(np.dtype(dtype)) if dtype is not None else None))
+    return hashlib.sha1(repr(affinity_params).encode()).hexdigest()
+
+
+def load_affinity_matrix(X, model=SpectralClustering, cache_dir=None, dtype=None):
+    """
+    if an affinity matrix for this feature matrix and model parameters exists in cache_dir, load it,
+    otherwise compute it with get_affinity_matrix and save it to cache_dir.
+    use a model with affinity='nearest_neighbors' to get a sparse k-nearest neighbor affinity matrix
+    the returned matrix can be passed to fits of a model with affinity='precomputed'
+    :param X: (ndarray) data, n observations by n features
+    :param model: SpectralClustering object, default = SpectralClustering with default parameters
+    :param cache_dir: directory to save and load affinity matrices in, if None, the affinity matrix is not cached
+    :param dtype: dtype of the affinity matrix, such as np.float32 to halve memory, if None, dtype is not changed
+    :return: affinity matrix, n observations by n observations, sparse for nearest neighbor affinities,
+            dense matrices loaded from cache are memory mapped read only
+    """
+    if model is SpectralClustering:
+        model = model()
+    if cache_dir is not None:
+        cache_key = 'affinity_' + get_feature_matrix_hash(X) + '_' + get_affinity_params_hash(model, dtype)
+        dense_path = os.path.join(cache_dir, cache_key + '.npy')
+        sparse_path = os.path.join(cache_dir, cache_key + '.npz')
+        if os.path.exists(dense_path):
+            return np.load(dense_path, mmap_mode='r')
+        elif os.path.exists(sparse_path):
+            return sparse.load_npz(sparse_path)
+
+    affinity_matrix = get_affinity_matrix(X, model)
+    if dtype is not None:
+        affinity_matrix = affinity_matrix.astype(dtype)
+
+    if cache_dir is not None:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        if sparse.issparse(affinity_matrix):
+            sparse.save_npz(sparse_path, affinity_matrix.tocsr())
+        else:
+            np.save(dense_path, affinity_matrix)
+    return affinity_matrix
+
+
+# model and data used by bootstrap worker processes, set once per process by _init_bootstrap_worker
+_bootstrap_worker_data = {}
+
+
+def _init_bootstrap_worker(model, X):
+    _bootstrap_worker_data['model'] = model
+    _bootstrap_worker_data['X'] = X
+
+
+def _fit_labels_for_seed(n_clusters, seed, model=None, X=None):
+    """
+    fits a copy of the model with the given number of clusters and random seed, and returns the labels
+    if model and X are not provided, uses the model and data set for this worker process
+    """
+    if model is None:
+        model = _bootstrap_worker_data['model']
+        X = _bootstrap_worker_data['X']
+    model = clone(model)
+    params = model.get_params()
+    if 'n_clusters' in params:
+        model.set_params(n_clusters=n_clusters)
+    if 'random_state' in params:
+        model.set_params(random_state=seed)
+    md = model.fit(X)
+    try:
+        labels = md.labels_
+    except AttributeError:
+        labels = md
+    return n_clusters, seed, np.asarray(labels)
+
+
+def _get_bootstrap_cache_path(cache_dir, cache_key, n_clusters, seed):
+    return os.path.join(cache_dir, cache_key + '_k' + str(n_clusters) + '_seed' + str(seed) + '.npy')
+
+
+def iterate_bootstrap_fits(X, model=SpectralClustering, n_clusters=8, seeds=np.arange(100), n_jobs=1,
+                           precompute_affinity=True, affinity_matrix=None, cache_dir=None):
+    '''
+    Runs independent fits of a clustering model on the same data, one for each combination of n_clusters and seed,
+    and yields labels for each fit as it finishes. Each fit uses its seed as the model random_state,
+    so results are reproducible regardless of the number of workers or order of completion.
+
+    :param X: (ndarray) data, n observations by n features
+    :param model: (clustering object) default = SpectralClustering; clustering method to use. The model is not modified.
+    :param n_clusters: (num or list) number of clusters, or list of numbers of clusters, to fit.
+                        If None, the n_clusters of the model is used.
+    :param seeds: (list or an array) random seeds, one per repeat
+    :param n_jobs: (int) default = 1, number of worker processes; 1 runs fits in this process, None or -1 uses all CPUs
+    :param precompute_affinity: (bool) default = True, for SpectralClustering, compute the affinity matrix once
+                        and reuse it across all fits
+    :param affinity_matrix: (ndarray) default = None, precomputed affinity matrix for X to use for all fits
+    :param cache_dir: (str) default = None, directory to cache labels in, keyed by feature matrix hash,
+                        model parameters, n_clusters and seed. Cached fits are loaded instead of being recomputed.
+                        The affinity matrix is also cached here, see load_affinity_matrix.
+    ___________
+    :yield: (n_clusters, seed, labels) for each fit
+    '''
+    if model is SpectralClustering:
+        model = model()
+    if isinstance(X, pd.DataFrame):
+        X = X.values
+    if n_clusters is None:
+        n_clusters = model.n_clusters
+    tasks = [(int(k), int(seed)) for k in np.atleast_1d(n_clusters) for seed in seeds]
+
+    if cache_dir is not None:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        cache_key = get_feature_matrix_hash(X) + '_' + get_model_params_hash(model)
+        tasks_to_fit = []
+        for k, seed in tasks:
+            cache_path = _get_bootstrap_cache_path(cache_dir, cache_key, k, seed)
+            if os.path.exists(cache_path):
+                yield k, seed, np.load(cache_path)
+            else:
+                tasks_to_fit.append((k, seed))
+        tasks = tasks_to_fit
+    if len(tasks) == 0:
+        return
+
+    fit_model = model
+    fit_X = X
+    if isinstance(model, SpectralClustering) and (affinity_matrix is not None or precompute_affinity) \
+            and model.affinity not in ['precomputed', 'precomputed_nearest_neighbors']:
+        if affinity_matrix is None:
+            affinity_matrix = load_affinity_matrix(X, model, cache_dir=cache_dir)
+        fit_model = clone(model).set_params(affinity='precomputed')
+        fit_X = affinity_matrix
+
+    if n_jobs == 1:
+        executor = None
+        futures = []
+        results = (_fit_labels_for_seed(k, seed, model=fit_model, X=fit_X) for k, seed in tasks)
+    else:
+        max_workers = None if n_jobs == -1 else n_jobs
+        executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_bootstrap_worker,
+                                       initargs=(fit_model, fit_X))
+        futures = [executor.submit(_fit_labels_for_seed, k, seed) for k, seed in tasks]
+        results = (future.result() for future in as_completed(futures))
+    try:
+        for k, seed, labels in tqdm(results, total=len(tasks)):
+            if cache_dir is not None:
+                np.save(_get_bootstrap_cache_path(cache_dir, cache_key, k, seed), labels)
+            yield k, seed, labels
+    finally:
+        if executor is not None:
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
+
+
+def run_bootstrap_fits(X, model=SpectralClustering, n_clusters=8, seeds=np.arange(100), n_jobs=1,
+                       precompute_affinity=True, affinity_matrix=None, cache_dir=None):
+    '''
+    Runs independent fits of a clustering model on the same data, one for each combination of n_clusters and seed.
+    See iterate_bootstrap_fits for a description of parameters.
+    ___________
+    :return: labels: dictionary with n_clusters as keys and matrix of labels, n seeds by n observations, as values
+    '''
+    seeds = [int(seed) for seed in seeds]
+    labels_by_fit = {}
+    for k, seed, labels in iterate_bootstrap_fits(X, model=model, n_clusters=n_clusters, seeds=seeds, n_jobs=n_jobs,
+                                                  precompute_affinity=precompute_affinity,
+                                                  affinity_matrix=affinity_matrix, cache_dir=cache_dir):
+        labels_by_fit[(k, seed)] = labels
+    n_clusters_list = sorted(set(k for k, seed in labels_by_fit.keys()))
+    labels = {k: np.array([labels_by_fit[(k, seed)] for seed in seeds]) for k in n_clusters_list}
+    return labels
+
+
 def compute_inertia(a, X, metric='euclidean'):
     W = [np.mean(pairwise_distances(X[a == c, :], metric=metric)) for c in np.unique(a)]
     return np.mean(W)
 
 
-def compute_gap(clustering, data, k_max=5, n_boots=20, reference_shuffle='all', metric='euclidean'):
+def _get_reference_inertia_for_seed(k, seed, clustering=None, data=None, reference_shuffle='all', metric='euclidean'):
+    """
+    draws a reference dataset (random or shuffled data) with the given random seed, clusters it into k clusters
+    and returns its inertia. if clustering and data are not provided, uses the model and data set for this worker process
+    """
+    if clustering is None:
+        clustering = _bootstrap_worker_data['model']
+        data = _bootstrap_worker_data['X']
+    random_state = np.random.get_state()
+    np.random.seed(seed)
+    try:
+        if reference_shuffle is None:
+            reference = np.random.rand(*data.shape) * -1
+        else:
+            reference_df = shuffle_dropout_score(data, shuffle_type=reference_shuffle)
+            reference = reference_df.values
+    finally:
+        np.random.set_state(random_state)
+    _, _, assignments = _fit_labels_for_seed(k, seed, model=clustering, X=reference)
+    return k, seed, compute_inertia(assignments, reference, metric=metric)
+
+
+def compute_gap(clustering, data, k_max=5, n_boots=20, reference_shuffle='all', metric='euclidean', n_jobs=1, cache_dir=None):
     '''
     Computes gap statistic between clustered data (ondata inertia) and null hypothesis (reference intertia).
 
@@ -521,6 +783,8 @@ def compute_gap(clustering, data, k_max=5, n_boots=20, reference_shuffle='all',
     :param reference: (str) what type of shuffle to use, shuffle_dropout_scores,
             None is use random normal distribution
     :param metric: (str) type of distance to use, default = 'euclidean'
+    :param n_jobs: (int) default = 1, number of worker processes used to run clustering repeats
+    :param cache_dir: (str) default = None, directory to cache labels of clustering repeats on data in
     :return:
     gap: array of gap values that are the difference between two inertias
     reference_inertia: array of log of reference inertia
@@ -535,35 +799,42 @@ def compute_gap(clustering, data, k_max=5, n_boots=20, reference_shuffle='all',
     else:
         data_array = data
 
+    k_values = np.arange(1, k_max)
+    seeds = np.arange(n_boots)
+
+    # reference data is redrawn for every repeat, so the affinity matrix can not be reused across repeats
+    ref_inertia = {}
+    tasks = [(k, seed) for k in k_values for seed in seeds]
+    if n_jobs == 1:
+        for k, seed in tasks:
+            ref_inertia[(k, seed)] = _get_reference_inertia_for_seed(k, seed, clustering=clustering, data=data,
+                                                                     reference_shuffle=reference_shuffle, metric=metric)[2]
+    else:
+        max_workers = None if n_jobs == -1 else n_jobs
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_bootstrap_worker,
+                                 initargs=(clustering, data)) as executor:
+            futures = [executor.submit(_get_reference_inertia_for_seed, k, seed,
+                                       reference_shuffle=reference_shuffle, metric=metric) for k, seed in tasks]
+            for future in as_completed(futures):
+                k, seed, inertia = future.result()
+                ref_inertia[(k, seed)] = inertia
+
+    ondata_labels = run_bootstrap_fits(data_array, model=clustering, n_clusters=k_values, seeds=seeds,
+                                       n_jobs=n_jobs, cache_dir=cache_dir)
+
     gap_statistics = {}
     reference_inertia = []
     reference_sem = []
+    ondata_inertia = []
+    ondata_sem = []
     gap_mean = []
     gap_sem = []
-    for k in range(1, k_max ):
-        local_ref_inertia = []
-        for _ in range(n_boots):
-            # draw random dist or shuffle for every nboot
-            if reference_shuffle is None:
-                reference = np.random.rand(*data.shape) * -1
-            else:
-                reference_df = shuffle_dropout_score(data, shuffle_type=reference_shuffle)
-                reference = reference_df.values
-
-            clustering.n_clusters = k
-            assignments = clustering.fit_predict(reference)
-            local_ref_inertia.append(compute_inertia(assignments, reference, metric=metric))
+    for k in k_values:
+        local_ref_inertia = [ref_inertia[(k, seed)] for seed in seeds]
         reference_inertia.append(np.mean(local_ref_inertia))
         reference_sem.append(sem(local_ref_inertia))
 
-    ondata_inertia = []
-    ondata_sem = []
-    for k in range(1, k_max ):
-        local_ondata_inertia = []
-        for _ in range(n_boots):
-            clustering.n_clusters = k
-            assignments = clustering.fit_predict(data_array)
-            local_ondata_inertia.append(compute_inertia(assignments, data_array, metric=metric))
+        local_ondata_inertia = [compute_inertia(assignments, data_array, metric=metric) for assignments in ondata_labels[k]]
         ondata_inertia.append(np.mean(local_ondata_inertia))
         ondata_sem.append(sem(local_ondata_inertia))
 
@@ -589,7 +860,8 @@ def compute_gap(clustering, data, k_max=5, n_boots=20, reference_shuffle='all',
 def get_eigenDecomposition(A, max_n_clusters=25):
     """
     Input:
-    A: Affinity matrix from spectral clustering
+    A: Affinity matrix from spectral clustering, dense or sparse. For sparse matrices,
+        only the max_n_clusters + 1 smallest eigenvalues are computed
     max_n_clusters
 
     :return A tuple containing:
@@ -609,7 +881,11 @@ def get_eigenDecomposition(A, max_n_clusters=25):
     """
     L = csgraph.laplacian(A, normed=True)
     # n_components = A.shape[0]
-    eigenvalues, eigenvectors = linalg.eigh(L)
+    if sparse.issparse(L):
+        # for sparse (nearest neighbor) affinities, only compute the smallest eigenvalues needed for the eigengap
+        eigenvalues, eigenvectors = eigsh(L, k=min(max_n_clusters + 1, L.shape[0] - 1), which='SA')
+    else:
+        eigenvalues, eigenvectors = linalg.eigh(L)
 
     # Identify the optimal number of clusters as the index corresponding
     # to the larger gap between eigen values
@@ -619,7 +895,8 @@ def get_eigenDecomposition(A, max_n_clusters=25):
     return eigenvalues, eigenvectors, nb_clusters
 
 
-def get_silhouette_scores(X, model=SpectralClustering, n_clusters=np.arange(2, 10), metric='euclidean', n_boots=20):
+def get_silhouette_scores(X, model=SpectralClustering, n_clusters=np.arange(2, 10), metric='euclidean', n_boots=20,
+                          n_jobs=1, cache_dir=None):
     '''
     Computes silhouette scores for given n clusters.
     :param X: data, n observations by n features
@@ -629,36 +906,35 @@ def get_silhouette_scores(X, model=SpectralClustering, n_clusters=np.arange(2, 1
     :param metric: default = 'euclidean', distance metric to use inner and outer cluster distance
                     (other options in scipy.spatial.distance.pdist)
     :param n_boots: default = 20, number of repeats to average over for each n cluster
+    :param n_jobs: default = 1, number of worker processes used to run clustering repeats
+    :param cache_dir: default = None, directory to cache labels of clustering repeats in
     _____________
     :return: silhouette_scores: a list of scores for each n cluster
     '''
     print('size of X = ' + str(np.shape(X)))
     print('NaNs in the array = ' + str(np.sum(X == np.nan)))
+    labels = run_bootstrap_fits(X, model=model, n_clusters=n_clusters, seeds=np.arange(n_boots),
+                                n_jobs=n_jobs, cache_dir=cache_dir)
     silhouette_scores = []
     silhouette_std = []
     for n_cluster in n_clusters:
-        s_tmp = []
-        for n_boot in range(0, n_boots):
-            model.n_clusters = n_cluster
-            md = model.fit(X)
-            try:
-                labels = md.labels_
-            except AttributeError:
-                labels = md
-            s_tmp.append(silhouette_score(X, labels, metric=metric))
+        s_tmp = [silhouette_score(X, labels_boot, metric=metric) for labels_boot in labels[int(n_cluster)]]
         silhouette_scores.append(np.mean(s_tmp))
         silhouette_std.append(np.std(s_tmp))
         print('n {} clusters mean score = {}'.format(n_cluster, np.mean(s_tmp)))
     return silhouette_scores, silhouette_std
 
 
-def load_silhouette_scores(glm_version, feature_matrix, cell_metadata, save_dir, n_boots=20, n_clusters=np.arange(2, 30)):
+def load_silhouette_scores(glm_version, feature_matrix, cell_metadata, save_dir, n_boots=20, n_clusters=np.arange(2, 30),
+                           n_jobs=1, cache_dir=None):
     """
     if silhouette scores file exists in save_dir, load it
     otherwise run spectral clustering n_boots times, for a range of n_clusters
     returns dictionary of silhouette scores for each cre line
     n_boots is the number of times to run clustering for each n_cluster to get variability across runs
     n_clusters is the range of K values for which to compute the silhouette score
+    n_jobs is the number of worker processes used to run clustering repeats
+    cache_dir is a directory to cache affinity matrices and clustering labels in
     """
 
     sil_filename = glm_version + '_silhouette_scores.pkl'
@@ -680,7 +956,9 @@ def load_silhouette_scores(glm_version, feature_matrix, cell_metadata, save_dir,
                                                                               model=sc,
                                                                               n_clusters=n_clusters,
                                                                               n_boots=n_boots,
-                                                                              metric='euclidean')
+                                                                              metric='euclidean',
+                                                                              n_jobs=n_jobs,
+                                                                              cache_dir=cache_dir)
             silhouette_scores[cre_line] = [silhouette_scores_cre, silhouette_std_cre]
         # save it for next time
         save_clustering_results(silhouette_scores, filename_string=sil_filename, path=save_dir)
@@ -719,11 +997,12 @@ def load_gap_statistic(glm_version, feature_matrix, cell_metadata, save_dir=None
     return gap_statistic
 
 
-def load_eigengap(glm_version, feature_matrix, cell_metadata, save_dir=None, k_max=25):
+def load_eigengap(glm_version, feature_matrix, cell_metadata, save_dir=None, k_max=25, cache_dir=None):
     """
            if eigengap values were computed and file exists in save_dir, load it
            otherwise run get_eigenDecomposition for a range of 1 to k_max clusters
            returns dictionary of eigengap for each cre line = [nb_clusters, eigenvalues, eigenvectors]
+           affinity matrices are cached in cache_dir, if provided, to be reused by other clustering steps
            # this doesnt actually take too long, so might not be a huge need to save files besides records
            """
     eigengap_filename = 'eigengap_' + glm_version + '_' + 'kmax' + str(k_max) + '.pkl'
@@ -739,66 +1018,143 @@ def load_eigengap(glm_version, feature_matrix, cell_metadata, save_dir=None, k_m
         for cre_line in get_cre_lines(cell_metadata):
             feature_matrix_cre = get_feature_matrix_for_cre_line(feature_matrix, cell_metadata, cre_line)
             X = feature_matrix_cre.values
-            sc = SpectralClustering(2)  # N of clusters does not impact affinity matrix
-            # but you can obtain affinity matrix only after fitting, thus some N of clusters must be provided.
-            sc.fit(X)
-            A = sc.affinity_matrix_
+            sc = SpectralClustering()  # N of clusters does not impact affinity matrix
+            A = load_affinity_matrix(X, sc, cache_dir=cache_dir)
             eigenvalues, eigenvectors, nb_clusters = get_eigenDecomposition(A, max_n_clusters=k_max)
             eigengap[cre_line] = [nb_clusters, eigenvalues, eigenvectors]
         save_clustering_results(eigengap, filename_string=eigengap_filename, path=save_dir)
     return eigengap
 
 
-def get_labels_for_coclust_matrix(X, model=SpectralClustering, nboot=np.arange(100), n_clusters=8):
+def get_labels_for_coclust_matrix(X, model=SpectralClustering, nboot=np.arange(100), n_clusters=8, n_jobs=1, cache_dir=None):
     '''
 
     :param X: (ndarray) data, n observations by n features
     :param model: (clustering object) default =  SpectralClustering; clustering method to use. Object must be initialized.
-    :param nboot: (list or an array) default = 100, number of clustering repeats
+    :param nboot: (list or an array) default = 100, number of clustering repeats; values are used as random seeds
     :param n_clusters: (num) default = 8
+    :param n_jobs: (int) default = 1, number of worker processes used to run clustering repeats
+    :param cache_dir: (str) default = None, directory to cache labels of clustering repeats in
     ___________
     :return: labels: matrix of labels, n repeats by n observations
     '''
     if model is SpectralClustering:
         model = model()
-    labels = []
-    if n_clusters is not None:
-        model.n_clusters = n_clusters
-    for _ in tqdm(nboot):
-        md = model.fit(X)
-        labels.append(md.labels_)
-    return labels
+    if n_clusters is None:
+        n_clusters = model.n_clusters
+    labels = run_bootstrap_fits(X, model=model, n_clusters=n_clusters, seeds=nboot, n_jobs=n_jobs, cache_dir=cache_dir)
+    return labels[int(n_clusters)]
+
+
+def get_one_hot_labels(labels):
+    '''
+    Converts a matrix of cluster labels into a one-hot encoded membership matrix, with one column per
+    (repeat, cluster) pair, such that the dot product of two rows is the number of repeats in which
+    the two observations were assigned to the same cluster.
+
+    :param labels: (ndarray) matrix of labels, n repeats by n observations
+    ______________
+    returns: one_hot: (ndarray) n observations by total number of clusters across all repeats
+    '''
+    labels = np.atleast_2d(np.asarray(labels))
+    n_repeats, n_observations = labels.shape
+    codes = np.empty(labels.shape, dtype=np.int64)
+    offset = 0
+    for i in range(n_repeats):
+        unique_labels, codes[i] = np.unique(labels[i], return_inverse=True)
+        codes[i] += offset
+        offset += len(unique_labels)
+    one_hot = np.zeros((n_observations, offset), dtype=np.float32)
+    one_hot[np.arange(n_observations)[None, :], codes] = 1
+    return one_hot
+
+
+def add_labels_to_coClust_counts(coClust_counts, labels, chunk_size=None):
+    '''
+    Adds the co-clustering counts for one or more repeats of clustering to an existing count matrix, in place.
+    Used to build the co-clustering matrix as each repeat finishes, without keeping all labels in memory.
+
+    :param coClust_counts: (ndarray) n observations by n observations matrix of co-clustering counts
+    :param labels: (ndarray) labels for one repeat (n observations), or a matrix of labels, n repeats by n observations
+    :param chunk_size: (int) default = None, number of rows of the count matrix to update at a time;
+                        limits the size of temporary arrays for large n observations
+    ______________
+    returns: coClust_counts: the updated count matrix
+    '''
+    one_hot = get_one_hot_labels(labels).astype(coClust_counts.dtype)
+    n_observations = one_hot.shape[0]
+    if chunk_size is None:
+        chunk_size = n_observations
+    for start in range(0, n_observations, chunk_size):
+        stop = min(start + chunk_size, n_observations)
+        coClust_counts[start:stop] += one_hot[start:stop] @ one_hot.T
+    return coClust_counts
 
 
-def get_coClust_matrix(X, model=SpectralClustering, nboot=np.arange(150), n_clusters=8):
+def get_coClust_matrix_from_labels(labels, n_normalize=None, dtype=np.float64, chunk_size=None):
+    '''
+    Computes co-clustering matrix from a matrix of labels using one-hot encoding and a single matrix product.
+
+    :param labels: (ndarray) matrix of labels, n repeats by n observations
+    :param n_normalize: (num) default = None, value to divide co-clustering counts by; if None, the number of repeats is used
+    :param dtype: default = np.float64, dtype of the output matrix; use np.float32 to halve memory for large n observations
+    :param chunk_size: (int) default = None, number of rows of the matrix to compute at a time
+    ______________
+    returns: coClust_matrix: (ndarray) probability matrix of co-clustering together.
+    '''
+    labels = np.atleast_2d(np.asarray(labels))
+    n_observations = labels.shape[1]
+    if n_normalize is None:
+        n_normalize = labels.shape[0]
+    coClust_matrix = np.zeros((n_observations, n_observations), dtype=dtype)
+    add_labels_to_coClust_counts(coClust_matrix, labels, chunk_size=chunk_size)
+    coClust_matrix /= n_normalize
+    return coClust_matrix
+
+
+def get_coClust_matrix(X, model=SpectralClustering, nboot=np.arange(150), n_clusters=8, dtype=np.float64,
+                       chunk_size=None, streaming=False, n_jobs=1, cache_dir=None):
     '''
 
     :param X: (ndarray) data, n observations by n features
     :param model: (clustering object) default =  SpectralClustering; clustering method to use. Model must be initialized.
     :param nboot: (list or an array) default = 100, number of clustering repeats
     :param n_clusters: (num) default = 8
+    :param dtype: default = np.float64, dtype of the co-clustering matrix; np.float32 halves memory for large n observations
+    :param chunk_size: (int) default = None, number of rows of the co-clustering matrix to compute at a time
+    :param streaming: (bool) default = False, if True, add each repeat to the co-clustering matrix as soon as it is fit
+                        instead of keeping the labels for all repeats
+    :param n_jobs: (int) default = 1, number of worker processes used to run clustering repeats
+    :param cache_dir: (str) default = None, directory to cache labels of clustering repeats in
     ______________
     returns: coClust_matrix: (ndarray) probability matrix of co-clustering together.
     '''
-    # model = model()
-    labels = get_labels_for_coclust_matrix(X=X,
-                                           model=model,
-                                           nboot=nboot,
-                                           n_clusters=n_clusters)
-    coClust_matrix = []
-    for i in range(np.shape(labels)[1]):  # get cluster id of this observation
-        this_coClust_matrix = []
-        for j in nboot:  # find other observations with this cluster id
-            id = labels[j][i]
-            this_coClust_matrix.append(labels[j] == id)
-        coClust_matrix.append(np.sum(this_coClust_matrix, axis=0) / max(nboot))
+    # counts are divided by max(nboot) to match co-clustering matrices computed previously
+    if streaming:
+        coClust_matrix = np.zeros((len(X), len(X)), dtype=dtype)
+        for _, _, labels in iterate_bootstrap_fits(X, model=model, n_clusters=n_clusters, seeds=nboot,
+                                                   n_jobs=n_jobs, cache_dir=cache_dir):
+            add_labels_to_coClust_counts(coClust_matrix, labels, chunk_size=chunk_size)
+        coClust_matrix /= max(nboot)
+    else:
+        labels = get_labels_for_coclust_matrix(X=X,
+                                               model=model,
+                                               nboot=nboot,
+                                               n_clusters=n_clusters,
+                                               n_jobs=n_jobs,
+                                               cache_dir=cache_dir)
+        coClust_matrix = get_coClust_matrix_from_labels(labels, n_normalize=max(nboot), dtype=dtype,
+                                                        chunk_size=chunk_size)
     return coClust_matrix
 
 
-def get_coclustering_matrix(glm_version, feature_matrix, cell_metadata, n_clusters_cre, save_dir, nboot=100):
+def get_coclustering_matrix(glm_version, feature_matrix, cell_metadata, n_clusters_cre, save_dir, nboot=100, n_jobs=1,
+                            cache_dir=None):
     """
     if coclustering matrix file exists in save_dir, load from file
     else, create coclustering matrix by performing spectral clustering nboot number of times and save the matrix
+    clustering repeats are run in n_jobs worker processes
+    affinity matrices and clustering labels are cached in cache_dir, if provided
 
     n_clusters_cre is a dictionary with cre lines as keys and the selected number of clusters for that cre line as values
     returns coclustering_matrices: a dictionary with cre_lines as keys, values as co-clustering matrix per cre line
@@ -817,7 +1173,8 @@ def get_coclustering_matrix(glm_version, feature_matrix, cell_metadata, n_cluste
             sc = SpectralClustering()
             feature_matrix_cre = get_feature_matrix_for_cre_line(feature_matrix, cell_metadata, cre_line)
             X = feature_matrix_cre.values
-            m = get_coClust_matrix(X=X, n_clusters=n_clusters_cre[cre_line], model=sc, nboot=np.arange(nboot))
+            m = get_coClust_matrix(X=X, n_clusters=n_clusters_cre[cre_line], model=sc, nboot=np.arange(nboot), n_jobs=n_jobs,
+                                   cache_dir=cache_dir)
             # make co-clustering matrix a dataframe with cell_specimen_ids as indices and columns
             coclustering_df = pd.DataFrame(data=m, index=feature_matrix_cre.index, columns=feature_matrix_cre.index)
             # save to dictionary
@@ -1,6 +1,7 @@
 from visual_behavior.ophys.response_analysis import response_processing as rp
 import xarray as xr
 import numpy as np
+import h5py
 # import os
 # import tensortools
 import visual_behavior.data_access.loading as loading
@@ -75,6 +76,138 @@ def create_session_tensor(oeids, use_events=True, filter_events=True, time_windo
     return response_xrs
 
 
+def scale_tensor_slice(X, scaler):
+    '''
+    Applies a scaler, such as zscore_scaler or min_max_scaler, to each cell of a slice of a tensor
+    :param X: array, num_cells x response profile x trials
+    :param scaler: function that takes and returns an array of one cell's responses
+    :return: scaled array, same shape as X
+    '''
+    return np.stack([scaler(X[i]) for i in range(X.shape[0])])
+
+
+def _get_tensor_slice(oeid, use_events, filter_events, time_window, time, trace_ids=None):
+    dataset = loading.get_ophys_dataset(oeid)
+    response_xr = rp.get_stimulus_response_xr(dataset, use_events=use_events, filter_events=filter_events, time_window=time_window)
+    response_xr.coords['eventlocked_timestamps'] = response_xr.coords['eventlocked_timestamps'].round(3)
+    if trace_ids is not None:
+        # keep the cells in trace_ids that are also in this experiment, as in create_container_tensor
+        index = response_xr['trace_id'].isin(trace_ids).values
+        response_xr = response_xr.isel({'trace_id': index})
+    if time is not None:
+        xr_sel = select_traces(response_xr, time=time)
+    else:
+        xr_sel = response_xr['eventlocked_traces']
+    return xr_sel
+
+
+def _append_to_dataset(h5_file, name, data, axis):
+    '''
+    writes data to a dataset in an open hdf5 file, creating the dataset on first write
+    and otherwise appending along the given axis
+    '''
+    data = np.asarray(data)
+    if name not in h5_file:
+        maxshape = list(data.shape)
+        maxshape[axis] = None
+        h5_file.create_dataset(name, data=data, maxshape=tuple(maxshape), chunks=True)
+    else:
+        dataset = h5_file[name]
+        start = dataset.shape[axis]
+        dataset.resize(start + data.shape[axis], axis=axis)
+        index = [slice(None)] * data.ndim
+        index[axis] = slice(start, start + data.shape[axis])
+        dataset[tuple(index)] = data
+
+
+def write_container_tensor(oeids, filepath, use_events=True, filter_events=True, time_window=None, time=None,
+                           scaler=None, dtype=np.float32):
+    '''
+    Creates tensor from datasets in one container, like create_container_tensor, but writes each experiment's
+    trials to a chunked hdf5 file as it is computed, so only one experiment's responses are held in memory.
+    Tensor is concatinated across sessions
+    Tensor = num_cells x response profile x trials, in dataset 'tensor'
+    Datasets 'trace_id', 'eventlocked_timestamps', 'trial_id' and 'ophys_experiment_id' (per trial) label the tensor axes
+    :param oeids: ophys_experiment_ids in container
+    :param filepath: path of hdf5 file to write
+    :param time: [start, end] of response profile to keep, as in select_traces; if None, keep full time_window
+    :param scaler: function such as zscore_scaler or min_max_scaler, applied to each cell within each experiment
+    :param dtype: dtype of tensor on disk
+    :return: filepath
+    '''
+    same_ids = get_matched_specimen_id(oeids)
+
+    with h5py.File(filepath, 'w') as f:
+        next_trial_id = 0
+        for i, oeid in enumerate(oeids):
+            xr_sel = _get_tensor_slice(oeid, use_events, filter_events, time_window, time, trace_ids=same_ids)
+            same_ids = xr_sel['trace_id'].values
+            if i == 0:
+                trace_ids = same_ids
+                f.create_dataset('trace_id', data=trace_ids)
+                f.create_dataset('eventlocked_timestamps', data=xr_sel['eventlocked_timestamps'].values)
+            else:
+                # cells missing from this or an earlier experiment are NaN, as in the outer join of xr.concat
+                xr_sel = xr_sel.reindex(trace_id=trace_ids)
+            X = transpose_tensor(xr_sel).astype(dtype)
+            if scaler is not None:
+                X = scale_tensor_slice(X, scaler)
+            trial_ids = xr_sel['trial_id'].values + next_trial_id
+            next_trial_id = trial_ids.max() + 1
+            _append_to_dataset(f, 'tensor', X, axis=2)
+            _append_to_dataset(f, 'trial_id', trial_ids, axis=0)
+            _append_to_dataset(f, 'ophys_experiment_id', np.repeat(oeid, len(trial_ids)), axis=0)
+    return filepath
+
+
+def write_session_tensor(oeids, filepath, use_events=True, filter_events=True, time_window=[-.5, .75], time=None,
+                         scaler=None, dtype=np.float32):
+    '''
+    Creates tensor from datasets in one session, like create_session_tensor, but writes each experiment's
+    cells to a chunked hdf5 file as it is computed, so only one experiment's responses are held in memory.
+    Concatinate across cortical layers and areas.
+    Tensor = num_cells x response profile x trials, in dataset 'tensor'
+    Datasets 'trace_id', 'eventlocked_timestamps', 'trial_id' and 'ophys_experiment_id' (per cell) label the tensor axes
+    :param oeids: ophys_experiment_ids in session
+    :param filepath: path of hdf5 file to write
+    :param time: [start, end] of response profile to keep, as in select_traces; if None, keep full time_window
+    :param scaler: function such as zscore_scaler or min_max_scaler, applied to each cell
+    :param dtype: dtype of tensor on disk
+    :return: filepath
+    '''
+    with h5py.File(filepath, 'w') as f:
+        for i, oeid in enumerate(oeids):
+            xr_sel = _get_tensor_slice(oeid, use_events, filter_events, time_window, time)
+            X = transpose_tensor(xr_sel).astype(dtype)
+            if scaler is not None:
+                X = scale_tensor_slice(X, scaler)
+            if i == 0:
+                f.create_dataset('trial_id', data=xr_sel['trial_id'].values)
+                f.create_dataset('eventlocked_timestamps', data=xr_sel['eventlocked_timestamps'].values)
+            _append_to_dataset(f, 'tensor', X, axis=0)
+            _append_to_dataset(f, 'trace_id', xr_sel['trace_id'].values, axis=0)
+            _append_to_dataset(f, 'ophys_experiment_id', np.repeat(oeid, X.shape[0]), axis=0)
+    return filepath
+
+
+def load_tensor(filepath, in_memory=False):
+    '''
+    Loads a tensor written by write_container_tensor or write_session_tensor.
+    :param filepath: path of hdf5 file
+    :param in_memory: if True, read the full tensor into memory,
+                      otherwise return an h5py dataset that reads from disk when indexed
+    :return: tensor (num_cells x response profile x trials), dictionary of axis labels
+    '''
+    f = h5py.File(filepath, 'r')
+    labels = {name: f[name][()] for name in ['trace_id', 'eventlocked_timestamps', 'trial_id', 'ophys_experiment_id']}
+    if in_memory:
+        tensor = f['tensor'][()]
+        f.close()
+    else:
+        tensor = f['tensor']
+    return tensor, labels
+
+
 def get_cells_df(oeids):
     cells_df = pd.DataFrame(columns=['cell_specimen_id', 'targeted_structure', 'imaging_depth'])
     for i, oeid in enumerate(oeids):
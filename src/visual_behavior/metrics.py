@@ -3,7 +3,9 @@ the metrics contained in this module conform to scikit-learn styled `metric(y_tr
 
 """
 from sklearn.metrics import confusion_matrix
+import warnings
 import numpy as np
+import pandas as pd
 from scipy import stats
 from .utilities import dprime as __dprime
 from .utilities import trial_number_limit
@@ -65,3 +67,171 @@ def criterion(hit_rate, false_alarm_rate):
     c = -0.5 * (Z(hit_rate) + Z(false_alarm_rate))
 
     return c
+
+
+# batched metrics
+#
+# the functions below compute the metrics above for many sets of trials (sessions, epochs or bootstrap resamples)
+# at once, from the go/catch confusion counts of each set
+
+
+def count_responses(y_true, y_pred, groups=None):
+    '''
+    go trial, hit, catch trial and false alarm counts for many sets of trials in one pass
+
+    Parameters
+    ----------
+    y_true, y_pred : boolean arrays
+        1-D with one value per trial, split into sets by `groups`,
+        or 2-D with one row per set of trials
+    groups : array of labels, one per trial, only for 1-D y_true and y_pred
+
+    Returns
+    -------
+    pandas.DataFrame
+        columns N_go_trials, hits, N_catch_trials and false_alarms,
+        indexed by the sorted group labels, or by row number for 2-D y_true and y_pred
+    '''
+    y_true = np.asarray(y_true, dtype=bool)
+    y_pred = np.asarray(y_pred, dtype=bool)
+
+    if y_true.ndim == 2:
+        index = pd.RangeIndex(len(y_true))
+        counts = [np.sum(mask, axis=1) for mask in (y_true, y_true & y_pred, ~y_true, ~y_true & y_pred)]
+    else:
+        if groups is None:
+            groups = np.zeros(len(y_true), dtype=int)
+        index, group_index = np.unique(np.asarray(groups), return_inverse=True)
+        counts = [np.bincount(group_index, weights=mask, minlength=len(index)).astype(int)
+                  for mask in (y_true, y_true & y_pred, ~y_true, ~y_true & y_pred)]
+
+    return pd.DataFrame(dict(zip(['N_go_trials', 'hits', 'N_catch_trials', 'false_alarms'], counts)), index=index)
+
+
+def response_rate_from_counts(responses, trial_count, apply_trial_number_limit=False, clip_vals=[0, 1]):
+    '''
+    response probability for arrays of response and trial counts, as in `hit_rate` and `false_alarm_rate`.
+    NaN where there are no trials
+    '''
+    trial_count = np.asarray(trial_count, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        response_probability = np.asarray(responses, dtype=float) / trial_count
+        if apply_trial_number_limit:
+            # same bounds as trial_number_limit
+            response_probability = np.clip(response_probability, 1. / (2 * trial_count), 1 - 1. / (2 * trial_count))
+    return np.clip(response_probability, clip_vals[0], clip_vals[1])
+
+
+def d_prime_from_rates(hit_rate, false_alarm_rate, clip_vals=[0, 1]):
+    '''
+    d' for arrays of hit and false alarm rates, as in `d_prime`. NaN where either rate is NaN
+    '''
+    Z = norm.ppf
+    return Z(np.clip(hit_rate, clip_vals[0], clip_vals[1])) - Z(np.clip(false_alarm_rate, clip_vals[0], clip_vals[1]))
+
+
+def discrim_p_from_counts(hits, misses, false_alarms, correct_rejects):
+    '''
+    chi-squared p-value of the go/catch confusion matrix for arrays of counts, as in `discrim_p`
+
+    uses the closed form of scipy.stats.chi2_contingency for a 2x2 table with Yates' correction.
+    tables with an empty row or column have a p-value of 1
+    '''
+    observed = np.stack(np.broadcast_arrays(
+        np.asarray(hits, dtype=float), np.asarray(misses, dtype=float),
+        np.asarray(false_alarms, dtype=float), np.asarray(correct_rejects, dtype=float),
+    ), axis=-1).reshape(np.shape(hits) + (2, 2))
+
+    row_totals = observed.sum(axis=-1, keepdims=True)
+    column_totals = observed.sum(axis=-2, keepdims=True)
+    total = row_totals.sum(axis=-2, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = row_totals * column_totals / total
+        difference = expected - observed
+        corrected = observed + np.sign(difference) * np.minimum(0.5, np.abs(difference))
+        chi2 = np.sum((corrected - expected) ** 2 / expected, axis=(-2, -1))
+
+    degenerate = np.any(expected == 0, axis=(-2, -1)) | np.isnan(chi2)
+    return np.where(degenerate, 1.0, stats.chi2.sf(np.where(degenerate, 0, chi2), 1))
+
+
+def batch_metrics(y_true, y_pred, groups=None, apply_trial_number_limit=False, clip_vals=[0, 1]):
+    '''
+    the metrics in this module for many sets of trials at once
+
+    Parameters
+    ----------
+    y_true, y_pred, groups :
+        see `count_responses`
+    apply_trial_number_limit, clip_vals :
+        see `hit_rate`
+
+    Returns
+    -------
+    pandas.DataFrame
+        the columns of `count_responses`, plus hit_rate, false_alarm_rate, d_prime and discrim_p
+    '''
+    metrics = count_responses(y_true, y_pred, groups=groups)
+
+    metrics['hit_rate'] = response_rate_from_counts(metrics['hits'], metrics['N_go_trials'], apply_trial_number_limit, clip_vals)
+    metrics['false_alarm_rate'] = response_rate_from_counts(metrics['false_alarms'], metrics['N_catch_trials'], apply_trial_number_limit, clip_vals)
+    metrics['d_prime'] = d_prime_from_rates(metrics['hit_rate'].values, metrics['false_alarm_rate'].values, clip_vals)
+    metrics['discrim_p'] = discrim_p_from_counts(
+        metrics['hits'].values,
+        (metrics['N_go_trials'] - metrics['hits']).values,
+        metrics['false_alarms'].values,
+        (metrics['N_catch_trials'] - metrics['false_alarms']).values,
+    )
+
+    return metrics
+
+
+def bootstrap_d_prime(y_true, y_pred, groups=None, n_bootstrap=1000, ci=95, apply_trial_number_limit=False, clip_vals=[0, 1], random_state=None):
+    '''
+    bootstrap confidence interval of d' for many sets of trials, without resampling in a loop
+
+    go and catch trials are resampled separately, with replacement. the number of hits (false alarms) in a resample
+    of N go (catch) trials is binomial with the observed hit (false alarm) probability, so the resampled counts are
+    drawn directly for all sets and resamples at once
+
+    Parameters
+    ----------
+    y_true, y_pred, groups :
+        see `count_responses`
+    n_bootstrap : int
+        number of bootstrap resamples
+    ci : float
+        width of the confidence interval, in percent
+    apply_trial_number_limit, clip_vals :
+        see `hit_rate`
+    random_state : int or numpy.random.RandomState, optional
+
+    Returns
+    -------
+    pandas.DataFrame
+        indexed like `count_responses`, with columns d_prime, ci_low and ci_high
+    '''
+    rng = random_state if isinstance(random_state, np.random.RandomState) else np.random.RandomState(random_state)
+    counts = count_responses(y_true, y_pred, groups=groups)
+
+    resampled_rates = []
+    for responses, trial_count in ((counts['hits'].values, counts['N_go_trials'].values),
+                                   (counts['false_alarms'].values, counts['N_catch_trials'].values)):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            response_probability = np.nan_to_num(responses / trial_count.astype(float))
+        resampled_responses = rng.binomial(trial_count, response_probability, size=(n_bootstrap, len(counts)))
+        resampled_rates.append(response_rate_from_counts(resampled_responses, trial_count, apply_trial_number_limit, clip_vals))
+    resampled_d_prime = d_prime_from_rates(resampled_rates[0], resampled_rates[1], clip_vals)
+
+    with warnings.catch_warnings():
+        # sets without go or catch trials have an all-NaN d'
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        ci_low, ci_high = np.nanpercentile(resampled_d_prime, [50 - ci / 2., 50 + ci / 2.], axis=0)
+
+    d_prime = d_prime_from_rates(
+        response_rate_from_counts(counts['hits'], counts['N_go_trials'], apply_trial_number_limit, clip_vals),
+        response_rate_from_counts(counts['false_alarms'], counts['N_catch_trials'], apply_trial_number_limit, clip_vals),
+        clip_vals,
+    )
+
+    return pd.DataFrame({'d_prime': d_prime, 'ci_low': ci_low, 'ci_high': ci_high}, index=counts.index)
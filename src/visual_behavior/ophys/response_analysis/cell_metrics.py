@@ -2,6 +2,7 @@ import os
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import visual_behavior.data_access.loading as loading
 import visual_behavior.data_access.utilities as utilities
@@ -885,7 +886,7 @@ def load_metrics_generation_exceptions_log_file():
 
 
 def load_metrics_table_for_experiment(ophys_experiment_id, condition, stimuli, session_subset,
-                                      data_type='events', interpolate=True, output_sampling_rate=30):
+                                      data_type='events', interpolate=True, output_sampling_rate=30, columns=None):
     """
     Loads metrics table from file, either cell metrics (stimulus locked metrics) or full trace metrics, depending on provided conditions
     Note: engaged defined as reward rate >2
@@ -893,19 +894,69 @@ def load_metrics_table_for_experiment(ophys_experiment_id, condition, stimuli, s
     :param condition: 'changes', 'omissions', 'images', or 'traces'
     :param stimuli: 'all_images', 'pref_image', or 'full_session' (for 'traces')
     :param session_subset: 'engaged', 'disengaged', or 'full_session' (for traces or cell metrics)
+    :param columns: list of columns to return, or None to return all columns
 
     :return: metrics table
     """
     filepath = get_metrics_df_filepath(ophys_experiment_id, condition, stimuli, session_subset,
                                        data_type=data_type, interpolate=interpolate, output_sampling_rate=output_sampling_rate)
     metrics_table = pd.read_hdf(filepath, key='df')
+    if columns is not None:
+        metrics_table = metrics_table[columns]
     return metrics_table
 
 
+def load_consolidated_metrics_table(ophys_experiment_ids, condition, stimuli, session_subset,
+                                    data_type='events', interpolate=True, output_sampling_rate=30, columns=None):
+    """
+    Loads metrics for the provided ophys_experiment_ids from the consolidated 'all_experiments' file
+    written by save_consolidated_metrics_table(). Only rows for the requested experiments and the requested columns are read.
+    :param ophys_experiment_ids: list of ophys_experiment_ids to load, or 'all_experiments' to load every experiment in the file
+    :param condition: 'changes', 'omissions', 'images', or 'traces'
+    :param stimuli: 'all_images', 'pref_image', or 'full_session' (for 'traces')
+    :param session_subset: 'engaged', 'disengaged', or 'full_session' (for traces or cell metrics)
+    :param columns: list of columns to return, or None to return all columns
+    :return: metrics table
+    """
+    filepath = get_metrics_df_filepath('all_experiments', condition, stimuli, session_subset,
+                                       data_type=data_type, interpolate=interpolate, output_sampling_rate=output_sampling_rate)
+    if (isinstance(ophys_experiment_ids, str)) and (ophys_experiment_ids == 'all_experiments'):
+        where = None
+    else:
+        where = 'ophys_experiment_id in {}'.format([int(expt_id) for expt_id in ophys_experiment_ids])
+    metrics_table = pd.read_hdf(filepath, key='df', where=where, columns=columns)
+    return metrics_table
+
+
+def save_consolidated_metrics_table(metrics_table, condition, stimuli, session_subset,
+                                    data_type='events', interpolate=True, output_sampling_rate=30):
+    """
+    Saves a metrics table for many experiments to a single 'all_experiments' file in HDF5 table format,
+    with ophys_experiment_id as an indexed data column, so that subsets of experiments and columns
+    can later be loaded with load_consolidated_metrics_table() without reading the whole file
+    :param metrics_table: metrics table for multiple experiments, as returned by load_metrics_table_for_experiments()
+    :param condition: 'changes', 'omissions', 'images', or 'traces'
+    :param stimuli: 'all_images', 'pref_image', or 'full_session' (for 'traces')
+    :param session_subset: 'engaged', 'disengaged', or 'full_session' (for traces or cell metrics)
+    :return: filepath of saved file
+    """
+    filepath = get_metrics_df_filepath('all_experiments', condition, stimuli, session_subset,
+                                       data_type=data_type, interpolate=interpolate, output_sampling_rate=output_sampling_rate)
+    if os.path.exists(filepath):
+        os.remove(filepath)
+        print('h5 file exists for all experiments  - overwriting')
+    metrics_table = metrics_table.reset_index(drop=True)
+    metrics_table['ophys_experiment_id'] = metrics_table['ophys_experiment_id'].astype(int)
+    metrics_table.to_hdf(filepath, key='df', format='table', data_columns=['ophys_experiment_id'])
+    return filepath
+
+
 def load_metrics_table_for_experiments(ophys_experiment_ids, condition, stimuli, session_subset,
-                                       data_type='events', interpolate=True, output_sampling_rate=30):
+                                       data_type='events', interpolate=True, output_sampling_rate=30,
+                                       columns=None, n_workers=16, use_consolidated=False):
     '''
     Loads a metrics table, either cell metrics (stimulus locked) or full trace metrics for multiple experiments
+    Files for individual experiments are read concurrently in a thread pool and concatenated once at the end
     Note: engaged defined as reward rate >2
     ophys_experiment_ids: unique identifier for experiment or 'all_experiments' to load table from single file for all expts
     :param condition: 'changes', 'omissions', 'images', or 'traces'
@@ -916,36 +967,64 @@ def load_metrics_table_for_experiments(ophys_experiment_ids, condition, stimuli,
                     not yet implemented: 'running_speed', 'pupil_diameter', 'lick_rate'
     :param interpolate: Boolean, whether or not to interpolate traces
     :param output_sampling_rate: sampling rate for interpolation, only used if interpolate is True
+    :param columns: list of columns to return, or None to return all columns
+    :param n_workers: number of threads used to read per-experiment files
+    :param use_consolidated: Boolean, if True, load the requested experiments from the consolidated file
+                            written by save_consolidated_metrics_table() instead of from per-experiment files
     '''
 
-    i = 0
-    problem_expts = pd.DataFrame()
-    metrics_table = pd.DataFrame()
     if (isinstance(ophys_experiment_ids, str)) and (ophys_experiment_ids == 'all_experiments'):
+        metrics_table = pd.DataFrame()
         try:
-            metrics_table = load_metrics_table_for_experiment(ophys_experiment_ids, condition, stimuli, session_subset,
-                                                              data_type=data_type, interpolate=interpolate,
-                                                              output_sampling_rate=output_sampling_rate)
+            if use_consolidated:
+                metrics_table = load_consolidated_metrics_table(ophys_experiment_ids, condition, stimuli, session_subset,
+                                                                data_type=data_type, interpolate=interpolate,
+                                                                output_sampling_rate=output_sampling_rate, columns=columns)
+            else:
+                metrics_table = load_metrics_table_for_experiment(ophys_experiment_ids, condition, stimuli, session_subset,
+                                                                  data_type=data_type, interpolate=interpolate,
+                                                                  output_sampling_rate=output_sampling_rate, columns=columns)
         except BaseException:
             print('problem loading all experiments metrics table')
-    else:
-        for ophys_experiment_id in tqdm(ophys_experiment_ids):
+        return metrics_table
+
+    if use_consolidated:
+        return load_consolidated_metrics_table(ophys_experiment_ids, condition, stimuli, session_subset,
+                                               data_type=data_type, interpolate=interpolate,
+                                               output_sampling_rate=output_sampling_rate, columns=columns)
+
+    def load_shard(ophys_experiment_id):
+        return load_metrics_table_for_experiment(ophys_experiment_id, condition, stimuli, session_subset,
+                                                 data_type=data_type, interpolate=interpolate,
+                                                 output_sampling_rate=output_sampling_rate, columns=columns)
+
+    tables = {}
+    problems = []
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = {executor.submit(load_shard, ophys_experiment_id): ophys_experiment_id
+                   for ophys_experiment_id in ophys_experiment_ids}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            ophys_experiment_id = futures[future]
             try:
-                tmp = load_metrics_table_for_experiment(ophys_experiment_id, condition, stimuli, session_subset,
-                                                        data_type=data_type, interpolate=interpolate,
-                                                        output_sampling_rate=output_sampling_rate)
-                metrics_table = pd.concat([metrics_table, tmp])
+                tables[ophys_experiment_id] = future.result()
             except Exception as e:
                 print('problem for experiment', ophys_experiment_id)
-                problem_expts.loc[i, 'ophys_experiment_id'] = ophys_experiment_id
-                problem_expts.loc[i, 'condition'] = condition
-                problem_expts.loc[i, 'stimuli'] = stimuli
-                problem_expts.loc[i, 'session_subset'] = session_subset
-                problem_expts.loc[i, 'data_type'] = data_type
-                problem_expts.loc[i, 'interpolate'] = interpolate
-                problem_expts.loc[i, 'output_sampling_rate'] = output_sampling_rate
-                problem_expts.loc[i, 'exception'] = e
-                i += 1
+                problems.append({'ophys_experiment_id': ophys_experiment_id,
+                                 'condition': condition,
+                                 'stimuli': stimuli,
+                                 'session_subset': session_subset,
+                                 'data_type': data_type,
+                                 'interpolate': interpolate,
+                                 'output_sampling_rate': output_sampling_rate,
+                                 'exception': e})
+
+    if len(tables) > 0:
+        # concatenate once, in the order the experiments were requested
+        metrics_table = pd.concat([tables[ophys_experiment_id] for ophys_experiment_id in ophys_experiment_ids
+                                   if ophys_experiment_id in tables])
+    else:
+        metrics_table = pd.DataFrame()
+    problem_expts = pd.DataFrame(problems)
 
     save_metrics_loading_exceptions_log_file(problem_expts)
 
@@ -983,16 +1062,18 @@ def load_metrics_loading_exceptions_log_file():
 
 
 def load_and_save_all_metrics_tables_for_all_experiments(ophys_experiment_table, data_type='events', interpolate=False,
-                                                         output_sampling_rate=None):
+                                                         output_sampling_rate=None, n_workers=16):
     """
     loads full trace and cell (stimulus locked) metrics dataframes for all possible scenarios (dff, events, pref stim, all stim etc)
-    for all ophys_experiment_ids in the provided ophys_experiment_table then saves to a single file
+    for all ophys_experiment_ids in the provided ophys_experiment_table then saves to a single consolidated file per scenario,
+    which can be loaded in part using load_metrics_table_for_experiments() with use_consolidated=True
     :param ophys_experiment_table: table of all ophys experiments to use
     :param data_type: which timeseries to get event triggered responses for
                     options: 'filtered_events', 'events', 'dff'
                     not yet implemented: 'running_speed', 'pupil_diameter', 'lick_rate'
     :param interpolate: Boolean, whether or not to interpolate traces
     :param output_sampling_rate: sampling rate for interpolation, only used if interpolate is True
+    :param n_workers: number of threads used to read per-experiment files
 
     :return:
     """
@@ -1010,15 +1091,10 @@ def load_and_save_all_metrics_tables_for_all_experiments(ophys_experiment_table,
                                                            stimuli=stimuli,
                                                            session_subset=session_subset,
                                                            data_type=data_type, interpolate=False,
-                                                           output_sampling_rate=None)
+                                                           output_sampling_rate=None, n_workers=n_workers)
         # save
-        filepath = get_metrics_df_filepath('all_experiments', condition, stimuli,
-                                           session_subset, data_type=data_type, interpolate=False,
-                                           output_sampling_rate=None)
-        if os.path.exists(filepath):
-            os.remove(filepath)
-            print('h5 file exists for all experiments  - overwriting')
-        metrics_table.to_hdf(filepath, key='df')
+        save_consolidated_metrics_table(metrics_table, condition, stimuli, session_subset,
+                                        data_type=data_type, interpolate=False, output_sampling_rate=None)
         print('trace metrics saved for all experiments')
 
     except Exception as e:
@@ -1041,15 +1117,13 @@ def load_and_save_all_metrics_tables_for_all_experiments(ophys_experiment_table,
                                                                        session_subset=session_subset,
                                                                        data_type=data_type,
                                                                        interpolate=interpolate,
-                                                                       output_sampling_rate=output_sampling_rate)
+                                                                       output_sampling_rate=output_sampling_rate,
+                                                                       n_workers=n_workers)
 
                     # save
-                    filepath = get_metrics_df_filepath('all_experiments', condition, stimuli,
-                                                       session_subset, data_type=data_type, interpolate=interpolate, output_sampling_rate=output_sampling_rate)
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-                        print('h5 file exists for all experiments  - overwriting')
-                    metrics_table.to_hdf(filepath, key='df')
+                    save_consolidated_metrics_table(metrics_table, condition, stimulus, session_subset,
+                                                    data_type=data_type, interpolate=interpolate,
+                                                    output_sampling_rate=output_sampling_rate)
                     print('cell metrics saved for all experiments')
 
                 except Exception as e:
@@ -691,6 +691,60 @@ def assign_trial_description(trial, palette='trial_types'):
     return trial_translator(trial['trial_type'], trial['response'], trial['auto_rewarded'])
 
 
+TRIAL_DESCRIPTIONS = ['aborted', 'auto_rewarded', 'hit', 'miss', 'false_alarm', 'correct_reject']
+
+
+def get_trial_descriptions(trials):
+    """ vectorized equivalent of applying `assign_trial_description` to every trial
+
+    Parameters
+    ----------
+    trials : pandas DataFrame
+        dataframe of trials, with `trial_type`, `response` and `auto_rewarded` columns
+
+    Returns
+    -------
+    pandas Series of categoricals with categories TRIAL_DESCRIPTIONS, indexed to trials DataFrame.
+    NaN for trial types without a description
+    """
+    trial_type = trials['trial_type']
+    response = trials['response']
+    responded = response == 1
+
+    conditions = [
+        trial_type == 'aborted',
+        (trials['auto_rewarded'] == True) | (trial_type == 'autorewarded'),  # noqa: E712
+        (trial_type == 'go') & (responded | (response == 'HIT')),
+        trial_type == 'go',
+        (trial_type == 'catch') & (responded | (response == 'FA')),
+        trial_type == 'catch',
+    ]
+    codes = np.select([condition.values for condition in conditions], np.arange(len(TRIAL_DESCRIPTIONS)), default=-1)
+
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories=TRIAL_DESCRIPTIONS),
+        index=trials.index,
+    )
+
+
+@inplace
+def annotate_trial_description(trials):
+    """ adds a categorical `full_trial_type` column with the description of each trial
+
+    Parameters
+    ----------
+    trials : pandas DataFrame
+        dataframe of trials
+    inplace : bool, optional
+        modify `trials` in place. if False, returns a copy. default: True
+
+    See Also
+    --------
+    assign_trial_description
+    """
+    trials['full_trial_type'] = get_trial_descriptions(trials)
+
+
 def assign_color(trial, palette='trial_types'):
 
     trial_type = trial_translator(trial['trial_type'], trial['response'])
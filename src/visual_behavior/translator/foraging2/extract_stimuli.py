@@ -8,55 +8,70 @@ import warnings
 logger = logging.getLogger(__name__)
 
 
-def get_visual_stimuli(stimuli, time):
-    n_frames = len(time)
-
-    data = []
-    for stimuli_group_name, stim_dict in iteritems(stimuli):
+def get_visual_stimuli_df(stimuli, time, include_image_category=True):
+    """builds the table of static stimulus presentations for all stimulus groups
 
-        for idx, (attr_name, attr_value, _time, frame, ) in \
-                enumerate(stim_dict["set_log"]):
-            orientation = attr_value if attr_name.lower() == "ori" else np.nan
-            image_name = attr_value if attr_name.lower() == "image" else np.nan
-
-            if attr_name.lower() == "image" and stim_dict["change_log"]:
-                image_category = _resolve_image_category(
-                    stim_dict["change_log"],
-                    frame
-                )
-            else:
-                image_category = np.nan
-
-            stimulus_epoch = _get_stimulus_epoch(
-                stim_dict["set_log"],
-                idx,
-                frame,
-                n_frames,
-            )
-            draw_epochs = _get_draw_epochs(
-                stim_dict["draw_log"],
-                *stimulus_epoch
-            )
+    Parameters
+    ----------
+    stimuli: dictionary of stimulus groups from the pickle, data['items']['behavior']['stimuli']
+    time: array of frame times
+    include_image_category: if False, image categories are not resolved from the change_log
+        and the image_category column is left out
 
-            for idx, (epoch_start, epoch_end, ) in enumerate(draw_epochs):
+    Returns
+    -------
+    pandas.DataFrame
+        one row per continuous draw epoch, in the order of stimulus group, set_log entry and frame,
+        with columns orientation (float), image_name, image_category, frame, end_frame, time and duration
+    """
+    time = np.asarray(time)
+    n_frames = len(time)
+    columns = ["orientation", "image_name", "image_category", "frame", "end_frame", "time", "duration"]
+    if not include_image_category:
+        columns.remove("image_category")
 
-                # visual stimulus doesn't actually change until start of
-                # following frame, so we need to bump the epoch_start & epoch_end
-                # to get the timing right
-                epoch_start += 1
-                epoch_end += 1
+    group_dfs = []
+    for stimuli_group_name, stim_dict in iteritems(stimuli):
+        set_log = stim_dict["set_log"]
+        if len(set_log) == 0:
+            continue
+        set_index, epoch_start, epoch_end = get_draw_epochs_for_set_log(set_log, stim_dict["draw_log"], n_frames)
+
+        attr_names = np.array([str(attr_name).lower() for attr_name, _, _, _ in set_log])
+        attr_values = np.empty(len(set_log), dtype=object)
+        attr_values[:] = [attr_value for _, attr_value, _, _ in set_log]
+        set_frames = np.array([frame for _, _, _, frame in set_log])
+
+        orientation = np.where(attr_names == "ori", attr_values, np.nan).astype(float)
+        image_name = np.where(attr_names == "image", attr_values, np.nan)
+        image_category = np.full(len(set_log), np.nan, dtype=object)
+        if include_image_category and stim_dict.get("change_log"):
+            is_image = attr_names == "image"
+            image_category[is_image] = resolve_image_categories(stim_dict["change_log"], set_frames[is_image])
+
+        # visual stimulus doesn't actually change until start of
+        # following frame, so we need to bump the epoch_start & epoch_end
+        # to get the timing right
+        epoch_start = epoch_start + 1
+        epoch_end = epoch_end + 1
+
+        group_dfs.append(pd.DataFrame({
+            "orientation": orientation[set_index],
+            "image_name": image_name[set_index],
+            "image_category": image_category[set_index],
+            "frame": epoch_start,
+            "end_frame": epoch_end,
+            "time": time[epoch_start],
+            "duration": time[epoch_end] - time[epoch_start],  # this will always work because an epoch will never occur near the end of time
+        }, columns=columns))
+
+    if len(group_dfs) == 0:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(group_dfs, ignore_index=True)
 
-                data.append({
-                    "orientation": orientation,
-                    "image_name": image_name,
-                    "image_category": image_category,
-                    "frame": epoch_start,
-                    "end_frame": epoch_end,
-                    "time": time[epoch_start],
-                    "duration": time[epoch_end] - time[epoch_start],  # this will always work because an epoch will never occur near the end of time
-                })
 
-    return data
+def get_visual_stimuli(stimuli, time):
+    return get_visual_stimuli_df(stimuli, time).to_dict('records')
 
 
 def check_for_omitted_flashes(stimulus_df, time, omitted_flash_frame_log=None, periodic_flash=None, threshold=2):
@@ -81,62 +96,80 @@ def check_for_omitted_flashes(stimulus_df, time, omitted_flash_frame_log=None, p
     else:
         flash_duration, blank_duration = periodic_flash
 
-        omitted_flash_list = []
+        omitted_flash_frames = []
+        omitted_flash_times = []
         if omitted_flash_frame_log is None:
             # if there was no omitted flash frame log, infer omitted flashes
-            # iterate over all rows with a preceding blank duration greater than threshold
+            # from all rows with a preceding blank duration greater than threshold
 
             stimulus_df['preceding_blank_duration'] = stimulus_df['time'].diff() - stimulus_df['duration']
+            long_blanks = stimulus_df[stimulus_df['preceding_blank_duration'] > threshold * blank_duration]
 
-            for idx, row in stimulus_df[stimulus_df['preceding_blank_duration'] > threshold * blank_duration].iterrows():
+            consecutive_previous_omitted_flashes = np.round(
+                (long_blanks['preceding_blank_duration'].values - blank_duration) / (flash_duration + blank_duration)
+            ).astype(int)
 
-                consecutive_previous_omitted_flashes = int(round((row['preceding_blank_duration'] - blank_duration) / (flash_duration + blank_duration)))
-
-                for inferred_omitted_flash_number in range(consecutive_previous_omitted_flashes):
-                    inferred_blank_time = (1 + inferred_omitted_flash_number) * (flash_duration + blank_duration)
-                    inferred_omitted_flash_time = row['time'] - inferred_blank_time
-                    inferred_omitted_flash_frame = np.argmin(abs(inferred_omitted_flash_time - time))
-
-                    omitted_flash_list.append({
-                        'frame': inferred_omitted_flash_frame,
-                        'time': inferred_omitted_flash_time,
-                    })
+            # grid of expected onsets stepping back from each stimulus that followed a long blank
+            inferred_omitted_flash_number = np.arange(consecutive_previous_omitted_flashes.sum()) - np.repeat(
+                np.cumsum(consecutive_previous_omitted_flashes) - consecutive_previous_omitted_flashes,
+                consecutive_previous_omitted_flashes,
+            )
+            inferred_blank_time = (1 + inferred_omitted_flash_number) * (flash_duration + blank_duration)
+            inferred_omitted_flash_times = np.repeat(long_blanks['time'].values, consecutive_previous_omitted_flashes) - inferred_blank_time
 
-            if len(omitted_flash_list) > 0:
+            if len(inferred_omitted_flash_times) > 0:
+                omitted_flash_frames.append(get_nearest_frames(inferred_omitted_flash_times, time))
+                omitted_flash_times.append(inferred_omitted_flash_times)
                 warnings.warn('\nthere was no omitted_flash_frame_log, but long delays were present that were assumed to be omitted flashes')
 
         elif omitted_flash_frame_log is not None:
-            for stimuli_group_name, omitted_flash_frames in iteritems(omitted_flash_frame_log):
+            stim_frames = stimulus_df['frame'].values
+            time = np.asarray(time)
+            for stimuli_group_name, logged_omitted_flash_frames in iteritems(omitted_flash_frame_log):
+                logged_omitted_flash_frames = np.array(logged_omitted_flash_frames, dtype=int)
 
-                stim_frames = stimulus_df['frame'].values
-                omitted_flash_frames = np.array(omitted_flash_frames)
-
-                #  Test offsets of omitted flash frames to see if they are in the stim log
-                offsets = np.arange(-3, 4)
-                offset_arr = np.add(np.repeat(omitted_flash_frames[:, np.newaxis], offsets.shape[0], axis=1), offsets)
-                matched_any_offset = np.any(np.isin(offset_arr, stim_frames), axis=1)
-
-                #  Remove omitted flashes that also exist in the stimulus log
+                #  Remove omitted flashes that also exist in the stimulus log, within 3 frames
+                matched_any_offset = get_frames_near_stimuli(logged_omitted_flash_frames, stim_frames, tolerance=3)
                 if np.any(matched_any_offset):
                     logger.warn("Removing {} omitted stimuli that also exist in frame log".format(
                         np.sum(matched_any_offset)))
-                was_true_omitted = np.logical_not(matched_any_offset)  # bool
-                omitted_flash_frames_to_keep = omitted_flash_frames[was_true_omitted]
 
                 # Have to remove frames that are double-counted in omitted log
-                omitted_flash_frames_to_keep = np.unique(omitted_flash_frames_to_keep)
+                omitted_flash_frames_to_keep = np.unique(logged_omitted_flash_frames[~matched_any_offset])
 
-                omitted_flash_times = [time[frame] for frame in omitted_flash_frames_to_keep]
+                omitted_flash_frames.append(omitted_flash_frames_to_keep)
+                omitted_flash_times.append(time[omitted_flash_frames_to_keep])
 
-                for omitted_flash_frame, omitted_flash_time in zip(omitted_flash_frames_to_keep,
-                                                                   omitted_flash_times):
+    if sum(len(frames) for frames in omitted_flash_frames) == 0:
+        return pd.DataFrame()
+    return pd.DataFrame({
+        'frame': np.concatenate(omitted_flash_frames),
+        'time': np.concatenate(omitted_flash_times),
+    })
 
-                    omitted_flash_list.append({
-                        'frame': omitted_flash_frame,
-                        'time': omitted_flash_time,
-                    })
 
-    return pd.DataFrame(omitted_flash_list)
+def get_nearest_frames(times, time):
+    """index of the frame in the sorted time array closest to each of times, the earlier frame on ties
+    """
+    time = np.asarray(time)
+    right = np.clip(np.searchsorted(time, times, side='left'), 1, len(time) - 1)
+    left = right - 1
+    use_right = np.abs(time[right] - times) < np.abs(times - time[left])
+    return np.where(use_right, right, left)
+
+
+def get_frames_near_stimuli(frames, stimulus_frames, tolerance=3):
+    """boolean mask of the frames that have a stimulus frame within `tolerance` frames in either direction
+    """
+    frames = np.asarray(frames)
+    stimulus_frames = np.sort(np.asarray(stimulus_frames))
+    if len(stimulus_frames) == 0:
+        return np.zeros(frames.shape, dtype=bool)
+    # first stimulus frame at or after the start of each frame's window
+    first_match = np.searchsorted(stimulus_frames, frames - tolerance, side='left')
+    in_range = first_match < len(stimulus_frames)
+    first_match = np.minimum(first_match, len(stimulus_frames) - 1)
+    return in_range & (stimulus_frames[first_match] <= frames + tolerance)
 
 
 def unpack_change_log(change):
@@ -153,13 +186,20 @@ def unpack_change_log(change):
     )
 
 
-def _resolve_image_category(change_log, frame):
+def resolve_image_categories(change_log, frames):
+    """image category shown at each of frames, using the change_log:
+    the from_category of the first change after the frame, or the to_category of the last change
+    """
+    changes = [unpack_change_log(c) for c in change_log]
+    change_frames = np.array([change['frame'] for change in changes])
+    from_categories = [change['from_category'] for change in changes]
+    # number of changes at or before each frame
+    n_changes = np.searchsorted(change_frames, frames, side='right')
+    return [from_categories[n] if n < len(changes) else changes[-1]['to_category'] for n in n_changes]
 
-    for change in (unpack_change_log(c) for c in change_log):
-        if frame < change['frame']:
-            return change['from_category']
 
-    return change['to_category']
+def _resolve_image_category(change_log, frame):
+    return resolve_image_categories(change_log, [frame])[0]
 
 
 def _get_stimulus_epoch(set_log, current_set_index, start_frame, n_frames):
@@ -171,23 +211,60 @@ def _get_stimulus_epoch(set_log, current_set_index, start_frame, n_frames):
     return (start_frame, next_set_event[3])  # end frame isnt inclusive
 
 
+def get_draw_log_runs(draw_log):
+    """start (inclusive) and end (non-inclusive) frames of each run of consecutive drawn frames in the draw_log
+    """
+    drawn = np.concatenate(([False], np.asarray(draw_log) == 1, [False]))
+    edges = np.flatnonzero(np.diff(drawn.astype(np.int8)))
+    return edges[0::2], edges[1::2]
+
+
+def split_draw_log_runs(run_starts, run_ends, epoch_starts, epoch_stops):
+    """clips draw_log runs to each of a set of epochs
+
+    Parameters
+    ----------
+    run_starts, run_ends: arrays from get_draw_log_runs
+    epoch_starts, epoch_stops: arrays with the first (inclusive) and last (non-inclusive) frame of each epoch
+
+    Returns
+    -------
+    tuple of arrays (epoch_index, draw_start, draw_end), with one entry for each part of a run within an epoch.
+    epochs that stop at or before their start (e.g. repeated set_log frames) have no entries
+    """
+    epoch_starts = np.asarray(epoch_starts)
+    epoch_stops = np.asarray(epoch_stops)
+    # runs that end after the epoch starts and start before the epoch stops
+    first_run = np.searchsorted(run_ends, epoch_starts, side='right')
+    last_run = np.searchsorted(run_starts, epoch_stops, side='left')
+    n_runs = np.clip(last_run - first_run, 0, None)
+
+    epoch_index = np.repeat(np.arange(len(epoch_starts)), n_runs)
+    run_offsets = np.arange(n_runs.sum()) - np.repeat(np.cumsum(n_runs) - n_runs, n_runs)
+    run_index = np.repeat(first_run, n_runs) + run_offsets
+    draw_start = np.maximum(run_starts[run_index], epoch_starts[epoch_index])
+    draw_end = np.minimum(run_ends[run_index], epoch_stops[epoch_index])
+    nonempty = draw_end > draw_start
+    return epoch_index[nonempty], draw_start[nonempty], draw_end[nonempty]
+
+
+def get_draw_epochs_for_set_log(set_log, draw_log, n_frames):
+    """draw epochs for every entry of a stimulus set_log. each set_log entry lasts
+    until the frame of the next entry, or until n_frames for the last entry
+
+    Returns
+    -------
+    tuple of arrays (set_index, epoch_start, epoch_end), epoch_start inclusive and epoch_end non-inclusive
+    """
+    set_frames = np.array([frame for _, _, _, frame in set_log], dtype=int)
+    set_stops = np.append(set_frames[1:], n_frames)
+    run_starts, run_ends = get_draw_log_runs(np.asarray(draw_log)[:n_frames])
+    return split_draw_log_runs(run_starts, run_ends, set_frames, set_stops)
+
+
 def _get_draw_epochs(draw_log, start_frame, stop_frame):
     """start_frame inclusive, stop_frame non-inclusive
     """
-    draw_epochs = []
-    current_frame = start_frame
-
-    while current_frame <= stop_frame:
-        epoch_length = 0
-        while current_frame < stop_frame and draw_log[current_frame] == 1:
-            epoch_length += 1
-            current_frame += 1
-        else:
-            current_frame += 1
-
-        if epoch_length:
-            draw_epochs.append(
-                (current_frame - epoch_length - 1, current_frame - 1, )
-            )
-
-    return draw_epochs
+    run_starts, run_ends = get_draw_log_runs(draw_log)
+    _, draw_start, draw_end = split_draw_log_runs(run_starts, run_ends, [start_frame], [stop_frame])
+    return [(int(start), int(end), ) for start, end in zip(draw_start, draw_end)]
@@ -1,6 +1,8 @@
 from __future__ import print_function
 from dateutil import parser, tz
 from functools import wraps
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import OrderedDict
 import logging
 import numpy as np
 import pandas as pd
@@ -10,6 +12,8 @@ import datetime
 import os
 import h5py
 import cv2
+import threading
+import weakref
 import warnings
 
 from . import database as db
@@ -34,7 +38,10 @@ def flatten_list(in_list):
     return out_list
 
 
-def get_response_rates(df_in, sliding_window=100, apply_trial_number_limit=False):
+RESPONSE_RATE_ENGINES = ['pandas', 'cumsum']
+
+
+def get_response_rates(df_in, sliding_window=100, apply_trial_number_limit=False, engine='pandas'):
     """
     calculates the rolling hit rate, false alarm rate, and dprime value
     Note that the pandas rolling metric deals with NaN values by propogating the previous non-NaN value
@@ -43,12 +50,23 @@ def get_response_rates(df_in, sliding_window=100, apply_trial_number_limit=False
     ----------
     sliding_window : int
         Number of trials over which to calculate metrics
+    engine : str
+        'pandas' (default) uses pandas rolling windows,
+        'cumsum' uses the cumulative sum kernel in `get_response_rates_for_windows`
 
     Returns
     -------
     tuple containing hit rate, false alarm rate, d_prime
 
     """
+    if engine not in RESPONSE_RATE_ENGINES:
+        raise ValueError('engine must be one of {}, not {}'.format(RESPONSE_RATE_ENGINES, engine))
+    if engine == 'cumsum':
+        return get_response_rates_for_windows(
+            df_in,
+            sliding_windows=(sliding_window, ),
+            apply_trial_number_limit=apply_trial_number_limit,
+        )[sliding_window]
 
     from visual_behavior.translator.core.annotate import is_catch, is_hit
 
@@ -86,6 +104,81 @@ def get_response_rates(df_in, sliding_window=100, apply_trial_number_limit=False
     return hit_rate, catch_rate, d_prime
 
 
+def get_go_catch_responses(df_in):
+    """
+    response on each go and catch trial, with the same values as applying `is_hit` and `is_catch` to every row
+
+    Returns
+    -------
+    tuple of arrays (go_responses, catch_responses)
+        go_responses is 1 on hits, 0 on misses and NaN otherwise,
+        catch_responses is 1 on false alarms, 0 on correct rejections and NaN otherwise
+    """
+    from visual_behavior.translator.core.annotate import get_trial_descriptions
+
+    trial_descriptions = get_trial_descriptions(df_in).values
+
+    go_responses = np.where(trial_descriptions == 'hit', 1., np.where(trial_descriptions == 'miss', 0., np.nan))
+    catch_responses = np.where(trial_descriptions == 'false_alarm', 1., np.where(trial_descriptions == 'correct_reject', 0., np.nan))
+
+    return go_responses, catch_responses
+
+
+def rolling_sum_and_count(responses, sliding_window):
+    """
+    rolling sum and count of the non-NaN responses over the last `sliding_window` trials,
+    equivalent to pandas rolling(window=sliding_window, min_periods=0) sum and count.
+    uses one cumulative sum pass, so the cost does not depend on the window size
+    """
+    responded = ~np.isnan(responses)
+    cumulative_sum = np.concatenate(([0.], np.cumsum(np.where(responded, responses, 0.))))
+    cumulative_count = np.concatenate(([0], np.cumsum(responded)))
+
+    window_end = np.arange(1, len(responses) + 1)
+    window_start = np.maximum(window_end - sliding_window, 0)
+
+    return (
+        cumulative_sum[window_end] - cumulative_sum[window_start],
+        cumulative_count[window_end] - cumulative_count[window_start],
+    )
+
+
+def get_response_rates_for_windows(df_in, sliding_windows=(100, ), apply_trial_number_limit=False):
+    """
+    calculates the rolling hit rate, false alarm rate, and dprime value for several window sizes,
+    with the same values as `get_response_rates`
+
+    Parameters
+    ----------
+    sliding_windows : list of ints
+        Numbers of trials over which to calculate metrics
+
+    Returns
+    -------
+    dict
+        keys are the sliding windows, values are tuples containing hit rate, false alarm rate, d_prime
+
+    """
+    go_responses, catch_responses = get_go_catch_responses(df_in)
+
+    response_rates = {}
+    for sliding_window in sliding_windows:
+        rates = []
+        for responses in (go_responses, catch_responses):
+            response_sum, response_count = rolling_sum_and_count(responses, sliding_window)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rate = response_sum / response_count
+                if apply_trial_number_limit:
+                    # avoid values close to 0 and 1, see trial_number_limit
+                    rate = np.clip(rate, 1. / (2 * response_count), 1 - 1. / (2 * response_count))
+            rates.append(rate)
+        hit_rate, catch_rate = rates
+
+        response_rates[sliding_window] = (hit_rate, catch_rate, dprime(hit_rate, catch_rate))
+
+    return response_rates
+
+
 class RisingEdge():
     """
     This object implements a "rising edge" detector on a boolean array.
@@ -449,6 +542,14 @@ class Movie(object):
         path to h5 file. assumes by default that filename matches movie filename, but with .h5 extension
     lazy_load (boolean), defaults True:
         when True, each frame is loaded from disk when requested. When False, the entire movie is loaded into memory on intialization (can be very slow)
+    cache_size (int), defaults 128:
+        number of decoded frames to keep in memory when lazy loading. 0 disables the frame cache
+    prefetch (int), defaults 0:
+        when greater than 0, a background thread decodes this many frames ahead of the most recently requested frame,
+        so that stepping forward through the movie does not wait on the decoder. Should be no larger than cache_size
+    frame_cache_path (string), optional:
+        path to a downsampled greyscale copy of the movie made with make_frame_cache. If it exists, it is memory mapped
+        and frames can be read from it with get_downsampled_frames
 
     Attributes:
     ------------
@@ -458,13 +559,10 @@ class Movie(object):
         width of each frame
     height (int):
         height of each frame
-
-    Todo:
-    --------------
-    - non-lazy-load a defined interval (would this be useful?)
     '''
 
-    def __init__(self, filepath, sync_timestamps=None, h5_filename=None, lazy_load=True):
+    def __init__(self, filepath, sync_timestamps=None, h5_filename=None, lazy_load=True, cache_size=128, prefetch=0,
+                 frame_cache_path=None):
 
         self.cap = cv2.VideoCapture(filepath)
         self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
@@ -491,13 +589,32 @@ class Movie(object):
             # warnings.warn('Movies often have a companion h5 file with a corresponding name. None found for this movie. Expected {}'.format(h5_filename))
             self.timestamps_from_file = None
 
+        # decoded frames, least recently used first. the lock guards the capture object, its position and the cache,
+        # which are shared with the prefetch thread
+        self.cache_size = cache_size
+        self._frame_cache = OrderedDict()
+        self._lock = threading.RLock()
+        self._next_frame = 0
+
+        self.frame_cache = None
+        if frame_cache_path is not None and os.path.exists(frame_cache_path):
+            self.frame_cache = np.load(frame_cache_path, mmap_mode='r')
+
+        self.prefetch = prefetch
+        self._prefetch_request = None
+        self._prefetch_event = threading.Event()
+        self._prefetch_thread = None
+        if self.prefetch > 0:
+            self._prefetch_thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+            self._prefetch_thread.start()
+
         self._lazy_load = lazy_load
         if self._lazy_load == False:
             self._get_array()
         else:
             self.array = None
 
-    def get_frame(self, frame=None, time=None, timestamps='sync'):
+    def _get_frame_index(self, frame=None, time=None, timestamps='sync'):
         if time and timestamps == 'sync':
             assert self.sync_timestamps is not None, 'sync timestamps do not exist'
             timestamps = self.sync_timestamps
@@ -510,13 +627,70 @@ class Movie(object):
         if time is not None and frame is None:
             assert timestamps is not None, 'must pass a timestamp array if referencing by time'
             frame = find_nearest_index(time, timestamps)
+        return frame
 
-        # use open CV to get the frame from disk if lazy mode is True
-        if self._lazy_load:
+    def _move_to_frame(self, frame, max_skip=32):
+        '''
+        positions the capture so that the next read returns frame. must be called with the lock held.
+        seeks when the position is unknown (after a failed read), behind frame, or more than max_skip frames ahead
+        '''
+        if self._next_frame < 0 or frame < self._next_frame or frame - self._next_frame > max_skip:
             self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        else:
+            for _ in range(frame - self._next_frame):
+                self.cap.grab()
+
+    def _read_frame(self, frame, max_skip=32):
+        '''
+        decode one frame from disk, or return it from the frame cache.
+        seeking is slow for compressed movies, so frames shortly after the current position are reached by skipping forward instead
+        '''
+        with self._lock:
+            if frame in self._frame_cache:
+                self._frame_cache.move_to_end(frame)
+                return self._frame_cache[frame]
+            self._move_to_frame(frame, max_skip=max_skip)
             found_frame, frame_array = self.cap.read()
-            if found_frame == True:
-                return frame_array
+            if found_frame != True:
+                # position is unknown after a failed read, force a seek on the next read
+                self._next_frame = -1
+                return None
+            self._next_frame = frame + 1
+            if self.cache_size > 0:
+                self._frame_cache[frame] = frame_array
+                while len(self._frame_cache) > self.cache_size:
+                    self._frame_cache.popitem(last=False)
+            return frame_array
+
+    def _prefetch_loop(self):
+        '''decodes the frames following the most recent request into the frame cache'''
+        while True:
+            self._prefetch_event.wait()
+            self._prefetch_event.clear()
+            start = self._prefetch_request
+            if start is None:
+                # set by close()
+                return
+            for frame in range(start + 1, min(start + 1 + self.prefetch, self.frame_count)):
+                # stop early if a new request came in, it will restart prefetching from the new position
+                if self._prefetch_event.is_set():
+                    break
+                with self._lock:
+                    if frame not in self._frame_cache:
+                        self._read_frame(frame)
+
+    def get_frame(self, frame=None, time=None, timestamps='sync'):
+        frame = self._get_frame_index(frame=frame, time=time, timestamps=timestamps)
+
+        # use open CV to get the frame from disk if lazy mode is True
+        if self._lazy_load:
+            frame_array = self._read_frame(frame)
+            if self._prefetch_thread is not None:
+                self._prefetch_request = frame
+                self._prefetch_event.set()
+            if frame_array is not None:
+                # a copy, so that callers drawing on the frame do not change the cached frame
+                return frame_array.copy()
             else:
                 warnings.warn("Couldn't find frame {}, returning None".format(frame))
                 return None
@@ -524,17 +698,86 @@ class Movie(object):
         else:
             return self.array[frame, :, :]
 
+    def get_frames(self, frames):
+        '''
+        returns an array of shape (len(frames), height, width, 3) with the requested frames, in the order requested.
+        frames are decoded in increasing order so that nearby frames are read without seeking.
+        the returned array is a new array, not a view of the frame cache
+        '''
+        frames = np.asarray(frames, dtype=int)
+        if not self._lazy_load:
+            return self.array[frames]
+        decoded = {}
+        for frame in np.unique(frames):
+            frame_array = self._read_frame(frame)
+            if frame_array is None:
+                raise IndexError("Couldn't find frame {}".format(frame))
+            decoded[frame] = frame_array
+        return np.stack([decoded[frame] for frame in frames])
+
+    def get_frame_range(self, start, stop, step=1):
+        '''returns frames start, start + step, ... up to but not including stop, as an array'''
+        return self.get_frames(np.arange(start, min(stop, self.frame_count), step))
+
+    def iter_frames(self, start=0, stop=None, step=1):
+        '''
+        yields (frame_index, frame_array) reading sequentially from disk, without filling the frame cache.
+        the lock is only held while decoding, so other readers can use the movie between frames
+        '''
+        stop = self.frame_count if stop is None else min(stop, self.frame_count)
+        for frame in range(start, stop, step):
+            with self._lock:
+                # another reader may have moved the capture since the last frame was yielded
+                if frame == start:
+                    self.cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+                else:
+                    self._move_to_frame(frame)
+                found_frame, frame_array = self.cap.read()
+                if not found_frame:
+                    self._next_frame = -1
+                    return
+                self._next_frame = frame + 1
+            yield frame, frame_array
+
+    def make_frame_cache(self, frame_cache_path, downsample=4):
+        '''
+        saves a greyscale copy of the movie, downsampled in space by downsample, as a .npy file that is
+        memory mapped for fast random access. Takes one sequential pass through the movie.
+        '''
+        height = int(np.ceil(self.height / downsample))
+        width = int(np.ceil(self.width / downsample))
+        frame_cache = np.lib.format.open_memmap(frame_cache_path, mode='w+', dtype=np.uint8, shape=(self.frame_count, height, width))
+        for frame, frame_array in self.iter_frames():
+            frame_cache[frame] = frame_array[::downsample, ::downsample, 0]
+        frame_cache.flush()
+        del frame_cache
+        self.frame_cache = np.load(frame_cache_path, mmap_mode='r')
+
+    def get_downsampled_frames(self, frames):
+        '''returns greyscale downsampled frames from the memory mapped frame cache made by make_frame_cache'''
+        assert self.frame_cache is not None, 'no frame cache, use make_frame_cache to create one'
+        return np.asarray(self.frame_cache[np.asarray(frames, dtype=int)])
+
+    def close(self):
+        '''stops the prefetch thread and releases the movie file'''
+        if self._prefetch_thread is not None:
+            self._prefetch_request = None
+            self._prefetch_event.set()
+            self._prefetch_thread.join()
+            self._prefetch_thread = None
+        with self._lock:
+            self._frame_cache.clear()
+            self.cap.release()
+
     def _get_array(self, dtype='uint8'):
         '''iterate over movie, load frames into an in-memory numpy array one at a time (slow and memory intensive)'''
         self.array = np.empty((self.frame_count, self.height, self.width), np.dtype(dtype))
 
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-        for N in range(self.frame_count):
-            found_frame, frame = self.cap.read()
-            if not found_frame:
-                print('something went wrong on frame {}, stopping'.format(frame))
-                break
+        N = -1
+        for N, frame in self.iter_frames():
             self.array[N, :, :] = frame[:, :, 0]
+        if N + 1 != self.frame_count:
+            print('something went wrong on frame {}, stopping'.format(N + 1))
 
 
 def get_sync_data(sync_path):
@@ -550,10 +793,26 @@ def get_sync_data(sync_path):
     return sd
 
 
+def get_movie_frame_count(movie_path):
+    '''number of frames in a movie, read from the container without decoding any frames'''
+    cap = cv2.VideoCapture(movie_path)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return frame_count
+
+
 class EyeTrackingData(object):
+    '''
+    eye tracking ellipse fits and movies for one ophys session.
+
+    Sync data, sync timestamps and ellipse fits are loaded the first time they are accessed.
+    If cache_dir is given, the processed ellipse fits are saved to one file per session in cache_dir the first time they are built,
+    and read from that file on later uses, skipping sync, movie and filtering steps.
+    '''
+
     def __init__(self, ophys_session_id, data_source='filesystem', filter_outliers=True, filter_blinks=True,
                  pupil_color=[0, 255, 247], eye_color=[255, 107, 66], cr_color=[0, 255, 0],
-                 filepaths={}, ellipse_fit_path=None):
+                 filepaths={}, ellipse_fit_path=None, cache_dir=None):
 
         # colors of ellipses:
         self.pupil_color = pupil_color
@@ -561,8 +820,10 @@ class EyeTrackingData(object):
         self.cr_color = cr_color
 
         self.ophys_session_id = ophys_session_id
-        self.ophys_experiment_id = db.convert_id({'ophys_session_id': ophys_session_id}, 'ophys_experiment_id')
-        self.foraging_id = db.get_value_from_table('id', ophys_session_id, 'ophys_sessions', 'foraging_id')
+        self.data_source = data_source
+        self.cache_dir = cache_dir
+        self._filter_outliers = filter_outliers
+        self._filter_blinks = filter_blinks
 
         # get paths of well known files
         well_known_files = db.get_well_known_files(ophys_session_id)
@@ -588,46 +849,98 @@ class EyeTrackingData(object):
         if ellipse_fit_path is not None:
             self.filepaths['ellipse_fits'] = ellipse_fit_path
 
-        # open and process sync data if sync path exists
-        if self.filepaths['sync']:
-            self.sync_data = get_sync_data(self.filepaths['sync'])
-
-            # assign timestamps from sync
-            self.sync_timestamps = {}
-            for movie_label, movie_path in zip(['eye', 'behavior'], [self.filepaths['eye_movie'], self.filepaths['behavior_movie']]):
-                movie = Movie(movie_path)
-                sync_line = self.get_matching_sync_line(movie, self.sync_data)
+        self._sync_data = None
+        self._sync_timestamps = {}
+        self._ellipse_fits = None
 
-                if sync_line is not None:
-                    self.sync_timestamps[movie_label] = self.sync_data[sync_line]
-                else:
-                    self.sync_timestamps[movie_label] = None
-                    warnings.warn('no matching sync line for {}'.format(movie_label))
-
-        # get ellipse fits if path exists
-        if self.filepaths['ellipse_fits']:
-            self.ellipse_fits = {}
-            if data_source == 'filesystem':
-                # get ellipse fits from h5 files
-                for dataset in ['pupil', 'eye', 'cr']:
-                    self.ellipse_fits[dataset] = self.get_eye_data_from_file(self.filepaths['ellipse_fits'], dataset=dataset, timestamps=self.sync_timestamps['eye'])
-                # replace the 'cr' key with 'corneal_reflection for clarity
-                self.ellipse_fits['corneal_reflection'] = self.ellipse_fits.pop('cr')
-
-            elif data_source == 'mongodb':
-                mongo_db = db.Database('visual_behavior_data')
-
-                for dataset in ['pupil', 'eye', 'corneal_reflection']:
-                    res = list(mongo_db['eyetracking'][dataset].find({'ophys_session_id': self.ophys_session_id}))
-                    self.ellipse_fits[dataset] = pd.concat([pd.DataFrame(r['data']) for r in res]).reset_index()
+    @property
+    def ophys_experiment_id(self):
+        if not hasattr(self, '_ophys_experiment_id'):
+            self._ophys_experiment_id = db.convert_id({'ophys_session_id': self.ophys_session_id}, 'ophys_experiment_id')
+        return self._ophys_experiment_id
 
-                mongo_db.close()
+    @property
+    def foraging_id(self):
+        if not hasattr(self, '_foraging_id'):
+            self._foraging_id = db.get_value_from_table('id', self.ophys_session_id, 'ophys_sessions', 'foraging_id')
+        return self._foraging_id
 
-            if filter_outliers:
-                self.filter_outliers()
+    @property
+    def sync_data(self):
+        # open and process sync data if sync path exists
+        if self._sync_data is None and self.filepaths['sync']:
+            self._sync_data = get_sync_data(self.filepaths['sync'])
+        return self._sync_data
+
+    def get_sync_timestamps(self, movie_label):
+        '''sync timestamps for the 'eye' or 'behavior' movie, or None if there is no sync line matching the movie frame count'''
+        if movie_label not in self._sync_timestamps:
+            if self.sync_data is None:
+                return None
+            movie_path = self.filepaths['{}_movie'.format(movie_label)]
+            sync_line = self.get_matching_sync_line(get_movie_frame_count(movie_path), self.sync_data)
+            if sync_line is not None:
+                self._sync_timestamps[movie_label] = self.sync_data[sync_line]
+            else:
+                self._sync_timestamps[movie_label] = None
+                warnings.warn('no matching sync line for {}'.format(movie_label))
+        return self._sync_timestamps[movie_label]
 
-            if filter_blinks:
-                self.filter_blinks()
+    @property
+    def sync_timestamps(self):
+        if self.sync_data is None:
+            return None
+        return {movie_label: self.get_sync_timestamps(movie_label) for movie_label in ['eye', 'behavior']}
+
+    def get_cache_path(self):
+        filename = 'eye_tracking_ophys_session_{}_filter_outliers_{}_filter_blinks_{}.h5'.format(
+            self.ophys_session_id, self._filter_outliers, self._filter_blinks)
+        return os.path.join(self.cache_dir, filename)
+
+    @property
+    def ellipse_fits(self):
+        if self._ellipse_fits is None and self.filepaths['ellipse_fits']:
+            if self.cache_dir is not None and os.path.exists(self.get_cache_path()):
+                self._ellipse_fits = {}
+                for dataset in ['pupil', 'eye', 'corneal_reflection']:
+                    self._ellipse_fits[dataset] = pd.read_hdf(self.get_cache_path(), key=dataset)
+            else:
+                self._ellipse_fits = self._load_ellipse_fits()
+                if self._filter_outliers:
+                    self.filter_outliers()
+                if self._filter_blinks:
+                    self.filter_blinks()
+                if self.cache_dir is not None:
+                    self.save_ellipse_fits()
+        return self._ellipse_fits
+
+    def _load_ellipse_fits(self):
+        ellipse_fits = {}
+        if self.data_source == 'filesystem':
+            # get ellipse fits from h5 files
+            timestamps = self.get_sync_timestamps('eye')
+            for dataset in ['pupil', 'eye', 'cr']:
+                ellipse_fits[dataset] = self.get_eye_data_from_file(self.filepaths['ellipse_fits'], dataset=dataset, timestamps=timestamps)
+            # replace the 'cr' key with 'corneal_reflection for clarity
+            ellipse_fits['corneal_reflection'] = ellipse_fits.pop('cr')
+
+        elif self.data_source == 'mongodb':
+            mongo_db = db.Database('visual_behavior_data')
+
+            for dataset in ['pupil', 'eye', 'corneal_reflection']:
+                res = list(mongo_db['eyetracking'][dataset].find({'ophys_session_id': self.ophys_session_id}))
+                ellipse_fits[dataset] = pd.concat([pd.DataFrame(r['data']) for r in res]).reset_index()
+
+            mongo_db.close()
+        return ellipse_fits
+
+    def save_ellipse_fits(self):
+        '''saves the processed ellipse fits for all three datasets to a single file in cache_dir'''
+        cache_path = self.get_cache_path()
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        for dataset, df in self.ellipse_fits.items():
+            df.to_hdf(cache_path, key=dataset, format='fixed')
 
     def filter_outliers(self, outlier_threshold=3):
         '''
@@ -637,12 +950,13 @@ class EyeTrackingData(object):
         cols_to_check = ['center_x', 'center_y', 'width', 'height']
         for dataset in self.ellipse_fits.keys():
             df = self.ellipse_fits[dataset]
-            df_outliers = pd.DataFrame({parameter: abs(zscore(df[parameter].fillna(df[parameter].mean()))) > outlier_threshold for parameter in cols_to_check})
-            df['likely_outlier'] = df_outliers.any(axis=1)
+            values = df[cols_to_check].to_numpy(dtype=float)
+            values = np.where(np.isnan(values), np.nanmean(values, axis=0), values)
+            df['likely_outlier'] = (np.abs(zscore(values, axis=0)) > outlier_threshold).any(axis=1)
 
     def get_matching_sync_line(self, movie, sync_data):
-        '''determine which sync line matches the frame count of a given movie'''
-        nframes = movie.frame_count
+        '''determine which sync line matches the frame count of a given movie (a Movie object or a frame count)'''
+        nframes = movie.frame_count if isinstance(movie, Movie) else movie
         for candidate_line in ['cam1_exposure_rising', 'cam2_exposure_rising', 'behavior_monitoring_rising', 'eye_tracking_rising']:
             if candidate_line in sync_data.keys() and nframes == len(sync_data[candidate_line]):
                 return candidate_line
@@ -652,54 +966,56 @@ class EyeTrackingData(object):
         '''
         identify and remove fits near blinks
         '''
-        merged = self.ellipse_fits['pupil'].merge(self.ellipse_fits['eye'].rename(columns={'area': 'eye_area'})['eye_area'], left_index=True, right_index=True)
+        pupil = self.ellipse_fits['pupil']
+        eye_area = self.ellipse_fits['eye']['area'].reindex(pupil.index)
         # detect blinks as frames with either a missing eye fit or a missing pupil fit
         # dilate by 2 frames, which will also label the frames before/after a blink as likely blinks. This should avoid the borderline cases where the eye is just shutting and the fit is bad
-        merged['likely_blinks'] = ndimage.binary_dilation(pd.isnull(merged['area']) | pd.isnull(merged['eye_area']) | merged['likely_outlier'] == True, iterations=dilation_frames)
+        likely_blinks = pd.isnull(pupil['area']).values | pd.isnull(eye_area).values | (pupil['likely_outlier'] == True).values
+        likely_blinks = ndimage.binary_dilation(likely_blinks, iterations=dilation_frames)
         for fit_data in self.ellipse_fits.keys():
-            self.ellipse_fits[fit_data]['likely_blinks'] = merged['likely_blinks']
+            self.ellipse_fits[fit_data]['likely_blinks'] = pd.Series(likely_blinks, index=pupil.index)
 
-        fit_parameters = [c for c in self.ellipse_fits['pupil'] if c not in ['frame', 'time', 'likely_blinks']]
+        fit_parameters = [c for c in pupil if c not in ['frame', 'time', 'likely_blinks']]
+        blink_corrected = {}
         for fit_parameter in fit_parameters:
-            # make a new 'blink_corrected' column
-            self.ellipse_fits['pupil']['blink_corrected_{}'.format(fit_parameter)] = self.ellipse_fits['pupil'][fit_parameter]
-
-            # fill likely blinks with nans
-            self.ellipse_fits['pupil'].loc[self.ellipse_fits['pupil'].query('likely_blinks == True').index, 'blink_corrected_{}'.format(fit_parameter)] = np.nan
+            # make a new 'blink_corrected' column, with likely blinks filled with nans
+            data = pd.Series(np.where(likely_blinks, np.nan, pupil[fit_parameter].to_numpy(dtype=float)), index=pupil.index)
 
             if interpolate_over_blinks:
                 # make a 'blink corrected' column that interpolates over the blinks
-                data = self.ellipse_fits['pupil']['blink_corrected_{}'.format(fit_parameter)].interpolate()
-                zs = pd.Series(zscore(data.fillna(data.mean())))
-                data.loc[zs[zs > 5].index] = np.nan
-                self.ellipse_fits['pupil']['blink_corrected_{}'.format(fit_parameter)] = data
+                data = data.interpolate()
+                values = data.to_numpy()
+                zs = zscore(np.where(np.isnan(values), np.nanmean(values), values))
+                data[zs > 5] = np.nan
+            blink_corrected['blink_corrected_{}'.format(fit_parameter)] = data
+        for column, data in blink_corrected.items():
+            pupil[column] = data
 
         # add a column with area normalized relative to 99th percentile area
-        area_99_percentile = np.percentile(self.ellipse_fits['pupil']['blink_corrected_area'].fillna(self.ellipse_fits['pupil']['blink_corrected_area'].median()), 99)
-        self.ellipse_fits['pupil']['normalized_blink_corrected_area'] = self.ellipse_fits['pupil']['blink_corrected_area'] / area_99_percentile
+        area_99_percentile = np.percentile(pupil['blink_corrected_area'].fillna(pupil['blink_corrected_area'].median()), 99)
+        pupil['normalized_blink_corrected_area'] = pupil['blink_corrected_area'] / area_99_percentile
 
     def get_eye_data_from_file(self, eye_tracking_path, dataset='pupil', timestamps=None):
         '''open ellipse fit. try to match sync data if possible'''
 
         df = pd.read_hdf(eye_tracking_path, dataset)
 
-        def area(row):
-            # calculate the area as a circle using the max of the height/width as radius
-            max_dim = max(row['height'], row['width'])
-            return np.pi * max_dim**2
+        # imaginary numbers sometimes show up in the ellipse fits. I'm not sure why, but I'm assuming it's an artifact of the fitting process.
+        # Convert them to real numbers
+        for col in df.columns:
+            if np.iscomplexobj(df[col].values):
+                df[col] = np.real(df[col])
 
-        df['area'] = df[['height', 'width']].apply(area, axis=1)
+        # calculate the area as a circle using the max of the height/width as radius
+        height = df['height'].to_numpy(dtype=float)
+        width = df['width'].to_numpy(dtype=float)
+        df['area'] = np.pi * np.where(width > height, width, height)**2
 
         if timestamps is not None:
             df['time'] = timestamps
 
         df['frame'] = np.arange(len(df)).astype(int)
 
-        # imaginary numbers sometimes show up in the ellipse fits. I'm not sure why, but I'm assuming it's an artifact of the fitting process.
-        # Convert them to real numbers
-        for col in df.columns:
-            df[col] = np.real(df[col])
-
         return df
 
     def add_ellipse(self, image, ellipse_fit_row, color=[1, 1, 1], linewidth=4):
@@ -738,8 +1054,12 @@ class EyeTrackingData(object):
             warnings.warn('cannot specify both frame and time')
             return None
 
-        eye_movie = Movie(self.filepaths['eye_movie'])
-        eye_movie.sync_timestamps = self.sync_timestamps['eye']
+        # keep the movie open between calls so that recently decoded frames are reused.
+        # no prefetch thread, since nothing would stop it
+        if getattr(self, '_eye_movie', None) is None:
+            self._eye_movie = Movie(self.filepaths['eye_movie'])
+        eye_movie = self._eye_movie
+        eye_movie.sync_timestamps = self.get_sync_timestamps('eye')
 
         if time is not None:
             frame = np.argmin(np.abs(time - eye_movie.sync_timestamps))
@@ -933,7 +1253,32 @@ def annotate_licks(dataset, inplace=False, lick_bout_ili=0.7):
         return licks_df
 
 
-def annotate_stimuli(dataset, inplace=False):
+# annotated stimulus presentations from annotate_stimuli, keyed by id of the dataset object
+_annotated_stimuli_cache = {}
+
+
+def clear_annotated_stimuli_cache():
+    _annotated_stimuli_cache.clear()
+
+
+def _get_cached_annotated_stimuli(dataset):
+    dataset_ref, stimulus_presentations = _annotated_stimuli_cache.get(id(dataset), (None, None))
+    if dataset_ref is not None and dataset_ref() is dataset:
+        return stimulus_presentations
+    return None
+
+
+def _cache_annotated_stimuli(dataset, stimulus_presentations):
+    key = id(dataset)
+    try:
+        # the entry is removed when the dataset is garbage collected, so that ids are never reused
+        dataset_ref = weakref.ref(dataset, lambda _: _annotated_stimuli_cache.pop(key, None))
+    except TypeError:
+        return
+    _annotated_stimuli_cache[key] = (dataset_ref, stimulus_presentations)
+
+
+def annotate_stimuli(dataset, inplace=False, use_cache=True):
     '''
     adds the following columns to the stimulus_presentations table, facilitating calculation
     of behavior performance based entirely on the stimulus_presentations table:
@@ -959,6 +1304,9 @@ def annotate_stimuli(dataset, inplace=False):
     inplace : Boolean
         If True, operates on the dataset.stimulus_presentations object directly and returns None
         If False (default), operates on a copy and returns the copy
+    use_cache : Boolean
+        If True (default), the annotated stimuli are computed once per dataset object and reused on later calls.
+        Use clear_annotated_stimuli_cache() if the stimulus, trials or licks tables of a dataset are modified
 
     Returns:
     --------
@@ -966,86 +1314,100 @@ def annotate_stimuli(dataset, inplace=False):
     None (if inplace == True)
     '''
 
+    stimulus_presentations = _get_cached_annotated_stimuli(dataset) if use_cache else None
+    if stimulus_presentations is None:
+        stimulus_presentations = get_annotated_stimuli(dataset.extended_stimulus_presentations, dataset.trials, dataset.licks)
+        if use_cache:
+            _cache_annotated_stimuli(dataset, stimulus_presentations)
+
     if inplace:
-        stimulus_presentations = dataset.extended_stimulus_presentations
+        for column in stimulus_presentations.columns:
+            dataset.extended_stimulus_presentations[column] = stimulus_presentations[column]
     else:
-        stimulus_presentations = dataset.extended_stimulus_presentations.copy()
-
-    # add previous_image_name
-    stimulus_presentations['previous_image_name'] = stimulus_presentations['image_name'].shift()
-
-    # add next_start_time
-    stimulus_presentations['next_start_time'] = stimulus_presentations['start_time'].shift(-1)
+        return stimulus_presentations.copy()
 
-    # add trials_id and trial_stimulus_index
-    stimulus_presentations['trials_id'] = None
-    stimulus_presentations['trial_stimulus_index'] = None
-    last_trial_id = -1
-    trial_stimulus_index = 0
 
-    # add response_lick, response_lick_times, response_lick_latency
-    stimulus_presentations['response_lick'] = False
-    stimulus_presentations['response_lick_times'] = None
-    stimulus_presentations['response_lick_latency'] = None
+def get_annotated_stimuli(stimulus_presentations, trials, licks):
+    '''
+    columnar implementation of annotate_stimuli, on the stimulus presentations, trials and licks tables of a session
 
-    # make a copy of trials with 'start_time' as index to speed lookup
-    trials = dataset.trials.copy().reset_index().set_index('start_time')
+    Parameters:
+    -----------
+    stimulus_presentations : Pandas.DataFrame
+        extended stimulus presentations, indexed by stimulus_presentations_id and sorted by start_time
+    trials : Pandas.DataFrame
+        trials, indexed by trials_id and sorted by start_time
+    licks : Pandas.DataFrame
+        licks, with a sorted timestamps column
 
-    # make a copy of licks with 'timestamps' as index to speed lookup
-    licks = dataset.licks.copy().reset_index().set_index('timestamps')
+    Returns:
+    --------
+    Pandas.DataFrame, a copy of stimulus_presentations with the columns described in annotate_stimuli
+    '''
+    stimulus_presentations = stimulus_presentations.copy()
+    n_stimuli = len(stimulus_presentations)
+    start_time = stimulus_presentations['start_time'].values.astype(float)
 
-    # iterate over every stimulus
-    for idx, row in stimulus_presentations.iterrows():
-        # trials_id is last trials_id with start_time <= stimulus_time
-        try:
-            trials_id = trials.loc[:row['start_time']].iloc[-1]['trials_id']
-        except IndexError:
-            trials_id = -1
-        stimulus_presentations.at[idx, 'trials_id'] = trials_id
+    # add previous_image_name
+    stimulus_presentations['previous_image_name'] = stimulus_presentations['image_name'].shift()
 
-        if trials_id == last_trial_id:
-            trial_stimulus_index += 1
-        else:
-            trial_stimulus_index = 0
-            last_trial_id = trials_id
-        stimulus_presentations.at[idx, 'trial_stimulus_index'] = trial_stimulus_index
-
-        stim_licks = licks.loc[row['start_time']:row['next_start_time'] - 1e-9].index.to_list()  # note the `- 1e-9` acts as a <, as opposed to a <=
-
-        stimulus_presentations.at[idx, 'response_lick_times'] = stim_licks
-        if len(stim_licks) > 0:
-            stimulus_presentations.at[idx, 'response_lick'] = True
-            stimulus_presentations.at[idx, 'response_lick_latency'] = stim_licks[0] - row['start_time']
-
-    # merge in auto_rewarded column from trials table
-    stimulus_presentations = stimulus_presentations.reset_index().merge(
-        dataset.trials[['auto_rewarded']],
-        on='trials_id',
-        how='left',
-    ).set_index('stimulus_presentations_id')
-
-    # add previous_response_on_trial
-    stimulus_presentations['previous_response_on_trial'] = False
-    # set 'stimulus_presentations_id' and 'trials_id' as indices to speed lookup
-    stimulus_presentations = stimulus_presentations.reset_index().set_index(['stimulus_presentations_id', 'trials_id'])
-    for idx, row in stimulus_presentations.iterrows():
-        stim_id, trials_id = idx
-        # get all stimuli before the current on the current trial
-        mask = (stimulus_presentations.index.get_level_values(0) < stim_id) & (stimulus_presentations.index.get_level_values(1) == trials_id)
-        # check to see if any previous stimuli have a response lick
-        stimulus_presentations.at[idx, 'previous_response_on_trial'] = stimulus_presentations[mask]['response_lick'].any()
-    # set the index back to being just 'stimulus_presentations_id'
-    stimulus_presentations = stimulus_presentations.reset_index().set_index('stimulus_presentations_id')
-
-    # add could_change
-    stimulus_presentations['could_change'] = False
-    for idx, row in stimulus_presentations.iterrows():
-        # check if we meet conditions where a change could occur on this stimulus (at least 4th flash of trial, no previous change on trial)
-        if row['trial_stimulus_index'] >= 4 and row['previous_response_on_trial'] == False and row['image_name'] != 'omitted' and row['previous_image_name'] != 'omitted':
-            stimulus_presentations.at[idx, 'could_change'] = True
+    # add next_start_time
+    stimulus_presentations['next_start_time'] = stimulus_presentations['start_time'].shift(-1)
 
-    if inplace == False:
-        return stimulus_presentations
+    # add trials_id: last trials_id with start_time <= stimulus start_time, -1 before the first trial
+    trial_index = np.searchsorted(trials['start_time'].values, start_time, side='right') - 1
+    trials_id = np.where(trial_index >= 0, trials.index.values[np.maximum(trial_index, 0)], -1)
+
+    # add trial_stimulus_index, counting stimuli since trials_id last changed (stimuli before the first trial count from 1)
+    new_trial = trials_id != np.concatenate(([-1], trials_id[:-1]))
+    trial_first_stimulus = np.maximum.accumulate(np.where(new_trial, np.arange(n_stimuli), -1))
+    trial_stimulus_index = np.arange(n_stimuli) - trial_first_stimulus
+
+    # add response_lick, response_lick_times, response_lick_latency from the licks in [start_time, next_start_time)
+    lick_times = licks['timestamps'].values.astype(float)
+    next_start_time = stimulus_presentations['next_start_time'].values.astype(float)
+    first_lick = np.searchsorted(lick_times, start_time, side='left')
+    last_lick = np.where(
+        np.isnan(next_start_time),
+        len(lick_times),
+        np.searchsorted(lick_times, next_start_time - 1e-9, side='right'),  # note the `- 1e-9` acts as a <, as opposed to a <=
+    )
+    last_lick = np.maximum(last_lick, first_lick)
+    response_lick = last_lick > first_lick
+    response_lick_latency = np.full(n_stimuli, np.nan)
+    response_lick_latency[response_lick] = lick_times[first_lick[response_lick]] - start_time[response_lick]
+
+    stimulus_presentations['trials_id'] = trials_id
+    stimulus_presentations['trial_stimulus_index'] = trial_stimulus_index
+    stimulus_presentations['response_lick'] = response_lick
+    stimulus_presentations['response_lick_times'] = [lick_times[first:last].tolist() for first, last in zip(first_lick, last_lick)]
+    stimulus_presentations['response_lick_latency'] = response_lick_latency
+
+    # add auto_rewarded column from trials table
+    stimulus_presentations['auto_rewarded'] = trials['auto_rewarded'].reindex(trials_id).values
+
+    # add previous_response_on_trial: any response lick on an earlier stimulus of the same trial
+    order = np.lexsort((stimulus_presentations.index.values, trials_id))
+    sorted_trials_id = trials_id[order]
+    sorted_responses = response_lick[order].astype(int)
+    responses_before = np.cumsum(sorted_responses) - sorted_responses
+    sorted_new_trial = np.concatenate(([True], sorted_trials_id[1:] != sorted_trials_id[:-1]))
+    trial_start = np.maximum.accumulate(np.where(sorted_new_trial, np.arange(n_stimuli), 0))
+    previous_response_on_trial = np.zeros(n_stimuli, dtype=bool)
+    previous_response_on_trial[order] = (responses_before - responses_before[trial_start]) > 0
+    stimulus_presentations['previous_response_on_trial'] = previous_response_on_trial
+
+    # add could_change: at least the fourth stimulus flash in the trial, no previous response on trial, no omitted flashes
+    stimulus_presentations['could_change'] = (
+        (trial_stimulus_index >= 4)
+        & ~previous_response_on_trial
+        & (stimulus_presentations['image_name'] != 'omitted').values
+        & (stimulus_presentations['previous_image_name'] != 'omitted').values
+    )
+
+    # trials_id first, as in the original row-wise implementation
+    columns = ['trials_id'] + [column for column in stimulus_presentations.columns if column != 'trials_id']
+    return stimulus_presentations[columns]
 
 
 def get_behavior_stats(behavior_session_id, method='stimulus_based', engaged_only=True, per_image=False):
@@ -1092,10 +1454,31 @@ def get_behavior_stats(behavior_session_id, method='stimulus_based', engaged_onl
             error - the error string associated with the failure
 
     '''
-    output_dict = {'behavior_session_id': behavior_session_id}
     print('getting metrics for behavior_session_id:', behavior_session_id)
-    session = loading.get_behavior_dataset(behavior_session_id, from_nwb=True,
-                                           get_extended_stimulus_presentations=True, get_extended_trials=True)
+    session = load_behavior_stats_session(behavior_session_id)
+    return compute_behavior_stats(session, behavior_session_id, method=method, engaged_only=engaged_only, per_image=per_image)
+
+
+def load_behavior_stats_session(behavior_session_id):
+    '''
+    loads the session object used by `get_behavior_stats`, with extended stimulus presentations and trials
+    '''
+    return loading.get_behavior_dataset(behavior_session_id, from_nwb=True,
+                                        get_extended_stimulus_presentations=True, get_extended_trials=True)
+
+
+def compute_behavior_stats(session, behavior_session_id, method='stimulus_based', engaged_only=True, per_image=False, stimulus_presentations=None):
+    '''
+    computes behavior stats for an already loaded session, see `get_behavior_stats` for details
+
+    Parameters:
+    -----------
+    session : BehaviorSession object, from `load_behavior_stats_session`
+    stimulus_presentations : pandas.DataFrame
+        the output of annotate_stimuli(session), used by method='stimulus_based'.
+        computed from the session if None (default). pass it in to share it across several calls on the same session
+    '''
+    output_dict = {'behavior_session_id': behavior_session_id}
     try:
         if method == 'trial_based':
 
@@ -1151,7 +1534,8 @@ def get_behavior_stats(behavior_session_id, method='stimulus_based', engaged_onl
 
         elif method == 'stimulus_based':
 
-            stimulus_presentations = annotate_stimuli(session, inplace=False)
+            if stimulus_presentations is None:
+                stimulus_presentations = annotate_stimuli(session, inplace=False)
             print(len(stimulus_presentations), 'total stimulus presentations')
 
             if engaged_only == True:
@@ -1288,14 +1672,7 @@ def cache_behavior_stats(behavior_session_id, method='stimulus_based', engaged_o
     print('behavior_session_id:', behavior_session_id)
     cache_dir = get_behavior_stats_cache_dir(method=method, engaged_only=engaged_only, per_image=per_image)
     behavior_stats = get_behavior_stats(behavior_session_id, method=method, engaged_only=engaged_only, per_image=per_image)
-    if per_image == True:
-        behavior_stats_df = pd.DataFrame()
-        for image_name in list(behavior_stats.keys()):
-            tmp = pd.DataFrame(behavior_stats[image_name], index=[image_name])
-            behavior_stats_df = pd.concat([behavior_stats_df, tmp])
-        behavior_stats_df = behavior_stats_df.reset_index(drop=True)
-    else:
-        behavior_stats_df = pd.DataFrame(behavior_stats, index=[behavior_session_id])
+    behavior_stats_df = behavior_stats_to_df(behavior_stats, behavior_session_id, per_image=per_image)
 
     filename = 'behavior_session_id={}.h5'.format(behavior_session_id)
     filepath = os.path.join(cache_dir, filename)
@@ -1308,6 +1685,25 @@ def cache_behavior_stats(behavior_session_id, method='stimulus_based', engaged_o
     return behavior_stats_df
 
 
+def behavior_stats_to_df(behavior_stats, behavior_session_id, per_image=False):
+    '''
+    converts the output of `get_behavior_stats` to a dataframe,
+    with one row per image_name if per_image is True, one row otherwise.
+    always has a behavior_session_id column, which the output of method='sdk' does not include
+    '''
+    if per_image == True and 'error' not in behavior_stats:
+        behavior_stats_df = pd.DataFrame()
+        for image_name in list(behavior_stats.keys()):
+            tmp = pd.DataFrame(behavior_stats[image_name], index=[image_name])
+            behavior_stats_df = pd.concat([behavior_stats_df, tmp])
+        behavior_stats_df = behavior_stats_df.reset_index(drop=True)
+    else:
+        behavior_stats_df = pd.DataFrame(behavior_stats, index=[behavior_session_id])
+    if 'behavior_session_id' not in behavior_stats_df.columns:
+        behavior_stats_df.insert(0, 'behavior_session_id', behavior_session_id)
+    return behavior_stats_df
+
+
 def cache_response_probability(behavior_session_id, engaged_only=True):
     '''
     calculates response probability matrix for all image transitions and saves to file
@@ -1360,3 +1756,182 @@ def get_cached_behavior_stats(behavior_session_id, engaged_only=True, method='st
     fn = os.path.join(cache_dir, 'behavior_session_id={}.h5'.format(behavior_session_id))
 
     return pd.read_hdf(fn, key='data')
+
+
+# (method, engaged_only, per_image) for every cached variant of the behavior stats.
+# the sdk metrics do not depend on engaged_only or per_image, so there is one sdk variant
+BEHAVIOR_STATS_VARIANTS = [
+    (method, engaged_only, per_image)
+    for method in ['trial_based', 'stimulus_based']
+    for engaged_only in [True, False]
+    for per_image in [False, True]
+] + [('sdk', False, False)]
+
+
+def get_behavior_stats_store_path():
+    '''
+    path to the single HDF5 store written by `cache_behavior_stats_for_sessions`
+    '''
+    import visual_behavior.data_access.loading as loading
+    return os.path.join(loading.get_platform_analysis_cache_dir(), 'behavior_performance', 'behavior_stats.h5')
+
+
+def get_behavior_stats_store_key(method='stimulus_based', engaged_only=True, per_image=False):
+    '''
+    key of the partition of the behavior stats store holding one variant,
+    named like the per-session cache directories from `get_behavior_stats_cache_dir`.
+    engaged_only and per_image are ignored for method='sdk', which has a single partition
+    '''
+    if method == 'sdk':
+        return method
+    key = method
+    if per_image:
+        key = key + '_per_image'
+    if engaged_only:
+        key = key + '_engaged_only'
+    return key
+
+
+def get_behavior_stats_for_variants(behavior_session_id, variants=BEHAVIOR_STATS_VARIANTS):
+    '''
+    calculates behavior stats for a given session for several variants of method, engaged_only and per_image.
+    the session is loaded once, and stimulus presentations are annotated once, for all variants
+
+    Parameters:
+    -----------
+    behavior_session_id : int
+        behavior session ID of interest
+    variants : list of (method, engaged_only, per_image) tuples
+        default = BEHAVIOR_STATS_VARIANTS, all variants
+
+    Returns:
+    --------
+    dictionary with (method, engaged_only, per_image) keys and dataframes of behavior stats as values,
+    see `get_behavior_stats` for the columns. failures have an `error` column with the error string
+    '''
+    print('getting metrics for behavior_session_id:', behavior_session_id)
+    try:
+        session = load_behavior_stats_session(behavior_session_id)
+    except Exception as e:
+        print('Failed to load session!')
+        print(e)
+        return {variant: behavior_stats_to_df({'behavior_session_id': behavior_session_id, 'error': str(e)}, behavior_session_id)
+                for variant in variants}
+
+    stimulus_presentations = None
+    annotation_error = None
+    if any(method == 'stimulus_based' for method, _, _ in variants):
+        try:
+            stimulus_presentations = annotate_stimuli(session, inplace=False)
+        except Exception as e:
+            annotation_error = e
+
+    behavior_stats = {}
+    for method, engaged_only, per_image in variants:
+        if method == 'stimulus_based' and annotation_error is not None:
+            stats = {'behavior_session_id': behavior_session_id, 'error': annotation_error}
+        else:
+            stats = compute_behavior_stats(session, behavior_session_id, method=method, engaged_only=engaged_only,
+                                           per_image=per_image, stimulus_presentations=stimulus_presentations)
+        if 'error' in stats:
+            stats['error'] = str(stats['error'])
+        behavior_stats[(method, engaged_only, per_image)] = behavior_stats_to_df(stats, behavior_session_id, per_image=per_image)
+
+    return behavior_stats
+
+
+def write_behavior_stats_partition(behavior_stats_df, store_path, key):
+    '''
+    writes behavior stats for many sessions to one partition of the behavior stats store.
+    rows already in the partition for the same sessions are replaced, rows for other sessions are kept
+    '''
+    behavior_stats_df = behavior_stats_df.reset_index(drop=True)
+    if os.path.exists(store_path):
+        with pd.HDFStore(store_path, mode='r') as store:
+            if '/' + key in store.keys():
+                existing = store.select(key)
+                existing = existing[~existing['behavior_session_id'].isin(behavior_stats_df['behavior_session_id'])]
+                behavior_stats_df = pd.concat([existing, behavior_stats_df], ignore_index=True, sort=False)
+
+    # table format needs string object columns, such as image_name and error
+    for column in behavior_stats_df.columns[behavior_stats_df.dtypes == object]:
+        behavior_stats_df[column] = behavior_stats_df[column].where(behavior_stats_df[column].notnull(), '').astype(str)
+
+    behavior_stats_df.to_hdf(store_path, key=key, mode='a', format='table', data_columns=['behavior_session_id'])
+
+
+def cache_behavior_stats_for_sessions(behavior_session_ids, variants=BEHAVIOR_STATS_VARIANTS, n_workers=8, store_path=None):
+    '''
+    calculates behavior stats for many sessions and all variants in a pool of worker processes,
+    and saves them to a single HDF5 store with one partition per variant.
+    load the results with `load_cached_behavior_stats`
+
+    Parameters:
+    -----------
+    behavior_session_ids : list of ints
+        behavior session IDs of interest
+    variants : list of (method, engaged_only, per_image) tuples
+        default = BEHAVIOR_STATS_VARIANTS, all variants
+    n_workers : int
+        number of worker processes, sessions are processed in this process if 1 (default = 8)
+    store_path : str
+        path of the HDF5 store, default from `get_behavior_stats_store_path`
+
+    Returns:
+    --------
+    dictionary with (method, engaged_only, per_image) keys and dataframes of behavior stats for all sessions as values
+    '''
+    if store_path is None:
+        store_path = get_behavior_stats_store_path()
+
+    session_results = []
+    if n_workers == 1:
+        for behavior_session_id in behavior_session_ids:
+            session_results.append(get_behavior_stats_for_variants(behavior_session_id, variants))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(get_behavior_stats_for_variants, behavior_session_id, variants): behavior_session_id
+                       for behavior_session_id in behavior_session_ids}
+            for future in as_completed(futures):
+                try:
+                    session_results.append(future.result())
+                except Exception as e:
+                    print('behavior stats failed for behavior_session_id {}, error:  {}'.format(futures[future], e))
+
+    behavior_stats = {}
+    for variant in variants:
+        variant_dfs = [result[variant] for result in session_results if variant in result]
+        if len(variant_dfs) == 0:
+            continue
+        behavior_stats[variant] = pd.concat(variant_dfs, ignore_index=True, sort=False)
+        write_behavior_stats_partition(behavior_stats[variant], store_path, get_behavior_stats_store_key(*variant))
+    print('behavior stats for {} sessions saved to {}'.format(len(session_results), store_path))
+
+    return behavior_stats
+
+
+def load_cached_behavior_stats(behavior_session_ids=None, method='stimulus_based', engaged_only=True, per_image=False, store_path=None):
+    '''
+    loads behavior stats for many sessions from the store written by `cache_behavior_stats_for_sessions`, in one read
+
+    Parameters:
+    -----------
+    behavior_session_ids : list of ints
+        behavior session IDs to load. all sessions in the store if None (default)
+    method, engaged_only, per_image :
+        the variant to load, see `get_behavior_stats`
+    store_path : str
+        path of the HDF5 store, default from `get_behavior_stats_store_path`
+
+    Returns:
+    --------
+    dataframe of behavior stats, one row per session (or per session and image_name if per_image is True)
+    '''
+    if store_path is None:
+        store_path = get_behavior_stats_store_path()
+    key = get_behavior_stats_store_key(method=method, engaged_only=engaged_only, per_image=per_image)
+
+    if behavior_session_ids is None:
+        return pd.read_hdf(store_path, key=key)
+    behavior_session_ids = [int(behavior_session_id) for behavior_session_id in behavior_session_ids]
+    return pd.read_hdf(store_path, key=key, where='behavior_session_id in {}'.format(behavior_session_ids))
@@ -3,7 +3,9 @@ import warnings
 import numpy as np
 import pandas as pd
 from .extended_trials import get_first_lick_relative_to_scheduled_change
+from .extended_trials_vectorized import flatten_trial_lists, get_first_values, get_trial_index, get_window_edges
 from visual_behavior.change_detection.running.metrics import count_wraps
+from visual_behavior.translator.foraging2.extract_stimuli import get_frames_near_stimuli
 from scipy.ndimage import median_filter as medfilt
 
 
@@ -234,12 +236,11 @@ def validate_omitted_flashes_are_omitted(core_data):
         )
         return True
 
-    for frame in omitted_stimuli['frame']:
-        for offset in range(-3, 4, 1):
-            if frame + offset in core_data['visual_stimuli']['frame'].tolist():
-                return False
-    else:
-        return True
+    return not np.any(get_frames_near_stimuli(
+        omitted_stimuli['frame'].values,
+        core_data['visual_stimuli']['frame'].values,
+        tolerance=3,
+    ))
 
 
 def get_licks_in_response_window(row, response_window=[0, 0], response_window_threshold=1 / 60 / 2):
@@ -269,6 +270,51 @@ def get_first_lick_reward_latency(row):
             return row['reward_times'][0] - row['licks_in_response_window'][0]
 
 
+def get_response_window_licks(trials, response_window=[0, 0], response_window_threshold=1 / 60 / 2):
+    '''
+    licks in the response window and the latency from the first of them to the first reward, for all trials at once
+
+    same values as applying get_licks_in_response_window and get_first_lick_reward_latency to every trial
+
+    Parameters
+    ----------
+    trials: trials dataframe with lick_times, change_time and reward_times columns
+    response_window: [start, end] of the response window, relative to the change
+    response_window_threshold: narrows the window at both ends, 1/2 frame width by default
+
+    Returns
+    -------
+    pandas.DataFrame
+        indexed like trials, with columns licks_in_response_window (array of lick times), number_of_licks_in_response_window
+        and lick_reward_latency (inf when there was no reward, NaN when there were no licks in the window)
+    '''
+    lick_times, offsets = flatten_trial_lists(trials['lick_times'])
+    trial_index = get_trial_index(offsets)
+    licks_relative_to_change = lick_times - np.asarray(trials['change_time'], dtype=float)[trial_index]
+    window_start, window_end = get_window_edges(response_window, response_window_threshold, 'inside')
+    with np.errstate(invalid='ignore'):
+        # licks on trials without a change are never in the window
+        in_window = (licks_relative_to_change >= window_start) & (licks_relative_to_change <= window_end)
+
+    # licks in the window, grouped by trial
+    window_licks = lick_times[in_window]
+    number_of_licks = np.bincount(trial_index[in_window], minlength=len(trials))
+    window_offsets = np.concatenate(([0], np.cumsum(number_of_licks)))
+
+    first_reward = get_first_values(*flatten_trial_lists(trials['reward_times']))
+    lick_reward_latency = np.where(
+        number_of_licks > 0,
+        np.where(np.isnan(first_reward), np.inf, first_reward - get_first_values(window_licks, window_offsets)),
+        np.nan,
+    )
+
+    return pd.DataFrame({
+        'licks_in_response_window': np.split(window_licks, window_offsets[1:-1]) if len(trials) > 0 else [],
+        'number_of_licks_in_response_window': number_of_licks,
+        'lick_reward_latency': lick_reward_latency,
+    }, index=trials.index)
+
+
 def validate_reward_follows_first_lick_in_window(core_data, reward_latency_threshold=0.001):
     '''
     on non-autorewarded go trials, the first lick in the response window should have
@@ -277,9 +323,9 @@ def validate_reward_follows_first_lick_in_window(core_data, reward_latency_thres
     tr = core_data['trials']
 
     # add some columns for convenience
-    tr['licks_in_response_window'] = tr.apply(get_licks_in_response_window, axis=1, response_window=core_data['metadata']['response_window'])
-    tr['number_of_licks_in_response_window'] = tr['licks_in_response_window'].map(lambda x: len(x))
-    tr['lick_reward_latency'] = tr.apply(get_first_lick_reward_latency, axis=1)
+    response_window_licks = get_response_window_licks(tr, response_window=core_data['metadata']['response_window'])
+    for column in response_window_licks.columns:
+        tr[column] = response_window_licks[column]
 
     # find errant trials
     errant_trials = tr[
@@ -291,11 +337,11 @@ def validate_reward_follows_first_lick_in_window(core_data, reward_latency_thres
 
     # fail if there were any errant trials
     if len(errant_trials) > 0:
-        for idx, trial in errant_trials.iterrows():
+        for idx, lick_reward_latency in zip(errant_trials.index, errant_trials['lick_reward_latency']):
             # print out the reason for the failure
             print('trial {} had a latency of {:.5f} seconds between the first lick and the reward, the maximum allowable latency is {}'.format(
                 idx,
-                trial['lick_reward_latency'],
+                lick_reward_latency,
                 reward_latency_threshold
             ))
         return False
@@ -0,0 +1,536 @@
+'''
+array-based versions of the row-wise validators in `extended_trials`
+
+every function here has the same name, arguments and return value as the function it replaces
+in `extended_trials`. Per-trial lists (e.g. `lick_times`, `reward_times`) are flattened into a
+single array of values with per-trial offsets, so each validator is a handful of numpy
+operations instead of a loop over trials.
+
+select this module with `qc.compute_qc_metrics(core_data, engine='vectorized')`
+'''
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from visual_behavior.translator.core import annotate
+
+from . import extended_trials as et
+
+
+# arrays for per-trial lists, keyed by id of the list, while cache_trial_arrays is active
+_trial_array_cache = None
+
+
+@contextmanager
+def cache_trial_arrays():
+    '''
+    while active, each per-trial list (e.g. the lick_times of one trial) is converted to an array once
+    and reused by every validator that flattens it, including validators run on subsets of the trials
+    '''
+    global _trial_array_cache
+    outermost = _trial_array_cache is None
+    if outermost:
+        _trial_array_cache = {}
+    try:
+        yield
+    finally:
+        if outermost:
+            _trial_array_cache = None
+
+
+def _list_to_array(values):
+    if values is None:
+        return np.empty(0)
+    cache = _trial_array_cache
+    if cache is not None:
+        cached = cache.get(id(values))
+        # keep a reference to the list so its id can not be reused while cached
+        if cached is not None and cached[0] is values:
+            return cached[1]
+    array = np.atleast_1d(np.asarray(values, dtype=float))
+    if cache is not None:
+        cache[id(values)] = (values, array)
+    return array
+
+
+def flatten_trial_lists(values):
+    '''
+    flattens a column of per-trial lists (e.g. trials['lick_times'])
+
+    Parameters
+    ----------
+    values: iterable of lists, one per trial
+
+    Returns
+    -------
+    tuple of arrays (flat, offsets)
+        flat: float array with all values, trial by trial
+        offsets: int array of length n_trials + 1, values for trial i are flat[offsets[i]:offsets[i + 1]]
+    '''
+    lists = [_list_to_array(v) for v in values]
+    counts = np.array([len(v) for v in lists], dtype=int)
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    flat = np.concatenate(lists) if len(lists) > 0 else np.empty(0)
+    return flat, offsets
+
+
+def get_trial_index(offsets):
+    '''trial number of each flattened value'''
+    counts = np.diff(offsets)
+    return np.repeat(np.arange(len(counts)), counts)
+
+
+def get_first_values(flat, offsets):
+    '''first value of each trial, nan for trials without values'''
+    counts = np.diff(offsets)
+    first = np.full(len(counts), np.nan)
+    has_values = counts > 0
+    first[has_values] = flat[offsets[:-1][has_values]]
+    return first
+
+
+def get_last_values(flat, offsets):
+    '''last value of each trial, nan for trials without values'''
+    counts = np.diff(offsets)
+    last = np.full(len(counts), np.nan)
+    has_values = counts > 0
+    last[has_values] = flat[offsets[1:][has_values] - 1]
+    return last
+
+
+def count_masked_values(offsets, mask):
+    '''number of values in each trial where mask is True'''
+    return np.bincount(get_trial_index(offsets)[mask], minlength=len(offsets) - 1)
+
+
+def get_window_edges(response_window, tolerance, tolerance_direction):
+    '''response window edges, widened for 'outside' or narrowed for 'inside' by tolerance'''
+    response_window = np.asarray(response_window, dtype=float)
+    if tolerance_direction == 'outside':
+        return response_window[..., 0] - tolerance, response_window[..., 1] + tolerance
+    else:
+        return response_window[..., 0] + tolerance, response_window[..., 1] - tolerance
+
+
+def get_licks_in_response_window_mask(lick_times, change_times, response_windows, tolerance=0.01, tolerance_direction='inside'):
+    '''
+    finds licks in the response window of their trial
+
+    Parameters
+    ----------
+    lick_times: per-trial lists of lick times
+    change_times: array of change times, one per trial
+    response_windows: a single [start, end] response window, or one per trial
+
+    Returns
+    -------
+    tuple (licks_relative_to_change, offsets, in_window)
+        flattened lick times relative to the change on their trial, their per-trial offsets, and a
+        boolean mask of the licks within the response window. Licks on trials without a change are never in the window
+    '''
+    flat, offsets = flatten_trial_lists(lick_times)
+    trial_index = get_trial_index(offsets)
+    licks_relative_to_change = flat - np.asarray(change_times, dtype=float)[trial_index]
+
+    left_edge, right_edge = get_window_edges(response_windows, tolerance, tolerance_direction)
+    if np.ndim(left_edge) > 0:
+        left_edge, right_edge = left_edge[trial_index], right_edge[trial_index]
+    with np.errstate(invalid='ignore'):
+        in_window = (licks_relative_to_change >= left_edge) & (licks_relative_to_change <= right_edge)
+    return licks_relative_to_change, offsets, in_window
+
+
+def get_response_windows(trials):
+    '''array of per-trial response windows, shape (n_trials, 2)'''
+    return np.array([list(response_window) for response_window in trials['response_window']], dtype=float).reshape(-1, 2)
+
+
+def nanis_equal(v1, v2):
+    '''
+    element-wise version of utils.nanis_equal: checks equality, with nulls equal to each other
+    '''
+    v1 = pd.Series(np.asarray(v1, dtype=object))
+    v2 = pd.Series(np.asarray(v2, dtype=object))
+    null_1 = pd.isnull(v1).values
+    null_2 = pd.isnull(v2).values
+    return (null_1 & null_2) | (~null_1 & ~null_2 & (v1.values == v2.values))
+
+
+def get_run_lengths(in_run):
+    '''number of consecutive True values up to and including each element, 0 where in_run is False'''
+    in_run = np.asarray(in_run, dtype=bool)
+    position = np.arange(len(in_run))
+    last_reset = np.maximum.accumulate(np.where(in_run, -1, position)) if len(in_run) > 0 else position
+    return np.where(in_run, position - last_reset, 0)
+
+
+def validate_aborted_change_time(trials):
+    return all((trials['trial_type'] != 'aborted').values | pd.isnull(trials['change_time']).values)
+
+
+def identify_consecutive_aborted_blocks(trials, failure_repeats):
+    '''
+    adds columns to the dataframe that:
+        1 - track the number of consecutive aborted trials
+        2 - assigns a unique integer to each 'failure_repeats' long block of aborted trials
+    '''
+    aborted = (trials['trial_type'] == 'aborted').values
+    consecutive_aborted = get_run_lengths(aborted)
+    # a new block starts whenever the number of previous consecutive aborted trials is a multiple of failure_repeats + 1
+    new_block = aborted & ((consecutive_aborted - 1) % (failure_repeats + 1) == 0)
+
+    trials['consecutive_aborted'] = consecutive_aborted
+    trials['consecutive_aborted_should_match'] = np.cumsum(new_block)
+
+    return trials
+
+
+def count_stimuli_per_trial(trials, visual_stimuli):
+    '''
+    counts stimulus groups in range of trial frames for each trial
+    returns vector with all numbers of stimuli per trial
+    '''
+    frames = visual_stimuli['frame'].values
+    end_frames = visual_stimuli['end_frame'].values
+    # the index ranges below rely on the stimuli being in frame order
+    if not (np.all(np.diff(frames) >= 0) and np.all(np.diff(end_frames) >= 0)):
+        return et.count_stimuli_per_trial(trials, visual_stimuli)
+
+    if all(pd.isnull(visual_stimuli.image_category)) == False:
+        col_to_check = 'image_category'
+    elif all(pd.isnull(visual_stimuli.orientation)) == False:
+        col_to_check = 'orientation'
+    else:
+        return np.zeros(len(trials))
+    codes, _ = pd.factorize(visual_stimuli[col_to_check])
+
+    start_frames = trials['startframe'].values
+    stop_frames = trials['endframe'].values
+
+    # stimuli with a start or an end frame within [startframe, endframe) of each trial
+    stimulus_indices = []
+    trial_indices = []
+    for frames_to_check in (frames, end_frames):
+        first = np.searchsorted(frames_to_check, start_frames, side='left')
+        last = np.searchsorted(frames_to_check, stop_frames, side='left')
+        n_stimuli = np.clip(last - first, 0, None)
+        trial_indices.append(np.repeat(np.arange(len(trials)), n_stimuli))
+        stimulus_indices.append(
+            np.repeat(first, n_stimuli) + np.arange(n_stimuli.sum()) - np.repeat(np.cumsum(n_stimuli) - n_stimuli, n_stimuli)
+        )
+    trial_indices = np.concatenate(trial_indices)
+    stimulus_codes = codes[np.concatenate(stimulus_indices)]
+
+    # count unique (trial, stimulus) pairs for each trial
+    pairs = np.unique(np.stack((trial_indices, stimulus_codes)), axis=1)
+    return np.bincount(pairs[0], minlength=len(trials)).astype(float)
+
+
+def validate_autorewards_after_N_consecutive_misses(extended_trials, autoreward_after_consecutive_misses, warmup_trials):
+    '''
+    validate that an autoreward is delivered after N consecutive misses
+
+    returns False if any expected autorewards are missing OR any autorewards come earlier than expected
+
+    Ignores warmup trials
+    '''
+    if warmup_trials == -1:
+        return True
+
+    go_trials = extended_trials[extended_trials.trial_type.isin(['go', 'autorewarded'])].iloc[warmup_trials:]
+    _, reward_offsets = flatten_trial_lists(go_trials['reward_times'])
+    miss = np.diff(reward_offsets) == 0
+    auto_rewarded = go_trials['auto_rewarded'].values.astype(bool)
+
+    # misses count up until a hit or an autoreward
+    consecutive_misses = get_run_lengths(miss & ~auto_rewarded)
+    reward_expected = np.zeros(len(go_trials), dtype=bool)
+    reward_expected[1:] = consecutive_misses[:-1] == autoreward_after_consecutive_misses
+
+    # autorewards should only come when expected, and always come when expected
+    return not np.any(auto_rewarded & ~reward_expected) and all(auto_rewarded[reward_expected])
+
+
+def validate_change_on_all_go_trials(trials):
+    '''
+    ensure that either the orientation or the image_name changes on every go
+    trial
+    '''
+    go_trials = trials[trials.trial_type == 'go']
+    same_image = nanis_equal(go_trials['initial_image_name'], go_trials['change_image_name'])
+    same_ori = nanis_equal(go_trials['initial_ori'], go_trials['change_ori'])
+    return not np.any(same_image & same_ori)
+
+
+def validate_no_change_on_all_catch_trials(trials):
+    '''ensure that neither the orientation nor the image_name changes on every catch trial'''
+    catch_trials = trials[trials.trial_type == 'catch']
+    same_image = nanis_equal(catch_trials['initial_image_name'], catch_trials['change_image_name'])
+    same_ori = nanis_equal(catch_trials['initial_ori'], catch_trials['change_ori'])
+    return not np.any(~same_image & ~same_ori)
+
+
+def validate_reward_when_lick_in_window(core_data, tolerance=0.01):
+    '''for every trial with a lick in the response window, there should be a reward'''
+    trials = core_data['trials']
+    trial_type = annotate.categorize_trials(trials)
+    contingent_go_trials = trials[
+        (trial_type == 'go') &
+        (trials['auto_rewarded'] == False)
+    ]
+    change_times = contingent_go_trials['change_time'].values.astype(float)
+
+    _, lick_offsets, in_window = get_licks_in_response_window_mask(
+        contingent_go_trials['lick_times'],
+        change_times,
+        core_data['metadata']['response_window'],
+        tolerance=0.01,
+        tolerance_direction='inside',
+    )
+    lick_in_window = count_masked_values(lick_offsets, in_window) > 0
+
+    reward_flat, reward_offsets = flatten_trial_lists(contingent_go_trials['reward_times'])
+    reward_time = get_first_values(reward_flat, reward_offsets) - change_times
+
+    return not np.any(lick_in_window & np.isnan(reward_time))
+
+
+def validate_licks_near_every_reward(trials, tolerance=0.005):
+    '''
+    validates that there is a lick near every reward, excluding auto_rewards
+    '''
+    earned_reward_trials = trials[
+        (trials.number_of_rewards > 0) &
+        (trials.auto_rewarded == False)
+    ]
+    lick_flat, lick_offsets = flatten_trial_lists(earned_reward_trials['lick_times'])
+    # if there aren't any licks on a trial, something is wrong
+    if np.any(np.diff(lick_offsets) == 0):
+        return False
+    if len(lick_flat) == 0:
+        return True
+
+    reward_flat, reward_offsets = flatten_trial_lists(earned_reward_trials['reward_times'])
+    first_reward = get_first_values(reward_flat, reward_offsets)
+    distance_to_reward = np.abs(first_reward[get_trial_index(lick_offsets)] - lick_flat)
+    closest_lick = np.minimum.reduceat(distance_to_reward, lick_offsets[:-1])
+
+    # there should be a lick within tolerance of every reward
+    return all(np.isclose(closest_lick, 0, atol=tolerance))
+
+
+def validate_lick_after_scheduled_on_go_catch_trials(core_data, abort_on_early_response, distribution_type, tolerance=0.01):
+    '''
+    if licks occur before a scheduled change time/flash, the trial ends
+    Therefore, no non-aborted trials should have a lick before the scheduled change time,
+    except when abort_on_early_response is False
+    '''
+    trials = core_data['trials']
+    trial_type = annotate.categorize_trials(trials)
+    nonaborted_trials = trials[trial_type != 'aborted']
+    if distribution_type.lower() == 'geometric':
+        return True
+    elif abort_on_early_response == True and len(nonaborted_trials) > 0:
+        lick_flat, lick_offsets = flatten_trial_lists(nonaborted_trials['lick_times'])
+        first_lick = (
+            get_first_values(lick_flat, lick_offsets)
+            - nonaborted_trials['scheduled_change_time'].values.astype(float)
+            - nonaborted_trials['starttime'].values.astype(float)
+        )
+        # use nanmin, apply tolerance to account for same frame licks
+        with np.errstate(invalid='ignore'):
+            return not np.any(first_lick < 0 - tolerance)
+    elif abort_on_early_response == False or len(nonaborted_trials) == 0:
+        return True
+
+
+def validate_initial_matches_final(trials):
+    '''
+    On go and catch trials, the initial image (or ori) on a given trial should match the final image (or ori) on the previous trial
+    '''
+    trials_to_test = trials[trials['trial_type'].isin(['go', 'catch', 'autorewarded'])]
+
+    if len(trials_to_test) > 2:
+        previous_final_image = np.concatenate((trials_to_test['initial_image_name'].values[:1], trials_to_test['change_image_name'].values[:-1]))
+        previous_final_ori = np.concatenate((trials_to_test['initial_ori'].values[:1], trials_to_test['change_ori'].values[:-1]))
+        image_match = nanis_equal(trials_to_test['initial_image_name'], previous_final_image)
+        ori_match = nanis_equal(trials_to_test['initial_ori'], previous_final_ori)
+        return all(image_match) and all(ori_match)
+    else:
+        return True
+
+
+def validate_first_lick_after_change_on_nonaborted(trials, abort_on_early_response):
+    '''
+    on GO and CATCH trials, licks should never be observed between the trial start and the first frame of an image change,
+    except when abort_on_early_response == False
+    '''
+    non_aborted_trials = trials[trials.trial_type != 'aborted']
+    if abort_on_early_response == True and len(non_aborted_trials) > 0:
+        lick_flat, lick_offsets = flatten_trial_lists(non_aborted_trials['lick_times'])
+        first_lick_relative_to_change = get_first_values(lick_flat, lick_offsets) - non_aborted_trials['change_time'].values.astype(float)
+        with np.errstate(invalid='ignore'):
+            return not np.any(first_lick_relative_to_change < 0)
+    elif abort_on_early_response == False or len(non_aborted_trials) == 0:
+        return True
+
+
+def validate_trial_ends_without_licks(trials, minimum_no_lick_time):
+    '''
+    There should never be a lick within 'minimum_no_lick_time' of trial end
+    Task logic should extend trial if mouse is licking near trial end
+    '''
+    non_aborted_trials = trials[trials.trial_type.isin(['go', 'catch'])]
+    lick_flat, lick_offsets = flatten_trial_lists(non_aborted_trials['lick_times'])
+    time_from_last_lick = non_aborted_trials['endtime'].values.astype(float) - get_last_values(lick_flat, lick_offsets)
+    with np.errstate(invalid='ignore'):
+        return not np.any(time_from_last_lick < minimum_no_lick_time)
+
+
+def validate_number_aborted_trial_repeats(trials, failure_repeats, tolerance=0.01):
+    '''
+    on aborted trials (e.g. early licks), the trial's stimulus parameters should be repeated `failure_repeats` times
+    '''
+    trials = identify_consecutive_aborted_blocks(trials, failure_repeats)
+    aborted_trials = trials[trials['trial_type'] == 'aborted']
+
+    scheduled_change_times = aborted_trials['scheduled_change_time'].values.astype(float)
+    block_ids = aborted_trials['consecutive_aborted_should_match'].values
+
+    # compare each scheduled change time to the next one in the same block, as in utils.all_close
+    same_block = block_ids[1:] == block_ids[:-1]
+    consecutive_match = np.isclose(scheduled_change_times[:-1], scheduled_change_times[1:], rtol=tolerance)
+    return not np.any(np.isnan(scheduled_change_times)) and all(consecutive_match[same_block])
+
+
+def validate_params_change_after_aborted_trial_repeats(trials, failure_repeats, distribution_type):
+    '''
+    failure_repeats: for the `failure_repeats`+2 aborted trial, new parameters should be sampled
+    '''
+    if distribution_type.lower() == 'geometric':
+        return True
+
+    trials = identify_consecutive_aborted_blocks(trials, failure_repeats)
+    aborted_trials = trials[trials['trial_type'] == 'aborted']
+
+    scheduled_change_times = aborted_trials['scheduled_change_time'].values
+    block_ids = aborted_trials['consecutive_aborted_should_match'].values
+
+    # the first change time of each block should differ from the last change time of the previous block
+    new_block = block_ids[1:] != block_ids[:-1]
+    return all(scheduled_change_times[1:][new_block] != scheduled_change_times[:-1][new_block])
+
+
+def validate_trial_times_never_overlap(trials):
+    '''
+    a trial cannot start until the prior trial is complete
+    '''
+    previous_end = np.concatenate(([0], trials['endtime'].values[:-1]))
+    return all(trials['starttime'].values >= previous_end)
+
+
+def validate_no_abort_on_lick_before_response_window(trials):
+    '''
+    If licks occur between the change time and `response_window[0]`, the trial should continue.
+    Method ensures that all cases matching this condition are labeled as 'go', 'catch', or 'autorewarded', not 'aborted'
+    '''
+    nonaborted_trials = trials[trials['trial_type'] != 'aborted']
+
+    if len(nonaborted_trials) > 0:
+        lick_flat, lick_offsets = flatten_trial_lists(trials['lick_times'])
+        first_lick_relative_to_change = get_first_values(lick_flat, lick_offsets) - trials['change_time'].values.astype(float)
+        with np.errstate(invalid='ignore'):
+            trials['response_before_response_window'] = (
+                (first_lick_relative_to_change >= 0)
+                & (first_lick_relative_to_change < get_response_windows(trials)[:, 0])
+            )
+
+        return all(trials[trials['response_before_response_window'] == True].trial_type.isin(['go', 'catch', 'autorewarded']))
+    else:
+        return True
+
+
+def count_licks_in_response_window(trials, tolerance=0.01, tolerance_direction='inside'):
+    '''number of licks in the response window of each trial, as in extended_trials.identify_licks_in_response_window'''
+    _, lick_offsets, in_window = get_licks_in_response_window_mask(
+        trials['lick_times'],
+        trials['change_time'].values.astype(float),
+        get_response_windows(trials),
+        tolerance=tolerance,
+        tolerance_direction=tolerance_direction,
+    )
+    return count_masked_values(lick_offsets, in_window)
+
+
+def validate_licks_on_go_trials_earn_reward(trials):
+    '''
+    all go trials with licks in response window should have 1 reward
+    '''
+    number_of_licks_in_window = count_licks_in_response_window(trials, tolerance=1 / 60., tolerance_direction='inside')
+    number_of_rewards_on_go_lick_trials = trials[
+        (number_of_licks_in_window > 0) &
+        (trials['trial_type'] == 'go').values
+    ]['number_of_rewards']
+    return all(number_of_rewards_on_go_lick_trials) == 1
+
+
+def validate_licks_on_catch_trials_do_not_earn_reward(trials):
+    '''
+    all catch trials with licks in window should have 0 rewards
+    '''
+    number_of_licks_in_window = count_licks_in_response_window(trials, tolerance=0.01, tolerance_direction='outside')
+    number_of_rewards_on_catch_lick_trials = trials[
+        (number_of_licks_in_window > 0) &
+        (trials['trial_type'] == 'catch').values
+    ]['number_of_rewards']
+    if len(number_of_rewards_on_catch_lick_trials) > 0:
+        return all(number_of_rewards_on_catch_lick_trials) == 0
+    else:
+        return True
+
+
+def validate_two_stimuli_per_go_trial(trials, visual_stimuli):
+    '''
+    all 'go' trials should have two stimulus groups
+    '''
+    stimuli_per_trial = count_stimuli_per_trial(trials[trials['trial_type'] == 'go'], visual_stimuli)
+    return all(stimuli_per_trial == 2)
+
+
+def validate_one_stimulus_per_catch_trial(trials, visual_stimuli):
+    '''
+    all 'catch' trials should have no more than one stimulus group
+    '''
+    stimuli_per_trial = count_stimuli_per_trial(trials[trials['trial_type'] == 'catch'], visual_stimuli)
+    return all(stimuli_per_trial <= 1)
+
+
+def validate_one_stimulus_per_aborted_trial(trials, visual_stimuli):
+    '''
+    all 'aborted' trials should have no more than one stimulus group
+    '''
+    stimuli_per_trial = count_stimuli_per_trial(trials[trials['trial_type'] == 'aborted'], visual_stimuli)
+    return all(stimuli_per_trial <= 1)
+
+
+def validate_initial_blank(trials, visual_stimuli, omitted_stimuli, initial_blank, periodic_flash=True, frame_tolerance=2):
+    '''
+    Verifies that there is a blank screen of duration `initial_blank` at the start of every trial.
+    If initial blank is 0, first frame of flash should be coincident with trial start (within 1 frame)
+    '''
+    if periodic_flash is None and initial_blank == 0:
+        return True
+
+    if omitted_stimuli is not None:
+        visual_stimuli = pd.concat((visual_stimuli, omitted_stimuli), sort=True).sort_values(by='frame').reset_index()
+
+    stimulus_frames = visual_stimuli['frame'].values
+    # the first stimulus after the trial start is found with searchsorted, which needs sorted frames
+    if np.any(np.diff(stimulus_frames) < 0):
+        return et.validate_initial_blank(trials, visual_stimuli, None, initial_blank, periodic_flash, frame_tolerance)
+
+    start_frames = trials['startframe'].values
+    first_stim_frame_offset = stimulus_frames[np.searchsorted(stimulus_frames, start_frames, side='left')] - start_frames
+    initial_blank_in_frames = int(initial_blank * 60.)
+    return all(np.isclose(first_stim_frame_offset, initial_blank_in_frames, atol=frame_tolerance))
@@ -1,14 +1,60 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
 from . import extended_trials as et
+from . import extended_trials_vectorized as etv
 from . import core as cd
+from ..translator import foraging, foraging2
 from ..translator.core import create_extended_dataframe
 
 
-def define_validation_functions(core_data):
+VALIDATION_ENGINES = ['python', 'vectorized']
+
+
+def get_engine_function(func, engine='python'):
+    '''
+    returns the implementation of a validation function for an engine:
+        'python' uses the row-wise validators in `extended_trials`
+        'vectorized' uses the array-based validators in `extended_trials_vectorized` where they exist
+    '''
+    if engine not in VALIDATION_ENGINES:
+        raise ValueError('engine must be one of {}, not {}'.format(VALIDATION_ENGINES, engine))
+    if engine == 'vectorized' and func.__module__ == et.__name__:
+        return getattr(etv, func.__name__, func)
+    return func
+
+
+def get_shared_inputs(core_data):
+    '''
+    computes the intermediate values shared by many validation functions, once per session:
+        trials: the extended trials dataframe
+        trial_stimuli: boolean array selecting the visual stimuli presented during trials
+    '''
+    # When checking validate_flash_blank_durations, we need to send only the periodic flash stimuli
+    # presented during trials, and not the movie stimuli that can be included at the end of
+    # sessions. We also want to exclude any countdown stimuli from before the first trial starts.
+    trial_stimuli = ((core_data['visual_stimuli']['frame'] >= core_data['trials'].iloc[0]['startframe']) &
+                     (core_data['visual_stimuli']['end_frame'] <= core_data['trials'].iloc[-1]['endframe'])).values
+
+    return {
+        'trials': create_extended_dataframe(**core_data),
+        'trial_stimuli': trial_stimuli,
+    }
+
+
+def define_validation_functions(core_data, engine='python', shared_inputs=None):
     '''
     creates a dictionary containing all validation functions as keys, input arguments as values
+
+    engine: 'python' or 'vectorized', see get_engine_function
+    shared_inputs: output of get_shared_inputs, computed here if None
     '''
+    if shared_inputs is None:
+        shared_inputs = get_shared_inputs(core_data)
 
-    trials = create_extended_dataframe(**core_data)
+    trials = shared_inputs['trials']
 
     AUTO_REWARD_VOLUME = core_data['metadata']['auto_reward_vol']
     PRE_CHANGE_TIME = core_data['metadata']['delta_minimum']
@@ -31,13 +77,8 @@ def define_validation_functions(core_data):
 
     PERIODIC_FLASH = core_data['metadata']['periodic_flash']
 
-    # When checking validate_flash_blank_durations, we need to send only the periodic flash stimuli
-    # presented during trials, and not the movie stimuli that can be included at the end of
-    # sessions. We also want to exclude any countdown stimuli from before the first trial starts.
-
     # Boolean array for selecting stimuli that were presented as part of a trial
-    trial_stimuli = ((core_data['visual_stimuli']['frame'] >= core_data['trials'].iloc[0]['startframe']) &
-                     (core_data['visual_stimuli']['end_frame'] <= core_data['trials'].iloc[-1]['endframe'])).values
+    trial_stimuli = shared_inputs['trial_stimuli']
 
     validation_functions = {
         # et.validate_schema
@@ -96,23 +137,25 @@ def define_validation_functions(core_data):
         cd.validate_encoder_voltage: (core_data, ),
     }
 
-    return validation_functions
+    return {get_engine_function(func, engine): args for func, args in validation_functions.items()}
 
 
-def compute_qc_metrics(core_data):
+def compute_qc_metrics(core_data, engine='python'):
     """generate a set of validation metrics
 
     Parameters
     ----------
     core_data: dict
         visual behavior core data object
+    engine: str
+        'python' for the row-wise validators, 'vectorized' for the array-based validators
 
     Returns
     -------
     dict:
         validation metrics
     """
-    validation_functions = define_validation_functions(core_data)
+    validation_functions = define_validation_functions(core_data, engine=engine)
 
     results = {
         func.__name__: func(*validation_functions[func])
@@ -136,12 +179,218 @@ def check_session_passes(qc_metrics):
     return all(metrics_to_validate.values())
 
 
-def generate_qc_report(core_data):
+def generate_qc_report(core_data, engine='python'):
 
     results = compute_qc_metrics(
         core_data,
+        engine=engine,
     )
 
     results['passes'] = check_session_passes(results)
 
     return results
+
+
+QC_RESULTS_COLUMNS = ['session', 'validator', 'result', 'seconds', 'error']
+
+
+def _copy_validation_args(args):
+    '''
+    shallow copies of the dataframes in a validation function's arguments. Some validators add columns
+    to their inputs, which must not be seen by validators running at the same time
+    '''
+    def copy_arg(arg):
+        if isinstance(arg, pd.DataFrame):
+            return arg.copy(deep=False)
+        elif isinstance(arg, dict):
+            return {key: copy_arg(value) for key, value in arg.items()}
+        return arg
+    return tuple(copy_arg(arg) for arg in args)
+
+
+def _run_validation_function(func, args):
+    start = time.time()
+    try:
+        result, error = func(*args), None
+    except Exception as e:
+        result, error = None, repr(e)
+    return {'validator': func.__name__, 'result': result, 'seconds': time.time() - start, 'error': error}
+
+
+def run_validation_functions(validation_functions, n_threads=1):
+    '''
+    runs validation functions, catching and recording errors instead of raising them
+
+    Parameters
+    ----------
+    validation_functions: dict
+        output of define_validation_functions
+    n_threads: int
+        number of validators to run at the same time. Each validator gets its own shallow copies
+        of the input dataframes when running in more than one thread
+
+    Returns
+    -------
+    list of dicts, one per validator in the order of validation_functions, with keys
+        'validator', 'result', 'seconds' and 'error'
+    '''
+    if n_threads == 1:
+        return [_run_validation_function(func, args) for func, args in validation_functions.items()]
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        futures = [
+            executor.submit(_run_validation_function, func, _copy_validation_args(args))
+            for func, args in validation_functions.items()
+        ]
+        return [future.result() for future in futures]
+
+
+def _get_error_report(session, validator, seconds, error):
+    '''a results table with a single row recording an error that stopped the session from being validated'''
+    return pd.DataFrame([{
+        'session': session, 'validator': validator, 'result': None,
+        'seconds': seconds, 'error': repr(error),
+    }], columns=QC_RESULTS_COLUMNS)
+
+
+def generate_qc_report_table(core_data, engine='vectorized', n_threads=1, session=None):
+    '''
+    runs all validators for one session, with timing
+
+    Parameters
+    ----------
+    core_data: dict
+        visual behavior core data object
+    engine: str
+        'python' or 'vectorized', see get_engine_function
+    n_threads: int
+        number of validators to run at the same time
+    session: str
+        label for the session in the 'session' column, e.g. the pkl path
+
+    Returns
+    -------
+    pandas.DataFrame
+        one row per validator with columns 'session', 'validator', 'result', 'seconds' and 'error',
+        plus a 'passes' row as in generate_qc_report. Validators that raised have a result of None
+        and the exception in 'error'. Shared inputs are timed in a 'get_shared_inputs' row.
+        If the shared inputs or the validators can not be set up for the session (e.g. the
+        extended dataframe can not be created), returns a single 'get_shared_inputs' row with the error
+    '''
+    rows = []
+    with etv.cache_trial_arrays():
+        start = time.time()
+        try:
+            shared_inputs = get_shared_inputs(core_data)
+            validation_functions = define_validation_functions(core_data, engine=engine, shared_inputs=shared_inputs)
+        except Exception as e:
+            return _get_error_report(session, 'get_shared_inputs', time.time() - start, e)
+        rows.append({'validator': 'get_shared_inputs', 'result': None, 'seconds': time.time() - start, 'error': None})
+
+        validator_rows = run_validation_functions(validation_functions, n_threads=n_threads)
+    rows.extend(validator_rows)
+
+    metrics = {row['validator']: row['result'] for row in validator_rows}
+    rows.append({'validator': 'passes', 'result': check_session_passes(metrics), 'seconds': 0., 'error': None})
+
+    report = pd.DataFrame(rows)
+    report.insert(0, 'session', session)
+    return report[QC_RESULTS_COLUMNS]
+
+
+def load_core_data(pkl_path, camstim_type='foraging2'):
+    '''loads a behavior pkl file and translates it to core data'''
+    data = pd.read_pickle(pkl_path)
+    if camstim_type == 'foraging2':
+        return foraging2.data_to_change_detection_core(data)
+    else:
+        return foraging.data_to_change_detection_core(data)
+
+
+def generate_qc_report_table_for_pkl(pkl_path, engine='vectorized', n_threads=1, camstim_type='foraging2'):
+    '''
+    loads a pkl file and runs all validators on it, see generate_qc_report_table.
+    If the pkl can not be loaded, returns a single 'load_core_data' row with the error
+    '''
+    start = time.time()
+    try:
+        core_data = load_core_data(pkl_path, camstim_type=camstim_type)
+    except Exception as e:
+        return _get_error_report(pkl_path, 'load_core_data', time.time() - start, e)
+    load_row = pd.DataFrame([{
+        'session': pkl_path, 'validator': 'load_core_data', 'result': None,
+        'seconds': time.time() - start, 'error': None,
+    }], columns=QC_RESULTS_COLUMNS)
+
+    report = generate_qc_report_table(core_data, engine=engine, n_threads=n_threads, session=pkl_path)
+    return pd.concat([load_row, report], ignore_index=True)
+
+
+def generate_qc_reports(pkl_paths, engine='vectorized', n_workers=1, n_threads=1, camstim_type='foraging2', output_path=None):
+    '''
+    runs all validators on many behavior pkl files, one session at a time per worker process
+
+    Parameters
+    ----------
+    pkl_paths: list
+        paths of behavior pkl files
+    engine: str
+        'python' or 'vectorized', see get_engine_function
+    n_workers: int
+        number of worker processes, sessions are processed in this process if 1
+    n_threads: int
+        number of validators to run at the same time within each session
+    camstim_type: str
+        'foraging2' or 'foraging'
+    output_path: str
+        if given, the results table is also saved here as a csv file
+
+    Returns
+    -------
+    pandas.DataFrame
+        tidy table with one row per session and validator, columns 'session', 'validator', 'result', 'seconds' and 'error'
+    '''
+    if n_workers == 1:
+        reports = [
+            generate_qc_report_table_for_pkl(pkl_path, engine=engine, n_threads=n_threads, camstim_type=camstim_type)
+            for pkl_path in pkl_paths
+        ]
+    else:
+        reports = []
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {
+                executor.submit(generate_qc_report_table_for_pkl, pkl_path, engine, n_threads, camstim_type): pkl_path
+                for pkl_path in pkl_paths
+            }
+            for future in as_completed(futures):
+                try:
+                    reports.append(future.result())
+                except Exception as e:
+                    # e.g. the worker process died, keep a row for the session
+                    print('qc failed for {}, error:  {}'.format(futures[future], e))
+                    reports.append(_get_error_report(futures[future], 'generate_qc_report_table_for_pkl', None, e))
+
+    results = pd.concat(reports, ignore_index=True) if len(reports) > 0 else pd.DataFrame(columns=QC_RESULTS_COLUMNS)
+
+    if output_path is not None:
+        results.to_csv(output_path, index=False)
+    return results
+
+
+def get_validator_timing(results):
+    '''
+    summarizes the output of generate_qc_reports by validator
+
+    Returns
+    -------
+    pandas.DataFrame
+        one row per validator, sorted by total time, with the total, mean and max seconds,
+        the number of sessions it passed and failed, and the number of errors
+    '''
+    timing = results.groupby('validator')['seconds'].agg(['sum', 'mean', 'max']).rename(
+        columns={'sum': 'total_seconds', 'mean': 'mean_seconds', 'max': 'max_seconds'}
+    )
+    timing['n_passed'] = results['result'].eq(True).groupby(results['validator']).sum()
+    timing['n_failed'] = results['result'].eq(False).groupby(results['validator']).sum()
+    timing['n_errors'] = results['error'].notnull().groupby(results['validator']).sum()
+    return timing.sort_values('total_seconds', ascending=False)
@@ -11,11 +11,11 @@ from visual_behavior import database as db
 from visual_behavior.data_access import utilities as data_access_utilities
 from visual_behavior.data_access import loading
 from multiprocessing import Pool
+from functools import partial
 
 
-def log_error_to_mongo(behavior_session_id, failed_attribute, error_class, traceback):
-    conn = db.Database('visual_behavior_data')
-    entry = {
+def make_error_log_entry(behavior_session_id, failed_attribute, error_class, traceback):
+    return {
         'timestamp': str(datetime.datetime.now()),
         'sdk_version': allensdk.__version__,
         'python_version': platform.python_version(),
@@ -25,22 +25,55 @@ def log_error_to_mongo(behavior_session_id, failed_attribute, error_class, trace
         'error_class': str(error_class),
         'traceback': traceback
     }
+
+
+def log_error_to_mongo(behavior_session_id, failed_attribute, error_class, traceback):
+    conn = db.Database('visual_behavior_data')
+    entry = make_error_log_entry(behavior_session_id, failed_attribute, error_class, traceback)
     conn['sdk_validation']['error_logs'].insert_one(entry)
     conn.close()
 
 
-def log_validation_results_to_mongo(behavior_session_id, validation_results):
+def log_errors_to_mongo(error_log_entries):
+    '''
+    writes a list of error log entries (from make_error_log_entry) to mongo in one bulk insert
+    '''
+    if len(error_log_entries) == 0:
+        return
+    conn = db.Database('visual_behavior_data')
+    conn['sdk_validation']['error_logs'].insert_many(error_log_entries, ordered=False)
+    conn.close()
+
+
+def make_validation_results_document(behavior_session_id, validation_results, is_ophys=None):
+    if is_ophys is None:
+        is_ophys = data_access_utilities.is_ophys(behavior_session_id)
     validation_results.update({'behavior_session_id': behavior_session_id})
-    validation_results.update({'is_ophys': data_access_utilities.is_ophys(behavior_session_id)})
+    validation_results.update({'is_ophys': is_ophys})
     validation_results.update({'timestamp': str(datetime.datetime.now())})
+    return validation_results
+
+
+def log_validation_results_to_mongo(behavior_session_id, validation_results, is_ophys=None):
     conn = db.Database('visual_behavior_data')
     collection = conn['sdk_validation']['validation_results']
-    document = validation_results
+    document = make_validation_results_document(behavior_session_id, validation_results, is_ophys)
     keys_to_check = ['behavior_session_id']
     db.update_or_create(collection, document, keys_to_check, force_write=False)
     conn.close()
 
 
+def log_many_validation_results_to_mongo(documents):
+    '''
+    writes a list of validation results documents (from make_validation_results_document) to mongo
+    in one bulk write, updating the documents of sessions that were validated before
+    '''
+    conn = db.Database('visual_behavior_data')
+    collection = conn['sdk_validation']['validation_results']
+    db.update_or_create_many(collection, documents, keys_to_check=['behavior_session_id'])
+    conn.close()
+
+
 def get_error_logs(behavior_session_id):
     conn = db.Database('visual_behavior_data')
     res = conn['sdk_validation']['error_logs'].find({'behavior_session_id': behavior_session_id})
@@ -213,23 +246,39 @@ def get_behavior_session_table():
     return behavior_session_table
 
 
-def validate_attribute(behavior_session_id, attribute):
-    session = data_access_utilities.get_sdk_session(
-        behavior_session_id,
-        data_access_utilities.is_ophys(behavior_session_id)
-    )
+def validate_attribute(behavior_session_id, attribute, session=None, error_log_entries=None):
+    '''
+    tries to load an attribute of an SDK session
+
+    session: an already loaded SDK session for behavior_session_id, loaded here if None
+    error_log_entries: if a list, errors are appended to it for a later bulk write
+                       instead of being written to mongo one at a time
+    '''
+    if session is None:
+        session = data_access_utilities.get_sdk_session(
+            behavior_session_id,
+            data_access_utilities.is_ophys(behavior_session_id)
+        )
     if attribute in dir(session):
         # if the attribute exists, try to load it
         try:
             getattr(session, attribute)
             return True
         except Exception:
-            log_error_to_mongo(
-                behavior_session_id,
-                attribute,
-                sys.exc_info()[0],
-                traceback.format_exc(),
-            )
+            if error_log_entries is None:
+                log_error_to_mongo(
+                    behavior_session_id,
+                    attribute,
+                    sys.exc_info()[0],
+                    traceback.format_exc(),
+                )
+            else:
+                error_log_entries.append(make_error_log_entry(
+                    behavior_session_id,
+                    attribute,
+                    sys.exc_info()[0],
+                    traceback.format_exc(),
+                ))
             return False
     else:
         # return None if attribute doesn't exist
@@ -332,9 +381,13 @@ class ValidateSDK(object):
         validate_only_failed (boolean, default = False):
             if True, check for previous validation and check only attributes that previously failed
             if False, check all attributes
+        log_to_mongo (boolean, default = True):
+            if True, write error logs (in one bulk insert) and validation results to mongo
+            if False, keep them in `self.error_log_entries` and `self.validation_results` for the caller to write,
+            as in `validate_sessions`
     '''
 
-    def __init__(self, behavior_session_id, validate_only_failed=False):
+    def __init__(self, behavior_session_id, validate_only_failed=False, log_to_mongo=True):
         self.behavior_session_id = behavior_session_id
         self.is_ophys = data_access_utilities.is_ophys(behavior_session_id)
         self.session = data_access_utilities.get_sdk_session(
@@ -353,10 +406,13 @@ class ValidateSDK(object):
         else:
             attributes_to_validate = self.get_attributes()
         self.validate_attributes(attributes_to_validate)
-        log_validation_results_to_mongo(
-            behavior_session_id,
-            self.validation_results
-        )
+        if log_to_mongo:
+            log_errors_to_mongo(self.error_log_entries)
+            log_validation_results_to_mongo(
+                behavior_session_id,
+                self.validation_results,
+                self.is_ophys,
+            )
 
     def get_attributes(self):
         expected_attributes = [
@@ -383,10 +439,94 @@ class ValidateSDK(object):
         return expected_attributes
 
     def validate_attributes(self, attributes_to_validate):
+        # every attribute is checked on the session loaded in __init__
         self.validation_results = {}
+        self.error_log_entries = []
         for attribute in attributes_to_validate:
             print('checking {}'.format(attribute))
-            self.validation_results[attribute] = validate_attribute(self.behavior_session_id, attribute)
+            self.validation_results[attribute] = validate_attribute(
+                self.behavior_session_id,
+                attribute,
+                session=self.session,
+                error_log_entries=self.error_log_entries,
+            )
+
+
+def _validate_session(behavior_session_id, validate_only_failed=False):
+    '''
+    validates one session without writing to mongo, for use in a worker process
+
+    returns (validation results document, error log entries)
+    '''
+    try:
+        validation = ValidateSDK(behavior_session_id, validate_only_failed, log_to_mongo=False)
+    except Exception:
+        # the session itself could not be loaded
+        print('failed to load session {}'.format(behavior_session_id))
+        error_log_entry = make_error_log_entry(
+            behavior_session_id,
+            'session',
+            sys.exc_info()[0],
+            traceback.format_exc(),
+        )
+        return None, [error_log_entry]
+    document = make_validation_results_document(
+        behavior_session_id,
+        validation.validation_results,
+        validation.is_ophys,
+    )
+    return document, validation.error_log_entries
+
+
+def write_validation_outputs(outputs):
+    '''
+    writes the (validation results document, error log entries) tuples returned by _validate_session to mongo,
+    with one bulk write for the error logs and one for the validation results
+
+    returns the validation results documents
+    '''
+    documents = [document for document, _ in outputs if document is not None]
+    error_log_entries = [entry for _, entries in outputs for entry in entries]
+    log_errors_to_mongo(error_log_entries)
+    if len(documents) > 0:
+        log_many_validation_results_to_mongo(documents)
+    return documents
+
+
+def validate_sessions(behavior_session_ids, validate_only_failed=False, n_workers=8, chunk_size=50):
+    '''
+    validates many sessions in a pool of worker processes, loading each session once.
+    error logs and validation results are written to mongo in bulk every `chunk_size` sessions,
+    so that a crash part way through only loses the results of the current chunk
+
+    returns a dataframe of validation results, indexed by behavior_session_id
+    '''
+    behavior_session_ids = [int(behavior_session_id) for behavior_session_id in behavior_session_ids]
+    validate = partial(_validate_session, validate_only_failed=validate_only_failed)
+
+    documents = []
+    outputs = []
+    if n_workers == 1:
+        for behavior_session_id in behavior_session_ids:
+            outputs.append(validate(behavior_session_id))
+            if len(outputs) == chunk_size:
+                documents.extend(write_validation_outputs(outputs))
+                outputs = []
+    else:
+        with Pool(n_workers) as pool:
+            for output in pool.imap_unordered(validate, behavior_session_ids):
+                outputs.append(output)
+                if len(outputs) == chunk_size:
+                    documents.extend(write_validation_outputs(outputs))
+                    outputs = []
+    documents.extend(write_validation_outputs(outputs))
+
+    if len(documents) == 0:
+        return pd.DataFrame()
+    # sessions finish out of order in the pool, return them in the order they were requested
+    order = {behavior_session_id: ii for ii, behavior_session_id in enumerate(behavior_session_ids)}
+    documents.sort(key=lambda document: order[document['behavior_session_id']])
+    return pd.DataFrame(documents).set_index('behavior_session_id')
 
 
 def str2bool(v):
@@ -402,8 +542,12 @@ def str2bool(v):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='run sdk validation')
-    parser.add_argument("--behavior-session-id", type=str, default=None, metavar='behavior session id')
+    parser.add_argument("--behavior-session-id", type=str, nargs='+', default=None, metavar='behavior session id')
     parser.add_argument("--validate-only-failed", type=str2bool, default=False, metavar='validate only previously failed attributes')
+    parser.add_argument("--n-workers", type=int, default=8, metavar='number of sessions to validate at the same time')
     args = parser.parse_args()
     print('args.validate_only_failed: {}'.format(args.validate_only_failed))
-    validation = ValidateSDK(int(args.behavior_session_id), args.validate_only_failed)
+    if len(args.behavior_session_id) == 1:
+        validation = ValidateSDK(int(args.behavior_session_id[0]), args.validate_only_failed)
+    else:
+        validate_sessions(args.behavior_session_id, args.validate_only_failed, n_workers=args.n_workers)
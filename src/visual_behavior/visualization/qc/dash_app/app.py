@@ -28,7 +28,7 @@ container_table = functions.load_container_data().sort_values('first_acquistion_
 container_plot_options = functions.load_container_plot_options()
 session_plot_options = functions.load_session_plot_options()
 container_overview_plot_options = functions.load_container_overview_plot_options()
-plot_inventory = functions.generate_plot_inventory()
+plot_inventory = functions.update_plot_inventory()
 plot_inventory_fig = functions.make_plot_inventory_heatmap(plot_inventory)
 experiment_table = loading.get_filtered_ophys_experiment_table().reset_index()
 session_table = functions.load_session_data()
@@ -48,6 +48,8 @@ print('done setting up components, it took {} seconds'.format(time.time() - t0))
 app.layout = html.Video(src='/static/my-video.webm')
 
 server = app.server
+functions.register_plot_route(server)
+functions.start_plot_inventory_updates()
 
 
 # APP LAYOUT
@@ -193,12 +195,15 @@ app.layout = html.Div(
 def update_data(data_display_level, selected_rows, n_clicks, stored_feedback, update_data_nclicks, reload_data_nclicks):
     print('updating data table at {}'.format(time.time()))
     print('data_display_level = {}'.format(data_display_level))
+    # selecting rows or switching display level reuses the cached tables, buttons and logged feedback reload them
+    triggers = [trigger['prop_id'].split('.')[0] for trigger in dash.callback_context.triggered]
+    reload_data = any(trigger in ['feedback_popup_ok', 'stored_feedback', 'update_data_button', 'reload_data_button'] for trigger in triggers)
     if data_display_level == 'container':
-        container_table = functions.load_container_data().sort_values('first_acquistion_date')
+        container_table = functions.load_container_data(reload_data=reload_data).sort_values('first_acquistion_date')
         data = container_table.to_dict('records')
     elif data_display_level == 'session':
         # session_table = functions.load_session_data()
-        data_to_display = functions.load_session_data()
+        data_to_display = functions.load_session_data(reload_data=reload_data)
         print('casting exps to string!!!!!!!')
         data_to_display = data_to_display.drop(columns=['ophys_experiment_ids, paired'])
         data = data_to_display.to_dict('records')
@@ -741,8 +746,8 @@ def update_frame_N(row_index, plot_types, display_level, input_id):
         elif display_level == 'session':
             _id = session_table.iloc[row_index[0]]['ophys_session_id']
 
-        encoded_image = functions.get_plot(_id, plot_type=plot_type, display_level=display_level)
-        return 'data:image/png;base64,{}'.format(encoded_image.decode())
+        # served by functions.serve_plot, so the browser only downloads plots that have changed
+        return functions.get_plot_url(_id, plot_type=plot_type, display_level=display_level)
     except IndexError:
         return None
 
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 
 import base64
+import hashlib
+import io
 import os
+import threading
 import yaml
 import json
 import pandas as pd
@@ -12,12 +15,45 @@ import uuid
 import sys
 from visual_behavior import database as db
 from importlib import reload
+from collections import OrderedDict
 
 from visual_behavior.data_access import loading
 
 
-def load_container_data():
-    sys.path.append('/allen/programs/braintv/workgroups/nc-ophys/visual_behavior/qc_plots/container_plots')
+QC_PLOTS_DIR = '/allen/programs/braintv/workgroups/nc-ophys/visual_behavior/qc_plots'
+
+# tables loaded from the qc_plots folder, keyed by table name, with the file modification times they were loaded at
+_table_cache = {}
+_table_cache_lock = threading.Lock()
+
+
+def get_directory_mtime(directory):
+    """most recent modification time of the files directly inside directory (subfolders are ignored)"""
+    mtimes = [entry.stat().st_mtime for entry in os.scandir(directory) if entry.is_file()]
+    return max(mtimes) if len(mtimes) > 0 else None
+
+
+def get_cached_table(table_name, data_dir, load_function, reload_data=False):
+    """
+    returns a table loaded by load_function, reusing the previously loaded table until
+    reload_data is True or a file in data_dir has been modified since it was loaded
+    """
+    try:
+        mtime = get_directory_mtime(data_dir)
+    except OSError:
+        mtime = None
+    with _table_cache_lock:
+        cached = _table_cache.get(table_name)
+        if cached is not None and not reload_data and mtime is not None and cached['mtime'] == mtime:
+            return cached['table'].copy()
+    table = load_function()
+    with _table_cache_lock:
+        _table_cache[table_name] = {'mtime': mtime, 'table': table}
+    return table.copy()
+
+
+def _load_container_data():
+    sys.path.append(os.path.join(QC_PLOTS_DIR, 'container_plots'))
     import container_data
     reload(container_data)
     container_df = container_data.load_data()
@@ -25,14 +61,24 @@ def load_container_data():
     return container_df
 
 
-def load_session_data():
+def load_container_data(reload_data=False):
+    return get_cached_table('container', os.path.join(QC_PLOTS_DIR, 'container_plots'),
+                            _load_container_data, reload_data=reload_data)
+
+
+def _load_session_data():
+    sys.path.append(os.path.join(QC_PLOTS_DIR, 'session_plots'))
+    import session_data
+    reload(session_data)
+    session_df = session_data.load_data()
+    session_df = session_data.update_data(session_df)
+    return session_df
+
+
+def load_session_data(reload_data=False):
     try:
-        sys.path.append('/allen/programs/braintv/workgroups/nc-ophys/visual_behavior/qc_plots/session_plots')
-        import session_data
-        reload(session_data)
-        session_df = session_data.load_data()
-        session_df = session_data.update_data(session_df)
-        return session_df
+        return get_cached_table('session', os.path.join(QC_PLOTS_DIR, 'session_plots'),
+                                _load_session_data, reload_data=reload_data)
     except Exception as e:
         print("ERROR LOADING SESSION DATA TABLE")
         print(e)
@@ -86,8 +132,7 @@ def load_container_overview_plot_options():
 
 
 def get_plot_path(_id, plot_type, display_level):
-    qc_plot_folder = '/allen/programs/braintv/workgroups/nc-ophys/visual_behavior/qc_plots'
-    plot_folder = os.path.join(qc_plot_folder, '{}_plots'.format(display_level))
+    plot_folder = os.path.join(QC_PLOTS_DIR, '{}_plots'.format(display_level))
 
     plot_image_path = os.path.join(
         plot_folder,
@@ -96,39 +141,151 @@ def get_plot_path(_id, plot_type, display_level):
     return plot_image_path
 
 
-def get_plot(_id, plot_type, display_level):
-    plot_image_path = get_plot_path(_id, plot_type, display_level)
+def get_plot_not_found_path(display_level):
+    return os.path.join(QC_PLOTS_DIR, '{}_plots'.format(display_level), 'no_cached_plot_small.png')
+
+
+# encoded images, keyed by (path, modification time, file size, max width), least recently used first
+IMAGE_CACHE_MAX_BYTES = 500e6
+_image_cache = OrderedDict()
+_image_cache_lock = threading.Lock()
+
+
+def make_thumbnail(image_bytes, max_width):
+    """returns png bytes of the image downsampled to be at most max_width pixels wide"""
+    from PIL import Image
+    image = Image.open(io.BytesIO(image_bytes))
+    if image.width > max_width:
+        image.thumbnail((max_width, int(image.height * max_width / image.width)))
+    output = io.BytesIO()
+    image.save(output, format='PNG', optimize=True)
+    return output.getvalue()
+
+
+def get_image(image_path, max_width=None):
+    """
+    returns (png_bytes, etag) for the image at image_path, optionally downsampled to max_width pixels wide.
+    images are cached in memory until the file changes. raises FileNotFoundError if the file does not exist
+    """
+    stat = os.stat(image_path)
+    key = (image_path, stat.st_mtime_ns, stat.st_size, max_width)
+    with _image_cache_lock:
+        if key in _image_cache:
+            _image_cache.move_to_end(key)
+            return _image_cache[key]
+    image_bytes = open(image_path, 'rb').read()
+    if max_width is not None:
+        image_bytes = make_thumbnail(image_bytes, max_width)
+    etag = hashlib.md5(repr(key).encode()).hexdigest()
+    with _image_cache_lock:
+        _image_cache[key] = (image_bytes, etag)
+        while sum(len(v[0]) for v in _image_cache.values()) > IMAGE_CACHE_MAX_BYTES and len(_image_cache) > 1:
+            _image_cache.popitem(last=False)
+    return image_bytes, etag
+
+
+def get_plot_image(_id, plot_type, display_level, max_width=None):
+    """returns (png_bytes, etag) for a QC plot, or for the 'no cached plot' image if the plot does not exist"""
     try:
-        encoded_image = base64.b64encode(open(plot_image_path, 'rb').read())
+        return get_image(get_plot_path(_id, plot_type, display_level), max_width=max_width)
     except FileNotFoundError:
         print('not found, ophys_container_id = {}, plot_type = {}'.format(_id, plot_type))
-        qc_plot_folder = '/allen/programs/braintv/workgroups/nc-ophys/visual_behavior/qc_plots'
-        plot_folder = os.path.join(qc_plot_folder, '{}_plots'.format(display_level))
+        return get_image(get_plot_not_found_path(display_level))
 
-        plot_not_found_path = os.path.join(
-            plot_folder,
-            'no_cached_plot_small.png'
-        )
-        encoded_image = base64.b64encode(
-            open(plot_not_found_path, 'rb').read())
 
-    return encoded_image
+def get_plot(_id, plot_type, display_level, max_width=None):
+    image_bytes, _ = get_plot_image(_id, plot_type, display_level, max_width=max_width)
+    return base64.b64encode(image_bytes)
 
 
-def generate_plot_inventory():
+def get_plot_url(_id, plot_type, display_level, max_width=None):
+    """url of a QC plot as served by serve_plot, so that browsers can cache the image and revalidate it by ETag"""
+    url = '/plots/{}/{}/{}.png'.format(display_level, plot_type, _id)
+    if max_width is not None:
+        url += '?max_width={}'.format(int(max_width))
+    return url
+
+
+def serve_plot(display_level, plot_type, _id):
+    """
+    flask view for QC plot images at the urls returned by get_plot_url. responds with 304 Not Modified
+    when the browser already has the current version of the image
+    """
+    from flask import request, Response
+    max_width = request.args.get('max_width', default=None, type=int)
+    image_bytes, etag = get_plot_image(_id, plot_type, display_level, max_width=max_width)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(image_bytes, mimetype='image/png')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def register_plot_route(server):
+    """adds the QC plot image route to the flask server of the dash app"""
+    server.add_url_rule('/plots/<display_level>/<plot_type>/<_id>.png', 'serve_plot', serve_plot)
+
+
+def get_plot_folder_contents(display_level, plot_type):
+    """names of the files in a plot folder, listing the folder once rather than checking each file"""
+    try:
+        return set(entry.name for entry in os.scandir(os.path.join(QC_PLOTS_DIR, '{}_plots'.format(display_level), plot_type)))
+    except OSError:
+        return set()
+
+
+def build_plot_inventory(ophys_container_ids, plot_types):
+    """dataframe of booleans indicating which container plots exist, indexed by ophys_container_id with one column per plot type"""
+    inventory = {}
+    for plot_type in plot_types:
+        saved_plots = get_plot_folder_contents('container', plot_type)
+        inventory[plot_type] = ['container_{}.png'.format(ophys_container_id) in saved_plots for ophys_container_id in ophys_container_ids]
+    plot_inventory = pd.DataFrame(inventory, index=pd.Index(ophys_container_ids, name='ophys_container_id'))
+    return plot_inventory.sort_index()
+
+
+# latest plot inventory built by update_plot_inventory
+_plot_inventory = {'table': None, 'timestamp': None}
+_plot_inventory_lock = threading.Lock()
+
+
+def update_plot_inventory():
     global CONTAINER_TABLE
 
     CONTAINER_TABLE = load_container_data().sort_values('first_acquistion_date')
-    container_table = CONTAINER_TABLE
-    plots = load_container_plot_options()
-    list_of_dicts = []
-    for ophys_container_id in container_table['ophys_container_id'].values:
-        d = {'ophys_container_id': ophys_container_id}
-        for entry in plots:
-            plot_type = entry['value']
-            d.update({plot_type: os.path.exists(get_plot_path(ophys_container_id, plot_type, 'container'))})
-        list_of_dicts.append(d)
-    return pd.DataFrame(list_of_dicts).set_index('ophys_container_id').sort_index()
+    plot_types = [entry['value'] for entry in load_container_plot_options()]
+    plot_inventory = build_plot_inventory(CONTAINER_TABLE['ophys_container_id'].values, plot_types)
+    with _plot_inventory_lock:
+        _plot_inventory['table'] = plot_inventory
+        _plot_inventory['timestamp'] = datetime.datetime.now()
+    return plot_inventory
+
+
+def start_plot_inventory_updates(interval=300):
+    """rebuilds the plot inventory every interval seconds in a background thread"""
+    def update_loop():
+        while True:
+            try:
+                update_plot_inventory()
+            except Exception as e:
+                print('failed to update plot inventory')
+                print(e)
+            threading.Event().wait(interval)
+
+    thread = threading.Thread(target=update_loop, name='plot_inventory_updates', daemon=True)
+    thread.start()
+    return thread
+
+
+def generate_plot_inventory():
+    """returns the most recent plot inventory, building it now if it has not been built yet"""
+    with _plot_inventory_lock:
+        plot_inventory = _plot_inventory['table']
+    if plot_inventory is None:
+        plot_inventory = update_plot_inventory()
+    return plot_inventory
 
 
 def make_plot_inventory_heatmap(plot_inventory):
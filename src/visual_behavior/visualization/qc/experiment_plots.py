@@ -3,6 +3,7 @@ import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
+from matplotlib.colors import ListedColormap
 
 import visual_behavior.visualization.utils as utils
 import visual_behavior.visualization.qc.plotting_utils as pu
@@ -120,9 +121,8 @@ def plot_valid_segmentation_mask_outlines_per_cell_for_experiment(ophys_experime
     dataset = loading.get_ophys_dataset(ophys_experiment_id)
     cell_specimen_table = dataset.cell_specimen_table.copy()
     if len(cell_specimen_table) > 0:
-        for cell_roi_id in cell_specimen_table.cell_roi_id.values:
-            mask = cell_specimen_table[cell_specimen_table.cell_roi_id == cell_roi_id].roi_mask.values[0]
-            ax.contour(mask, levels=0, colors=['red'], linewidths=[0.6])
+        outlines = processing.gen_transparent_roi_outlines(cell_specimen_table.roi_mask.values)
+        ax.imshow(outlines, cmap=ListedColormap(['red']), vmin=0, vmax=1, interpolation='nearest')
     ax.set_title('valid ROI outlines\n n = ' + str(len(cell_specimen_table.cell_roi_id.values)))
     ax.axis('off')
     return ax
@@ -135,25 +135,28 @@ def plot_valid_and_invalid_segmentation_mask_overlay_per_cell_for_experiment(oph
     dataset = loading.get_ophys_dataset(ophys_experiment_id)
     cell_specimen_table = dataset.cell_specimen_table.copy()
     exclusion_labels = loading.get_lims_cell_exclusion_labels(ophys_experiment_id)
+    # group rois by outline color, then draw all outlines of each color as one image.
+    # invalid rois are gray unless their exclusion labels can be looked up
+    colors = pd.Series(np.where(cell_specimen_table.valid_roi == True, 'red', 'gray'), index=cell_specimen_table.index)
     try:
-        for cell_roi_id in cell_specimen_table[cell_specimen_table.valid_roi == True].cell_roi_id.values:
-            mask = cell_specimen_table[cell_specimen_table.cell_roi_id == cell_roi_id].roi_mask.values[0]
-            ax.contour(mask, levels=0, colors=['red'], linewidths=[1])
-    except BaseException:
-        pass
-    try:
-        for cell_roi_id in cell_specimen_table[cell_specimen_table.valid_roi == False].cell_roi_id.values:
-            mask = cell_specimen_table[cell_specimen_table.cell_roi_id == cell_roi_id].roi_mask.values[0]
-            excl_labels = exclusion_labels[exclusion_labels.cr_id == cell_roi_id].excl_label.values
-            decrosstalk_in_labels = ['decrosstalk' in excl_label for excl_label in excl_labels]
-            if (True in decrosstalk_in_labels) and (len(excl_labels) == 1):
-                ax.contour(mask, levels=0, colors=['green'], linewidths=[2])
-            elif (True in decrosstalk_in_labels) and (len(excl_labels) > 1):
-                ax.contour(mask, levels=0, colors=['cyan'], linewidths=[1])
+        excl_labels = exclusion_labels.groupby('cr_id').excl_label.apply(list)
+        for index, cell_roi_id in cell_specimen_table[cell_specimen_table.valid_roi == False].cell_roi_id.items():
+            labels = excl_labels.get(cell_roi_id, [])
+            decrosstalk_in_labels = ['decrosstalk' in excl_label for excl_label in labels]
+            if (True in decrosstalk_in_labels) and (len(labels) == 1):
+                colors[index] = 'green'
+            elif (True in decrosstalk_in_labels) and (len(labels) > 1):
+                colors[index] = 'cyan'
             else:
-                ax.contour(mask, levels=0, colors=['blue'], linewidths=[1])
-    except BaseException:
-        pass
+                colors[index] = 'blue'
+    except Exception as e:
+        print('could not get exclusion labels for experiment {}, invalid ROIs are drawn in gray, error:  {}'.format(ophys_experiment_id, e))
+    for color in colors.unique():
+        try:
+            outlines = processing.gen_transparent_roi_outlines(cell_specimen_table[colors == color].roi_mask.values)
+            ax.imshow(outlines, cmap=ListedColormap([color]), vmin=0, vmax=1, interpolation='nearest')
+        except BaseException:
+            pass
     ax.axis('off')
     return ax
 
@@ -11,11 +11,17 @@ parser = argparse.ArgumentParser(description='run container qc plot generation f
 parser.add_argument('--env', type=str, default='visual_behavior_sdk', metavar='name of conda environment to use')
 parser.add_argument('--scriptname', type=str, default='save_all_container_plots.py', metavar='name of script to run (must be in same folder)')
 parser.add_argument("--plots", type=str, default=None, metavar='plot name to generate')
+parser.add_argument('--containers-per-job', type=int, default=10, metavar='number of containers processed by each cluster job')
+parser.add_argument('--n-workers', type=int, default=1, metavar='worker processes per job, each processing one container at a time')
+parser.add_argument('--overwrite', action='store_true', help='regenerate plots that are newer than the container NWB files')
 
 job_dir = r"/allen/programs/braintv/workgroups/nc-ophys/visual_behavior/cluster_jobs/vba_qc_plots"
 
+# memory for one container, jobs get this much per worker process
+mem_per_worker_gb = 60
+
 job_settings = {'queue': 'braintv',
-                'mem': '60g',
+                'mem': '{}g'.format(mem_per_worker_gb),
                 'walltime': '10:00:00',
                 'ppn': 1,
                 }
@@ -30,13 +36,19 @@ if __name__ == "__main__":
     python_executable = "{}/anaconda2/envs/{}/bin/python".format(os.path.expanduser('~'), args.env)
     python_file = os.path.join(os.getcwd(), args.scriptname)
 
-    for ii, container_id in enumerate(container_ids):
-        if args.plots is None:
-            args_to_pass = '--container-id {}'.format(container_id)
-        else:
-            args_to_pass = '--container-id {} --plots {}'.format(container_id, args.plots)
-        print('container ID = {}, number {} of {}'.format(container_id, ii + 1, len(container_ids)))
-        job_title = 'container_{}'.format(container_id)
+    job_settings['ppn'] = args.n_workers
+    job_settings['mem'] = '{}g'.format(mem_per_worker_gb * args.n_workers)
+
+    # each job runs save_plots_for_containers on a batch of containers, with one worker process per container at a time
+    batches = [container_ids[ii:ii + args.containers_per_job] for ii in range(0, len(container_ids), args.containers_per_job)]
+    for ii, batch in enumerate(batches):
+        args_to_pass = '--container-id {} --n-workers {}'.format(' '.join(str(container_id) for container_id in batch), args.n_workers)
+        if args.plots is not None:
+            args_to_pass += ' --plots {}'.format(args.plots)
+        if args.overwrite:
+            args_to_pass += ' --overwrite'
+        print('containers {} to {}, batch {} of {}'.format(batch[0], batch[-1], ii + 1, len(batches)))
+        job_title = 'containers_{}_to_{}'.format(batch[0], batch[-1])
         pbstools.PythonJob(
             python_file,
             python_executable,
@@ -1,76 +1,247 @@
 from visual_behavior.visualization.qc import container_plots as cp
+from visual_behavior.data_access import loading
+from visual_behavior.data_access import from_lims
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import matplotlib.pyplot as plt
+import pandas as pd
 import argparse
+import time
+import os
 
 
-def main():
-    possible_plots = {
-        "pupil_timeseries": cp.plot_pupil_timeseries_for_container,
-        "event_triggered_averages": cp.plot_event_triggered_averages_for_container,
-        "ophys_session_sequence": cp.plot_container_session_sequence,
-        "max_projection_images": cp.plot_sdk_max_projection_images_for_container,
-        "average_images": cp.plot_sdk_average_images_for_container,
-        "dff_traces_heatmaps": cp.plot_dff_traces_heatmaps_for_container,
-        "running_speed": cp.plot_running_speed_for_container,
-        "lick_rasters": cp.plot_lick_rasters_for_container,
-        "average_intensity_timeseries": cp.plot_average_intensity_timeseries_for_container,
-        "motion_correction_xy_shift": cp.plot_motion_correction_xy_shift_for_container,
-        "OphysRegistrationSummaryImage": cp.plot_OphysRegistrationSummaryImage,
-        "number_matched_cells": cp.plot_number_matched_cells_for_container,
-        "fraction_matched_cells": cp.plot_fraction_matched_cells_for_container,
-        "cell_matching_registration_overlay_grid": cp.plot_cell_matching_registration_overlay_grid,
-        "cell_matching_registration_output": cp.plot_cell_matching_registration_output,
-        "nway_match_fraction": cp.plot_nway_match_fraction,
-        "nway_warp_overlay": cp.plot_nway_warp_overlay,
-        "nway_warp_summary": cp.plot_nway_warp_summary,
-        "segmented_rois_by_experiment": cp.plot_number_segmented_rois_for_container,
-        "segmentation_masks": cp.plot_segmentation_masks_for_container,
-        "segmentation_mask_overlays": cp.plot_segmentation_mask_overlays_for_container,
-        "max_projection_images_movies": cp.plot_movie_max_projection_images_for_container,
-        "average_images_movies": cp.plot_movie_average_images_for_container,
-        "cell_snr_by_experiment": cp.plot_cell_snr_for_container,
-        "eye_tracking_sample_frames": cp.plot_eye_tracking_sample_frames,
-        "pupil_area_sdk": cp.plot_pupil_area_sdk,
-        "pupil_area": cp.plot_pupil_area,
-        "pupil_position": cp.plot_pupil_position,
-        "FOV_average_intensity": cp.plot_average_intensity_for_container,
-        "pmt_settings": cp.plot_pmt_for_container,
-        "snr_by_pmt": cp.plot_snr_by_pmt_for_container,
-        "snr_by_pmt_and_intensity": cp.plot_snr_by_pmt_gain_and_intensity_for_container,
-        "experiment_summary": cp.plot_experiment_summary_figure_for_container,
-        "behavior_summary": cp.plot_behavior_summary,
-        "population_average_across_sessions_omission": cp.plot_omission_population_average_across_sessions,
-        "population_average_across_sessions_trials": cp.plot_trials_population_average_across_sessions,
-        "population_average_across_sessions_stimulus": cp.plot_stimulus_population_average_across_sessions,
-        "event_detection": cp.plot_event_detection_for_container,
-        "single_cell_response_plots": cp.plot_single_cell_response_plots_for_container,
-        "traces_and_behavior": cp.plot_dff_trace_and_behavior_for_container,
-        # "roi_filtering_metrics_all_cells": cp.plot_roi_filtering_metrics_for_all_rois_for_container,
-        # "roi_filtering_metrics_valid_cells": cp.plot_roi_filtering_metrics_for_valid_rois_for_container,
-        # "filtered_roi_masks": cp.plot_filtered_roi_masks_for_container,
-        # "classifier_validation": cp.plot_classifier_validation_for_container,
-        # "snr_metrics_df": cp.generate_snr_metrics_df_for_container,
-    }
+CONTAINER_PLOTS = {
+    "pupil_timeseries": cp.plot_pupil_timeseries_for_container,
+    "event_triggered_averages": cp.plot_event_triggered_averages_for_container,
+    "ophys_session_sequence": cp.plot_container_session_sequence,
+    "max_projection_images": cp.plot_sdk_max_projection_images_for_container,
+    "average_images": cp.plot_sdk_average_images_for_container,
+    "dff_traces_heatmaps": cp.plot_dff_traces_heatmaps_for_container,
+    "running_speed": cp.plot_running_speed_for_container,
+    "lick_rasters": cp.plot_lick_rasters_for_container,
+    "average_intensity_timeseries": cp.plot_average_intensity_timeseries_for_container,
+    "motion_correction_xy_shift": cp.plot_motion_correction_xy_shift_for_container,
+    "OphysRegistrationSummaryImage": cp.plot_OphysRegistrationSummaryImage,
+    "number_matched_cells": cp.plot_number_matched_cells_for_container,
+    "fraction_matched_cells": cp.plot_fraction_matched_cells_for_container,
+    "cell_matching_registration_overlay_grid": cp.plot_cell_matching_registration_overlay_grid,
+    "cell_matching_registration_output": cp.plot_cell_matching_registration_output,
+    "nway_match_fraction": cp.plot_nway_match_fraction,
+    "nway_warp_overlay": cp.plot_nway_warp_overlay,
+    "nway_warp_summary": cp.plot_nway_warp_summary,
+    "segmented_rois_by_experiment": cp.plot_number_segmented_rois_for_container,
+    "segmentation_masks": cp.plot_segmentation_masks_for_container,
+    "segmentation_mask_overlays": cp.plot_segmentation_mask_overlays_for_container,
+    "max_projection_images_movies": cp.plot_movie_max_projection_images_for_container,
+    "average_images_movies": cp.plot_movie_average_images_for_container,
+    "cell_snr_by_experiment": cp.plot_cell_snr_for_container,
+    "eye_tracking_sample_frames": cp.plot_eye_tracking_sample_frames,
+    "pupil_area_sdk": cp.plot_pupil_area_sdk,
+    "pupil_area": cp.plot_pupil_area,
+    "pupil_position": cp.plot_pupil_position,
+    "FOV_average_intensity": cp.plot_average_intensity_for_container,
+    "pmt_settings": cp.plot_pmt_for_container,
+    "snr_by_pmt": cp.plot_snr_by_pmt_for_container,
+    "snr_by_pmt_and_intensity": cp.plot_snr_by_pmt_gain_and_intensity_for_container,
+    "experiment_summary": cp.plot_experiment_summary_figure_for_container,
+    "behavior_summary": cp.plot_behavior_summary,
+    "population_average_across_sessions_omission": cp.plot_omission_population_average_across_sessions,
+    "population_average_across_sessions_trials": cp.plot_trials_population_average_across_sessions,
+    "population_average_across_sessions_stimulus": cp.plot_stimulus_population_average_across_sessions,
+    "event_detection": cp.plot_event_detection_for_container,
+    "single_cell_response_plots": cp.plot_single_cell_response_plots_for_container,
+    "traces_and_behavior": cp.plot_dff_trace_and_behavior_for_container,
+    # "roi_filtering_metrics_all_cells": cp.plot_roi_filtering_metrics_for_all_rois_for_container,
+    # "roi_filtering_metrics_valid_cells": cp.plot_roi_filtering_metrics_for_valid_rois_for_container,
+    # "filtered_roi_masks": cp.plot_filtered_roi_masks_for_container,
+    # "classifier_validation": cp.plot_classifier_validation_for_container,
+    # "snr_metrics_df": cp.generate_snr_metrics_df_for_container,
+}
+
+# folder within the container plots directory that each plot is saved to, as 'container_<ophys_container_id>.png'
+# plots that save one figure per experiment or cell are not listed and are always regenerated
+CONTAINER_PLOT_FOLDERS = {
+    "ophys_session_sequence": "ophys_session_sequence",
+    "max_projection_images": "max_intensity_projection",
+    "average_images": "average_images",
+    "dff_traces_heatmaps": "dff_traces_heatmaps",
+    "running_speed": "running_speed",
+    "lick_rasters": "lick_rasters",
+    "average_intensity_timeseries": "average_intensity_timeseries",
+    "motion_correction_xy_shift": "motion_correction_xy_shift",
+    "OphysRegistrationSummaryImage": "OphysRegistrationSummaryImage",
+    "number_matched_cells": "number_matched_cells",
+    "fraction_matched_cells": "fraction_matched_cells",
+    "cell_matching_registration_overlay_grid": "cell_matching_registration_overlay_grid",
+    "nway_match_fraction": "nway_match_fraction",
+    "nway_warp_overlay": "nway_warp_overlay",
+    "nway_warp_summary": "nway_warp_summary",
+    "segmented_rois_by_experiment": "segmented_rois_by_experiment",
+    "segmentation_masks": "segmentation_masks",
+    "segmentation_mask_overlays": "segmentation_mask_overlays",
+    "max_projection_images_movies": "max_intensity_projection_movies",
+    "average_images_movies": "average_images_movies",
+    "cell_snr_by_experiment": "cell_snr_by_experiment",
+    "eye_tracking_sample_frames": "eyetracking_sample_frames",
+    "pupil_area_sdk": "pupil_area_vs_time_sdk",
+    "pupil_area": "pupil_area_vs_time",
+    "pupil_position": "pupil_position_vs_time",
+    "FOV_average_intensity": "FOV_average_intensity",
+    "pmt_settings": "pmt_settings",
+    "snr_by_pmt": "snr_by_pmt",
+    "snr_by_pmt_and_intensity": "snr_by_pmt_and_intensity",
+    "behavior_summary": "behavior_metric_summary",
+    "population_average_across_sessions_omission": "population_average_by_session_omission",
+    "population_average_across_sessions_trials": "population_average_by_session_trials",
+    "population_average_across_sessions_stimulus": "population_average_by_session_stimulus",
+}
+
+
+def get_container_plot_path(ophys_container_id, plot_name):
+    """path of the png saved by a container plot, or None if the plot does not save a single figure per container
+    """
+    if plot_name not in CONTAINER_PLOT_FOLDERS:
+        return None
+    return os.path.join(loading.get_container_plots_dir(), CONTAINER_PLOT_FOLDERS[plot_name],
+                        'container_{}.png'.format(ophys_container_id))
+
+
+def get_container_input_mtime(ophys_experiment_ids):
+    """most recent modification time of the NWB files for the experiments in a container,
+        or None if any of them can not be found.
+        only the NWB files are checked: plots made from other inputs (LIMS registration and
+        cell matching outputs, eye tracking files, motion corrected movies) are not regenerated
+        when those change, use overwrite=True to regenerate them
+    """
+    mtimes = []
+    for ophys_experiment_id in ophys_experiment_ids:
+        try:
+            mtimes.append(os.path.getmtime(from_lims.get_BehaviorOphys_NWB_filepath(ophys_experiment_id)))
+        except Exception:
+            return None
+    return max(mtimes) if len(mtimes) > 0 else None
+
+
+def plot_is_up_to_date(ophys_container_id, plot_name, input_mtime):
+    """True if the saved plot exists and is newer than input_mtime, the NWB modification time
+        from get_container_input_mtime. changes to inputs other than the NWB files are not detected
+    """
+    plot_path = get_container_plot_path(ophys_container_id, plot_name)
+    if plot_path is None or input_mtime is None or not os.path.exists(plot_path):
+        return False
+    return os.path.getmtime(plot_path) > input_mtime
+
+
+def save_plots_for_container(ophys_container_id, plot_names=None, overwrite=False):
+    """generates QC plots for one container in this process. each experiment's dataset is
+        loaded once and shared by all plots, using loading.cache_ophys_datasets
+
+    Arguments:
+        ophys_container_id {int} -- container to generate plots for
+
+    Keyword Arguments:
+        plot_names {list} -- names of plots in CONTAINER_PLOTS to generate, all plots if None (default: {None})
+        overwrite {bool} -- if False, skip plots that exist and are newer than the
+                            container's NWB files. changes to other inputs are not
+                            detected (default: {False})
+
+    Returns:
+        list -- one dictionary per plot with keys "ophys_container_id", "plot_name",
+                "status" ('saved', 'skipped' or 'failed'), "seconds" and "error"
+    """
+    if plot_names is None:
+        plot_names = list(CONTAINER_PLOTS.keys())
+    results = []
+    with loading.cache_ophys_datasets():
+        input_mtime = None
+        if not overwrite:
+            ophys_experiment_ids = loading.get_ophys_experiment_ids_for_ophys_container_id(ophys_container_id)
+            input_mtime = get_container_input_mtime(ophys_experiment_ids)
+        for plot_name in plot_names:
+            result = {'ophys_container_id': ophys_container_id, 'plot_name': plot_name, 'error': None}
+            start = time.time()
+            if not overwrite and plot_is_up_to_date(ophys_container_id, plot_name, input_mtime):
+                result['status'] = 'skipped'
+            else:
+                try:
+                    CONTAINER_PLOTS[plot_name](ophys_container_id)
+                    result['status'] = 'saved'
+                except Exception as e:
+                    print('{} failed for container {}, error:  {}'.format(plot_name, ophys_container_id, e))
+                    result['status'] = 'failed'
+                    result['error'] = repr(e)
+                finally:
+                    plt.close('all')
+            result['seconds'] = time.time() - start
+            results.append(result)
+        print('dataset cache for container {}: {}'.format(ophys_container_id, loading.get_ophys_dataset_cache_info()))
+    return results
 
+
+def save_plots_for_containers(ophys_container_ids, plot_names=None, overwrite=False, n_workers=1):
+    """generates QC plots for many containers, one container at a time per worker process
+
+    Arguments:
+        ophys_container_ids {list} -- containers to generate plots for
+
+    Keyword Arguments:
+        plot_names {list} -- names of plots in CONTAINER_PLOTS to generate, all plots if None (default: {None})
+        overwrite {bool} -- if False, skip plots that are already up to date (default: {False})
+        n_workers {int} -- number of worker processes, containers are processed in this process if 1 (default: {1})
+
+    Returns:
+        dataframe -- one row per container and plot, with columns "ophys_container_id", "plot_name",
+                    "status", "seconds" and "error"
+    """
+    if plot_names is not None:
+        invalid_plot_names = [plot_name for plot_name in plot_names if plot_name not in CONTAINER_PLOTS]
+        if len(invalid_plot_names) > 0:
+            raise RuntimeError(f"{invalid_plot_names} are not valid plot options!")
+    results = []
+    if n_workers == 1:
+        for ophys_container_id in ophys_container_ids:
+            results.extend(save_plots_for_container(ophys_container_id, plot_names, overwrite))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(save_plots_for_container, ophys_container_id, plot_names, overwrite): ophys_container_id
+                       for ophys_container_id in ophys_container_ids}
+            for future in as_completed(futures):
+                try:
+                    results.extend(future.result())
+                except Exception as e:
+                    print('plots failed for container {}, error:  {}'.format(futures[future], e))
+    return pd.DataFrame(results, columns=['ophys_container_id', 'plot_name', 'status', 'seconds', 'error'])
+
+
+def get_plot_timing_report(results):
+    """summarizes the output of save_plots_for_containers by plot type
+
+    Returns:
+        dataframe -- one row per plot_name with the number of plots saved, skipped and failed,
+                    and the total and mean seconds spent generating saved plots
+    """
+    counts = results.groupby(['plot_name', 'status']).size().unstack('status', fill_value=0)
+    counts = counts.reindex(columns=['saved', 'skipped', 'failed'], fill_value=0)
+    saved = results[results.status == 'saved'].groupby('plot_name')['seconds']
+    report = counts.join(saved.sum().rename('total_seconds')).join(saved.mean().rename('mean_seconds'))
+    return report.sort_values('total_seconds', ascending=False)
+
+
+def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--container-id", type=int,
-                        help="Container ID to process")
+    parser.add_argument("--container-id", type=int, nargs='+',
+                        help="Container ID(s) to process")
     parser.add_argument("--plots", type=str, nargs='+', default=None,
                         help=(f"Which plots to create for a container."
-                              f"Possible plots: {possible_plots.keys()}"))
+                              f"Possible plots: {CONTAINER_PLOTS.keys()}"))
+    parser.add_argument("--n-workers", type=int, default=1,
+                        help="Number of worker processes, each processing one container at a time")
+    parser.add_argument("--overwrite", action='store_true',
+                        help="Regenerate plots that already exist and are newer than the container's NWB files")
     args = parser.parse_args()
 
-    if args.plots:
-        for plot_name in args.plots:
-            try:
-                possible_plots[plot_name](args.container_id)
-            except KeyError:
-                raise RuntimeError(f"'{plot_name}'' is not a valid plot option!")
-    else:
-        for plot_name, plot_callable in possible_plots.items():
-            try:
-                plot_callable(args.container_id)
-            except Exception as e:
-                print('{} failed for container {}, error:  {}'.format(plot_name, args.container_id, e))
+    results = save_plots_for_containers(args.container_id, plot_names=args.plots,
+                                        overwrite=args.overwrite, n_workers=args.n_workers)
+    print(get_plot_timing_report(results))
 
 
 if __name__ == "__main__":
@@ -1,3 +1,5 @@
+import numpy as np
+import pytest
 import visual_behavior.utilities as vbu
 
 
@@ -7,3 +9,24 @@ def test_d_prime(mock_trials_fixture):
 
     hr_with_limits, far_with_limits, dp_with_limits = vbu.get_response_rates(mock_trials_fixture, apply_trial_number_limit=True)
     assert dp_with_limits[2] == 0.6744897501960817
+
+
+@pytest.mark.parametrize('apply_trial_number_limit', [False, True])
+def test_cumsum_response_rates(mock_trials_fixture, apply_trial_number_limit):
+    trials = mock_trials_fixture.copy()
+    trials.loc[trials.index % 7 == 0, 'trial_type'] = 'aborted'
+
+    response_rates = vbu.get_response_rates_for_windows(trials, sliding_windows=(10, 100), apply_trial_number_limit=apply_trial_number_limit)
+    for sliding_window in (10, 100):
+        expected = vbu.get_response_rates(trials, sliding_window=sliding_window, apply_trial_number_limit=apply_trial_number_limit)
+        for result, expected_result in zip(response_rates[sliding_window], expected):
+            np.testing.assert_allclose(result, expected_result)
+
+    _, _, dp = vbu.get_response_rates(mock_trials_fixture, apply_trial_number_limit=apply_trial_number_limit, engine='cumsum')
+    assert np.isclose(dp[2], [4.6526957480816815, 0.6744897501960817][apply_trial_number_limit])
+
+
+def test_rolling_sum_and_count():
+    response_sum, response_count = vbu.rolling_sum_and_count(np.array([1., np.nan, 0., 1., 1.]), 3)
+    np.testing.assert_array_equal(response_sum, [1, 1, 1, 1, 2])
+    np.testing.assert_array_equal(response_count, [1, 1, 2, 2, 3])
@@ -1,3 +1,6 @@
+import pytest
+import numpy as np
+import pandas as pd
 from pandas.testing import assert_frame_equal
 from visual_behavior.change_detection.trials import summarize
 
@@ -24,3 +27,54 @@ def test_epoch_level_summary(mock_trials_fixture, epoch_summary):
         check_exact=False,
         check_less_precise=2,
     )
+
+
+@pytest.mark.parametrize('apply_trial_number_limit', [False, True])
+def test_vectorized_summary_engine(mock_trials_fixture, apply_trial_number_limit):
+    trials = mock_trials_fixture.copy()
+    # split the trials into several sessions & abort a few, so that groups differ
+    trials['behavior_session_uuid'] = trials['behavior_session_uuid'].astype(str) + (trials.index % 3).astype(str)
+    trials.loc[trials.index % 7 == 0, 'trial_type'] = 'aborted'
+
+    for summarize_func in (summarize.session_level_summary, summarize.epoch_level_summary):
+        assert_frame_equal(
+            summarize_func(trials.copy(), apply_trial_number_limit=apply_trial_number_limit, engine='vectorized'),
+            summarize_func(trials.copy(), apply_trial_number_limit=apply_trial_number_limit),
+            check_dtype=False,
+        )
+
+
+def test_vectorized_summary_engine_keeps_overrides(mock_trials_fixture):
+    summary = summarize.session_level_summary(
+        mock_trials_fixture.copy(),
+        engine='vectorized',
+        d_prime=lambda grp: -999.,
+    )
+    assert (summary['d_prime'] == -999.).all()
+    # metrics that were not overridden are still computed from counts
+    assert_frame_equal(
+        summary.drop(columns='d_prime'),
+        summarize.session_level_summary(mock_trials_fixture.copy()).drop(columns='d_prime'),
+        check_dtype=False,
+    )
+
+
+def test_discrimination_summary():
+    trials = pd.DataFrame({
+        'session': ['a'] * 5 + ['b'] * 3,
+        'trial_type': ['go', 'go', 'catch', 'catch', 'aborted', 'go', 'go', 'go'],
+        'change': [True, True, False, False, False, True, True, True],
+        'detect': [True, False, True, False, True, True, True, True],
+    })
+    summary = summarize.discrimination_summary(trials, ['session'])
+    np.testing.assert_array_equal(summary['number_of_go_trials'], [2, 3])
+    np.testing.assert_array_equal(summary['number_of_catch_trials'], [2, 0])
+    np.testing.assert_array_equal(summary['hit_rate'], [0.5, 1.0])
+    np.testing.assert_array_equal(summary['false_alarm_rate'], [0.5, np.nan])
+    np.testing.assert_array_equal(summary['response_bias'], [0.5, 1.0])
+    np.testing.assert_array_equal(summary['d_prime'], [0.0, np.nan])
+
+
+def test_summary_engine_must_be_known(mock_trials_fixture):
+    with pytest.raises(ValueError):
+        summarize.session_level_summary(mock_trials_fixture, engine='numba')
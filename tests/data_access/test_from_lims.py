@@ -270,3 +270,21 @@ def test_get_filtered_ophys_session_table():
     assert from_lims.get_id_type(914161594)  == 'ophys_session_id'
     assert from_lims.get_id_type(1080784881) == 'cell_roi_id'
     assert from_lims.get_id_type(1234)       == 'unknown_id'
+
+
+def test_load_traces_array_for_cell_roi_ids(tmpdir, monkeypatch):
+    import h5py
+    import numpy as np
+
+    filepath = os.path.join(str(tmpdir), 'demixed_traces.h5')
+    with h5py.File(filepath, 'w') as f:
+        f.create_dataset('data', data=np.arange(12, dtype=float).reshape(3, 4))
+        f.create_dataset('roi_names', data=np.array([b'10', b'11', b'12']))
+    monkeypatch.setattr(from_lims, 'get_demixed_traces_filepath', lambda ophys_experiment_id: filepath)
+
+    traces = from_lims.load_demixed_traces_array(OPHYS_EXPERIMENT_ID_SCI, cell_roi_ids=[12, 10])
+    np.testing.assert_array_equal(traces, [[8, 9, 10, 11], [0, 1, 2, 3]])
+
+    # rows would not line up with the requested ids if missing ids were dropped
+    with pytest.raises(ValueError):
+        from_lims.load_demixed_traces_array(OPHYS_EXPERIMENT_ID_SCI, cell_roi_ids=[12, 99, 10])
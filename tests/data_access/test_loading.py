@@ -22,3 +22,66 @@ def test_get_dff_traces_for_roi():
 
     dff = loading.get_dff_traces_for_roi(cell_roi_id)
     np.isclose(dff[100],-0.13958465)
+
+
+def test_get_object_nbytes_counts_array_cells():
+    import pandas as pd
+    import visual_behavior.data_access.loading as loading
+
+    class MockDataset(object):
+        pass
+
+    dataset = MockDataset()
+    dataset.dff_traces = pd.DataFrame({'dff': [np.zeros(100000) for _ in range(10)]})
+    # the traces themselves are 8 MB, well above the size of the pointers to them
+    assert loading.get_object_nbytes(dataset) > 10 * 100000 * 8
+
+
+def test_ophys_dataset_cache_evicts_by_deep_size():
+    import pandas as pd
+    import visual_behavior.data_access.loading as loading
+
+    class MockDataset(object):
+        def __init__(self):
+            self.events = pd.DataFrame({'events': [np.zeros(100000) for _ in range(10)]})
+
+    cache = loading.OphysDatasetCache(max_bytes=2e7)
+    for key in range(3):
+        cache.put(key, MockDataset())
+    # each dataset holds 8 MB, so only two fit in the budget
+    assert len(cache) == 2
+    assert 0 not in cache
+    assert cache.info()['evictions'] == 1
+
+
+def test_ophys_datasets_are_only_cached_within_context(monkeypatch):
+    import visual_behavior.data_access.loading as loading
+
+    class MockExperiment(object):
+        @classmethod
+        def from_lims(cls, ophys_experiment_id):
+            return cls()
+
+    monkeypatch.setattr(loading.from_lims, 'get_id_type', lambda ophys_experiment_id: 'ophys_experiment_id')
+    monkeypatch.setattr(loading, 'BehaviorOphysExperiment', MockExperiment)
+
+    def get_dataset(ophys_experiment_id):
+        return loading.get_ophys_dataset(ophys_experiment_id, load_from_lims=True)
+
+    # not cached by default, so changes one caller makes are not seen by the next
+    assert get_dataset(1) is not get_dataset(1)
+    assert loading.get_ophys_dataset_cache_info() is None
+
+    with loading.cache_ophys_datasets():
+        dataset = get_dataset(1)
+        assert get_dataset(1) is dataset
+        with loading.cache_ophys_datasets():
+            assert get_dataset(1) is dataset
+            get_dataset(2)
+        # a nested context leaves the enclosing cache as it was
+        assert get_dataset(1) is dataset
+        assert loading.get_ophys_dataset_cache_info()['n_datasets'] == 2
+        assert loading.get_ophys_dataset(1, load_from_lims=True, use_cache=False) is not dataset
+
+    assert loading.get_ophys_dataset_cache_info() is None
+    assert get_dataset(1) is not dataset
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+from visual_behavior.data_access import processing
+
+
+def test_shift_image_masks_matches_shift_mask_by_row():
+    rng = np.random.RandomState(0)
+    cell_table = pd.DataFrame({
+        'image_mask': [(rng.rand(20, 30) > 0.9).astype(float) for _ in range(4)],
+        # offsets past the edges of the FOV wrap around, like np.roll
+        'x': [0, 3, 29, -2],
+        'y': [0, 19, 25, 1],
+    })
+    expected = [processing.shift_mask_by_row(row) for _, row in cell_table.iterrows()]
+    cell_table = processing.shift_image_masks(cell_table)
+    for roi_mask, expected_mask in zip(cell_table['roi_mask'], expected):
+        np.testing.assert_array_equal(roi_mask, expected_mask)
+        assert roi_mask.dtype == expected_mask.dtype
+
+
+def test_motion_corrected_movie_summaries_are_bounded(monkeypatch):
+    loaded = []
+
+    def load_motion_corrected_movie(ophys_experiment_id):
+        loaded.append(ophys_experiment_id)
+        return np.full((10, 8, 8), float(ophys_experiment_id))
+
+    monkeypatch.setattr(processing.data_loading, 'load_motion_corrected_movie', load_motion_corrected_movie)
+    monkeypatch.setattr(processing, 'MOTION_CORRECTED_MOVIE_SUMMARIES_MAX_ENTRIES', 2)
+    processing.clear_motion_corrected_movie_summaries()
+
+    for ophys_experiment_id in [1, 2, 1, 3]:
+        summary = processing.get_motion_corrected_movie_summary(ophys_experiment_id, subsample=5)
+        assert summary['max_FOV'][0, 0] == ophys_experiment_id
+    # 1 was used more recently than 2, so 2 was dropped when 3 was added
+    assert loaded == [1, 2, 3]
+    processing.get_motion_corrected_movie_summary(1, subsample=5)
+    processing.get_motion_corrected_movie_summary(2, subsample=5)
+    assert loaded == [1, 2, 3, 2]
+    processing.clear_motion_corrected_movie_summaries()
@@ -0,0 +1,34 @@
+import numpy as np
+from unittest import mock
+from pymongo import UpdateOne
+
+from visual_behavior import database as db
+
+
+def test_update_or_create_many():
+    documents = [
+        {'behavior_session_id': np.int64(1), 'licks': True, 'is_ophys': np.bool_(False)},
+        {'behavior_session_id': np.int64(2), 'licks': False, 'is_ophys': np.bool_(True)},
+    ]
+
+    # the query and update that update_or_create uses for an existing document
+    single_collection = mock.MagicMock()
+    single_collection.find_one.return_value = {'behavior_session_id': 1}
+    expected = []
+    for document in documents:
+        db.update_or_create(single_collection, document, keys_to_check=['behavior_session_id'])
+        query, update = single_collection.update_one.call_args[0]
+        expected.append(UpdateOne(query, update, upsert=True))
+
+    collection = mock.MagicMock()
+    db.update_or_create_many(collection, documents, keys_to_check=['behavior_session_id'])
+    collection.bulk_write.assert_called_once()
+    assert collection.bulk_write.call_args[0][0] == expected
+    collection.insert_one.assert_not_called()
+    collection.update_one.assert_not_called()
+
+
+def test_update_or_create_many_without_documents():
+    collection = mock.MagicMock()
+    db.update_or_create_many(collection, [], keys_to_check=['behavior_session_id'])
+    collection.bulk_write.assert_not_called()
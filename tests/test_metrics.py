@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+from visual_behavior import metrics
+
+
+@pytest.mark.parametrize('apply_trial_number_limit', [False, True])
+@pytest.mark.parametrize('clip_vals', [[0, 1], [0.01, 0.99]])
+def test_batch_metrics(apply_trial_number_limit, clip_vals):
+    rng = np.random.RandomState(0)
+    y_true = rng.rand(200) < 0.3
+    y_pred = np.where(y_true, rng.rand(200) < 0.8, rng.rand(200) < 0.2)
+    groups = rng.choice(['a', 'b', 'c'], 200)
+    # one group with only go trials and hits
+    y_true[groups == 'c'] = True
+    y_pred[groups == 'c'] = True
+
+    batch = metrics.batch_metrics(y_true, y_pred, groups, apply_trial_number_limit=apply_trial_number_limit, clip_vals=clip_vals)
+
+    assert list(batch.index) == ['a', 'b', 'c']
+    for group, row in batch.iterrows():
+        group_true = pd.Series(y_true[groups == group])
+        group_pred = pd.Series(y_pred[groups == group])
+        kws = dict(apply_trial_number_limit=apply_trial_number_limit, clip_vals=clip_vals)
+        assert row['N_go_trials'] == metrics.N_go_trials(group_true, group_pred)
+        assert row['N_catch_trials'] == metrics.N_catch_trials(group_true, group_pred)
+        np.testing.assert_allclose(row['hit_rate'], metrics.hit_rate(group_true, group_pred, **kws))
+        np.testing.assert_allclose(row['false_alarm_rate'], metrics.false_alarm_rate(group_true, group_pred, **kws))
+        np.testing.assert_allclose(row['d_prime'], metrics.d_prime(group_true, group_pred, **kws))
+        np.testing.assert_allclose(row['discrim_p'], metrics.discrim_p(group_true, group_pred))
+
+
+def test_batch_metrics_2d():
+    rng = np.random.RandomState(1)
+    y_true = rng.rand(5, 40) < 0.5
+    y_pred = rng.rand(5, 40) < 0.5
+
+    batch = metrics.batch_metrics(y_true, y_pred)
+
+    expected = [metrics.d_prime(pd.Series(y_true[ii]), pd.Series(y_pred[ii])) for ii in range(5)]
+    np.testing.assert_allclose(batch['d_prime'], expected)
+
+
+def test_bootstrap_d_prime():
+    rng = np.random.RandomState(2)
+    y_true = rng.rand(400) < 0.5
+    y_pred = np.where(y_true, rng.rand(400) < 0.8, rng.rand(400) < 0.2)
+    groups = np.repeat([0, 1], 200)
+
+    bootstrap = metrics.bootstrap_d_prime(y_true, y_pred, groups, n_bootstrap=2000, random_state=0)
+
+    np.testing.assert_allclose(bootstrap['d_prime'], metrics.batch_metrics(y_true, y_pred, groups)['d_prime'])
+    assert (bootstrap['ci_low'] < bootstrap['d_prime']).all()
+    assert (bootstrap['ci_high'] > bootstrap['d_prime']).all()
+    # reproducible with a fixed random state
+    pd.testing.assert_frame_equal(bootstrap, metrics.bootstrap_d_prime(y_true, y_pred, groups, n_bootstrap=2000, random_state=0))
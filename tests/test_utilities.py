@@ -3,7 +3,9 @@ from visual_behavior.utilities import find_nearest_index
 from visual_behavior.utilities import dprime
 from visual_behavior.utilities import trial_number_limit
 from visual_behavior.utilities import Movie
+import visual_behavior.utilities as vbu
 import numpy as np
+import pandas as pd
 import pytest
 import os
 
@@ -35,6 +37,54 @@ def test_movie_load():
     assert frame2[100, 100, 0] == 150
 
 
+def _write_test_movie(tmpdir):
+    cv2 = pytest.importorskip('cv2')
+    movie_path = os.path.join(str(tmpdir), 'movie.avi')
+    writer = cv2.VideoWriter(movie_path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (16, 12))
+    for value in [0, 60, 120, 180, 240]:
+        writer.write(np.full((12, 16, 3), value, dtype=np.uint8))
+    writer.release()
+    return movie_path
+
+
+def test_movie_frames_are_not_changed_by_annotation(tmpdir):
+    cv2 = pytest.importorskip('cv2')
+    movie = Movie(_write_test_movie(tmpdir))
+    frame = movie.get_frame(frame=1)
+    original = frame.copy()
+
+    # draw on the returned frame, as EyeTrackingData.add_ellipse does
+    cv2.ellipse(frame, (8, 6), (4, 3), 0, 0, 360, (0, 0, 255), 2)
+    assert not np.array_equal(frame, original)
+
+    # the cached frame is unchanged
+    np.testing.assert_array_equal(movie.get_frame(frame=1), original)
+    np.testing.assert_array_equal(movie.get_frames([1])[0], original)
+    movie.close()
+
+
+def test_movie_reads_after_failed_read(tmpdir):
+    movie = Movie(_write_test_movie(tmpdir), cache_size=0)
+    with pytest.warns(UserWarning):
+        assert movie.get_frame(frame=movie.frame_count) is None
+
+    # the position is unknown after the failed read, so the next read has to seek rather than skip forward
+    frame0 = movie.get_frame(frame=0)
+    assert frame0 is not None
+    assert abs(int(frame0[6, 8, 0]) - 0) < 10
+    frame2 = movie.get_frame(frame=2)
+    assert abs(int(frame2[6, 8, 0]) - 120) < 10
+
+    # the lock is released between yielded frames, so other reads can interleave with iteration
+    frames = []
+    for frame, frame_array in movie.iter_frames(step=2):
+        movie.get_frame(frame=4)
+        frames.append((frame, int(frame_array[6, 8, 0])))
+    assert [frame for frame, _ in frames] == [0, 2, 4]
+    assert all(abs(value - 60 * frame) < 10 for frame, value in frames)
+    movie.close()
+
+
 def test_trial_number_limit():
     assert trial_number_limit(1, 5) == 0.9
 
@@ -81,3 +131,101 @@ def test_dprime():
         limits=False
     )
     assert d_prime == 0.0
+
+
+def test_cache_behavior_stats_for_sessions(tmpdir, monkeypatch):
+    loaded_sessions = []
+
+    def load_behavior_stats_session(behavior_session_id):
+        loaded_sessions.append(behavior_session_id)
+        if behavior_session_id == 3:
+            raise RuntimeError('missing nwb')
+        return behavior_session_id
+
+    def compute_behavior_stats(session, behavior_session_id, method, engaged_only, per_image, stimulus_presentations=None):
+        if per_image:
+            return {image_name: {'behavior_session_id': behavior_session_id, 'image_name': image_name, 'hit_rate': 0.5}
+                    for image_name in ['im000', 'im031']}
+        return {'behavior_session_id': behavior_session_id, 'hit_rate': 0.1 * behavior_session_id}
+
+    monkeypatch.setattr(vbu, 'load_behavior_stats_session', load_behavior_stats_session)
+    monkeypatch.setattr(vbu, 'annotate_stimuli', lambda session, inplace=False: None)
+    monkeypatch.setattr(vbu, 'compute_behavior_stats', compute_behavior_stats)
+
+    store_path = os.path.join(str(tmpdir), 'behavior_stats.h5')
+    vbu.cache_behavior_stats_for_sessions([1, 2, 3], n_workers=1, store_path=store_path)
+    # each session is loaded once for all variants
+    assert sorted(loaded_sessions) == [1, 2, 3]
+
+    behavior_stats = vbu.load_cached_behavior_stats(store_path=store_path)
+    assert list(behavior_stats['behavior_session_id']) == [1, 2, 3]
+    assert list(behavior_stats['error']) == ['', '', 'missing nwb']
+
+    per_image_stats = vbu.load_cached_behavior_stats([2], method='trial_based', per_image=True, store_path=store_path)
+    assert list(per_image_stats['image_name']) == ['im000', 'im031']
+
+    # re-caching a session replaces its rows
+    vbu.cache_behavior_stats_for_sessions([2, 4], variants=[('stimulus_based', True, False)], n_workers=1, store_path=store_path)
+    behavior_stats = vbu.load_cached_behavior_stats([1, 2, 4], store_path=store_path)
+    assert sorted(behavior_stats['behavior_session_id']) == [1, 2, 4]
+    np.testing.assert_allclose(behavior_stats.sort_values('behavior_session_id')['hit_rate'], [0.1, 0.2, 0.4])
+
+
+def test_cache_behavior_stats_sdk_variant(tmpdir, monkeypatch):
+    def load_behavior_stats_session(behavior_session_id):
+        session = MockDataset()
+        # like BehaviorSession.get_performance_metrics, without the behavior_session_id
+        session.get_performance_metrics = lambda: {'trial_count': 10 * behavior_session_id, 'hit_rate': 0.1 * behavior_session_id}
+        return session
+
+    monkeypatch.setattr(vbu, 'load_behavior_stats_session', load_behavior_stats_session)
+
+    store_path = os.path.join(str(tmpdir), 'behavior_stats.h5')
+    variants = [variant for variant in vbu.BEHAVIOR_STATS_VARIANTS if variant[0] == 'sdk']
+    assert variants == [('sdk', False, False)]
+    vbu.cache_behavior_stats_for_sessions([1, 2], variants=variants, n_workers=1, store_path=store_path)
+    # a second write replaces rows by behavior_session_id
+    vbu.cache_behavior_stats_for_sessions([2, 3], variants=variants, n_workers=1, store_path=store_path)
+
+    behavior_stats = vbu.load_cached_behavior_stats([1, 2, 3], method='sdk', store_path=store_path)
+    assert sorted(behavior_stats['behavior_session_id']) == [1, 2, 3]
+    np.testing.assert_array_equal(behavior_stats.sort_values('behavior_session_id')['trial_count'], [10, 20, 30])
+    # engaged_only does not change the sdk partition
+    assert len(vbu.load_cached_behavior_stats([2], method='sdk', engaged_only=True, store_path=store_path)) == 1
+
+
+class MockDataset(object):
+    pass
+
+
+def test_annotate_stimuli():
+    dataset = MockDataset()
+    dataset.extended_stimulus_presentations = pd.DataFrame({
+        'start_time': np.arange(12) * 0.75,
+        'image_name': ['im0'] * 5 + ['omitted'] + ['im0'] * 3 + ['im1'] * 3,
+    }, index=pd.Index(np.arange(12), name='stimulus_presentations_id'))
+    dataset.trials = pd.DataFrame({
+        'start_time': [0.0, 6.0],
+        'auto_rewarded': [False, True],
+    }, index=pd.Index([0, 1], name='trials_id'))
+    dataset.licks = pd.DataFrame({'timestamps': [3.1, 3.2, 6.75]})
+
+    stimulus_presentations = vbu.annotate_stimuli(dataset, use_cache=False)
+
+    np.testing.assert_array_equal(stimulus_presentations['trials_id'], [0] * 8 + [1] * 4)
+    np.testing.assert_array_equal(stimulus_presentations['trial_stimulus_index'], list(range(8)) + list(range(4)))
+    np.testing.assert_array_equal(stimulus_presentations['response_lick'], [False] * 4 + [True] + [False] * 4 + [True] + [False] * 2)
+    assert stimulus_presentations.loc[4, 'response_lick_times'] == [3.1, 3.2]
+    np.testing.assert_allclose(stimulus_presentations.loc[[4, 9], 'response_lick_latency'], [0.1, 0.0])
+    np.testing.assert_array_equal(stimulus_presentations['auto_rewarded'], [False] * 8 + [True] * 4)
+    np.testing.assert_array_equal(
+        stimulus_presentations['previous_response_on_trial'],
+        [False] * 5 + [True] * 3 + [False] * 2 + [True] * 2
+    )
+    np.testing.assert_array_equal(stimulus_presentations['could_change'], [False] * 4 + [True] + [False] * 7)
+
+    # cached per dataset object
+    annotated = vbu.annotate_stimuli(dataset)
+    annotated['could_change'] = True
+    np.testing.assert_array_equal(vbu.annotate_stimuli(dataset)['could_change'], stimulus_presentations['could_change'])
+    assert vbu.annotate_stimuli(dataset) is not vbu.annotate_stimuli(dataset)
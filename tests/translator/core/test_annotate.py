@@ -2,7 +2,7 @@ import numpy as np
 import pandas as pd
 from pandas.testing import assert_series_equal, assert_frame_equal
 from visual_behavior.translator.core.annotate import annotate_startdatetime, \
-    make_trials_contiguous
+    make_trials_contiguous, assign_trial_description, get_trial_descriptions
 
 def test_annotate_startdatetime():
 
@@ -38,3 +38,17 @@ def test_make_trials_contiguous():
     output_trials = make_trials_contiguous(input_trials,time)
 
     assert_frame_equal(output_trials, EXPECTED_TRIALS, check_dtype=False)
+
+
+def test_get_trial_descriptions():
+
+    trials = pd.DataFrame(dict(
+        trial_type=['go', 'go', 'catch', 'catch', 'aborted', 'autorewarded', 'go', 'go', 'other'],
+        response=[1.0, 0.0, 1.0, np.nan, 1.0, 0.0, 'HIT', 0.0, 1.0],
+        auto_rewarded=[False, False, False, False, True, False, False, True, False],
+    ))
+
+    descriptions = get_trial_descriptions(trials)
+
+    assert descriptions.dtype.name == 'category'
+    assert list(descriptions.astype(object).where(descriptions.notnull(), None)) == list(trials.apply(assign_trial_description, axis=1))
@@ -1,4 +1,5 @@
 import pytest
+import time as time_module
 import numpy as np
 import pandas as pd
 
@@ -51,11 +52,29 @@ def test__get_stimulus_epoch(foraging2_data_stage_0_2018_05_16, idx, start_frame
         ),
         [(1, 2, ), (3, 5, ), (6, 11, ), ],
     ),
+    (
+        ([0, 1, 1, 1, 1, 0, ], 2, 2, ),
+        [],
+    ),
+    (
+        ([0, 1, 1, 1, 1, 0, ], 4, 2, ),
+        [],
+    ),
 ])
 def test__get_draw_epochs(args, expected):
     assert extract_stimuli._get_draw_epochs(*args) == expected
 
 
+def test_get_draw_epochs_for_set_log_repeated_frames():
+    draw_log = [1] * 8 + [0] * 2
+    # the third entry is set on the same frame as the second, the fourth before it
+    set_log = [('Image', 'im000', 0., frame) for frame in [0, 4, 4, 2, 6]]
+    set_index, epoch_start, epoch_end = extract_stimuli.get_draw_epochs_for_set_log(set_log, draw_log, 10)
+    np.testing.assert_array_equal(set_index, [0, 3, 4])
+    np.testing.assert_array_equal(epoch_start, [0, 2, 6])
+    np.testing.assert_array_equal(epoch_end, [4, 6, 8])
+
+
 def test_get_visual_stimuli(foraging2_data_stage_0_2018_05_16):
     expected = pd.DataFrame(data=[
         {
@@ -100,6 +119,77 @@ def test_get_visual_stimuli(foraging2_data_stage_0_2018_05_16):
     )
 
 
+def test_get_visual_stimuli_df_orientation_is_float():
+    stimuli = {
+        'gratings': {
+            'set_log': [('Ori', 90, 0., 0), ('Ori', 180, 0., 5)],
+            'draw_log': [1] * 3 + [0] * 2 + [1] * 3 + [0] * 3,
+        },
+    }
+    time = np.arange(11) / 60.
+    visual_stimuli_df = extract_stimuli.get_visual_stimuli_df(stimuli, time, include_image_category=False)
+    assert visual_stimuli_df['orientation'].dtype == np.float64
+    np.testing.assert_array_equal(visual_stimuli_df['orientation'], [90., 180.])
+    assert 'image_category' not in visual_stimuli_df.columns
+    assert visual_stimuli_df['image_name'].isnull().all()
+
+
+def _make_flashing_stimulus_df(n_flashes, omitted_flashes, flash_frames=15, blank_frames=30):
+    onset_frames = np.arange(n_flashes) * (flash_frames + blank_frames) + 10
+    time = np.arange(onset_frames[-1] + 100) / 60.
+    frames = np.delete(onset_frames, omitted_flashes)
+    stimulus_df = pd.DataFrame({
+        'frame': frames,
+        'end_frame': frames + flash_frames,
+        'time': time[frames],
+        'duration': time[frames + flash_frames] - time[frames],
+    })
+    return stimulus_df, time, onset_frames
+
+
+@pytest.mark.parametrize("omitted_flash_frame_log", [True, False, ])
+def test_check_for_omitted_flashes(omitted_flash_frame_log):
+    omitted_flashes = [5, 20, 21, 50]
+    stimulus_df, time, onset_frames = _make_flashing_stimulus_df(100, omitted_flashes)
+
+    if omitted_flash_frame_log:
+        # the last entry is within 3 frames of a presented flash, so is not an omitted flash
+        log = {'images': list(onset_frames[omitted_flashes]) + [onset_frames[7] + 2]}
+        omitted = extract_stimuli.check_for_omitted_flashes(stimulus_df, time, log, (0.25, 0.5))
+    else:
+        with pytest.warns(UserWarning):
+            omitted = extract_stimuli.check_for_omitted_flashes(stimulus_df, time, None, (0.25, 0.5))
+
+    assert sorted(omitted['frame']) == list(onset_frames[omitted_flashes])
+    np.testing.assert_allclose(sorted(omitted['time']), time[onset_frames[omitted_flashes]])
+
+
+def test_check_for_omitted_flashes_benchmark():
+    # a long session, ~2 hours of flashes with 5% omitted
+    n_flashes = 10000
+    rng = np.random.RandomState(0)
+    omitted_flashes = np.sort(rng.choice(np.arange(1, n_flashes - 1), n_flashes // 20, replace=False))
+    stimulus_df, time, onset_frames = _make_flashing_stimulus_df(n_flashes, omitted_flashes)
+    log = {'images': onset_frames[omitted_flashes]}
+
+    start = time_module.perf_counter()
+    omitted = extract_stimuli.check_for_omitted_flashes(stimulus_df, time, log, (0.25, 0.5))
+    elapsed = time_module.perf_counter() - start
+
+    # timing is reported rather than asserted, so that slow or loaded machines do not fail the test
+    print('check_for_omitted_flashes: {} flashes in {:.3f} s'.format(n_flashes, elapsed))
+    assert sorted(omitted['frame']) == list(onset_frames[omitted_flashes])
+    np.testing.assert_allclose(sorted(omitted['time']), time[onset_frames[omitted_flashes]])
+
+
+def test_get_frames_near_stimuli():
+    np.testing.assert_array_equal(
+        extract_stimuli.get_frames_near_stimuli([0, 10, 14, 20, 30], [13, 17, 40], tolerance=3),
+        [False, True, True, True, False],
+    )
+    assert not np.any(extract_stimuli.get_frames_near_stimuli([1, 2], []))
+
+
 # def test_wut():
 #     from visual_behavior.translator.foraging2 import data_to_change_detection_core
 #
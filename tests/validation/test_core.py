@@ -95,6 +95,21 @@ def test_validate_reward_follows_first_lick_in_window():
     assert validate_reward_follows_first_lick_in_window(core_data) == False
 
 
+
+def test_get_response_window_licks():
+    trials = pd.DataFrame({
+        'change_time': [10., np.nan, 30., 40.],
+        'lick_times': [[10.2, 10.5, 11.], [20.3], [], [40.1, 40.4]],
+        'reward_times': [[10.2005], [], [], []],
+    }, index=[3, 4, 5, 6])
+    response_window_licks = get_response_window_licks(trials, response_window=(0.15, 0.75))
+
+    np.testing.assert_array_equal(response_window_licks.index, trials.index)
+    np.testing.assert_array_equal(response_window_licks['number_of_licks_in_response_window'], [2, 0, 0, 1])
+    np.testing.assert_allclose(response_window_licks['lick_reward_latency'], [0.0005, np.nan, np.nan, np.inf])
+    for row, (_, trial) in zip(response_window_licks['licks_in_response_window'], trials.iterrows()):
+        np.testing.assert_array_equal(row, get_licks_in_response_window(trial, response_window=(0.15, 0.75)))
+
 def test_validate_encoder_voltage():
     # good data: spans range from 0 to 5V
     GOOD_DATA = {'running': pd.DataFrame({'v_sig': np.arange(0, 5, 0.1)})}
@@ -0,0 +1,118 @@
+import pytest
+import numpy as np
+import pandas as pd
+from visual_behavior.validation import extended_trials as et
+from visual_behavior.validation import extended_trials_vectorized as etv
+from visual_behavior.validation import qc
+
+
+def make_trials(n_trials=60, seed=0):
+    rng = np.random.RandomState(seed)
+    trial_type = rng.choice(['go', 'catch', 'aborted'], n_trials, p=[0.5, 0.2, 0.3])
+    starttime = np.cumsum(rng.uniform(3, 8, n_trials))
+    endtime = starttime + rng.uniform(2, 3, n_trials)
+    change_time = np.where(trial_type == 'aborted', np.nan, starttime + rng.uniform(0.5, 2, n_trials))
+
+    lick_times = []
+    reward_times = []
+    for tt, change, start in zip(trial_type, change_time, starttime):
+        if tt == 'aborted':
+            licks = sorted(start + rng.uniform(0, 2, rng.randint(0, 3)))
+        else:
+            licks = sorted(change + rng.uniform(-0.3, 1.0, rng.randint(0, 4)))
+        lick_times.append(list(licks))
+        reward_times.append([licks[0]] if (tt == 'go' and len(licks) > 0 and rng.rand() < 0.8) else [])
+
+    images = np.array(['im000', 'im031', 'im035'], dtype=object)
+    initial_image_name = rng.choice(images, n_trials)
+    change_image_name = np.where(trial_type == 'catch', initial_image_name, rng.choice(images, n_trials))
+
+    return pd.DataFrame({
+        'trial_type': trial_type,
+        'starttime': starttime,
+        'endtime': endtime,
+        'change_time': change_time,
+        'lick_times': lick_times,
+        'reward_times': reward_times,
+        'auto_rewarded': False,
+        'number_of_rewards': [len(rewards) for rewards in reward_times],
+        'initial_image_name': initial_image_name,
+        'change_image_name': change_image_name,
+        'initial_ori': np.nan,
+        'change_ori': np.nan,
+        'scheduled_change_time': rng.choice([1., 1.5, 2.], n_trials),
+        'response_window': [[0.15, 0.75]] * n_trials,
+    }, index=np.arange(n_trials) + 10)
+
+
+@pytest.mark.parametrize('validator, args', [
+    ('validate_aborted_change_time', ()),
+    ('validate_autorewards_after_N_consecutive_misses', (3, 0)),
+    ('validate_change_on_all_go_trials', ()),
+    ('validate_no_change_on_all_catch_trials', ()),
+    ('validate_licks_near_every_reward', ()),
+    ('validate_initial_matches_final', ()),
+    ('validate_first_lick_after_change_on_nonaborted', (True, )),
+    ('validate_trial_ends_without_licks', (0.5, )),
+    ('validate_number_aborted_trial_repeats', (2, )),
+    ('validate_params_change_after_aborted_trial_repeats', (2, 'exponential')),
+    ('validate_trial_times_never_overlap', ()),
+    ('validate_no_abort_on_lick_before_response_window', ()),
+    ('validate_licks_on_go_trials_earn_reward', ()),
+    ('validate_licks_on_catch_trials_do_not_earn_reward', ()),
+])
+@pytest.mark.parametrize('seed', range(5))
+def test_vectorized_validators_match_row_wise(validator, args, seed):
+    trials = make_trials(seed=seed)
+    expected = getattr(et, validator)(trials.copy(), *args)
+    assert getattr(etv, validator)(trials.copy(), *args) == expected
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_validate_reward_when_lick_in_window_matches_row_wise(seed):
+    trials = make_trials(seed=seed)
+    # drop one reward, so that some sessions fail
+    trials['reward_times'] = [[] if ii == 3 else rewards for ii, rewards in enumerate(trials['reward_times'])]
+    trials['rewarded'] = trials['trial_type'] == 'go'
+    core_data = {'trials': trials, 'metadata': {'response_window': [0.15, 0.75]}}
+    assert etv.validate_reward_when_lick_in_window(core_data) == et.validate_reward_when_lick_in_window(core_data)
+
+
+def test_identify_consecutive_aborted_blocks():
+    trials = pd.DataFrame({'trial_type': ['aborted', 'aborted', 'aborted', 'aborted', 'go', 'aborted', 'catch']})
+    expected = et.identify_consecutive_aborted_blocks(trials.copy(), failure_repeats=2)
+    result = etv.identify_consecutive_aborted_blocks(trials.copy(), failure_repeats=2)
+    np.testing.assert_array_equal(result['consecutive_aborted'], [1, 2, 3, 4, 0, 1, 0])
+    np.testing.assert_array_equal(result['consecutive_aborted_should_match'], expected['consecutive_aborted_should_match'])
+
+
+def test_count_stimuli_per_trial():
+    frames = np.arange(0, 1000, 45)
+    visual_stimuli = pd.DataFrame({
+        'frame': frames,
+        'end_frame': frames + 15,
+        'image_category': np.where(frames < 500, 'im000', 'im031'),
+        'orientation': np.nan,
+    })
+    trials = pd.DataFrame({'startframe': [0, 400, 900], 'endframe': [300, 600, 1000]})
+    np.testing.assert_array_equal(
+        etv.count_stimuli_per_trial(trials, visual_stimuli),
+        et.count_stimuli_per_trial(trials, visual_stimuli),
+    )
+
+
+def test_flatten_trial_lists():
+    flat, offsets = etv.flatten_trial_lists([[1, 2], [], [3]])
+    np.testing.assert_array_equal(flat, [1, 2, 3])
+    np.testing.assert_array_equal(offsets, [0, 2, 2, 3])
+    np.testing.assert_array_equal(etv.get_first_values(flat, offsets), [1, np.nan, 3])
+    np.testing.assert_array_equal(etv.get_last_values(flat, offsets), [2, np.nan, 3])
+
+
+def test_get_engine_function():
+    assert qc.get_engine_function(et.validate_aborted_change_time, 'python') is et.validate_aborted_change_time
+    assert qc.get_engine_function(et.validate_aborted_change_time, 'vectorized') is etv.validate_aborted_change_time
+    # validators without a vectorized version are used as is
+    assert qc.get_engine_function(et.validate_even_sampling, 'vectorized') is et.validate_even_sampling
+    with pytest.raises(ValueError):
+        qc.get_engine_function(et.validate_aborted_change_time, 'numba')
@@ -7,3 +7,65 @@ def test_check_session_passes():
 
     FAIL = {'metric_1': False, 'metric_2': True}
     assert check_session_passes(FAIL)==False
+
+
+def test_run_validation_functions():
+    import pandas as pd
+    from visual_behavior.validation.qc import run_validation_functions, get_validator_timing
+
+    def validate_adds_column(trials):
+        trials['new_column'] = 1
+        return True
+
+    def validate_has_no_new_column(trials):
+        return 'new_column' not in trials.columns
+
+    def validate_raises(trials):
+        raise ValueError('bad trials')
+
+    trials = pd.DataFrame({'starttime': [0., 1., 2.]})
+    validation_functions = {
+        validate_adds_column: (trials, ),
+        validate_has_no_new_column: (trials, ),
+        validate_raises: (trials, ),
+    }
+
+    for n_threads in [1, 3]:
+        results = pd.DataFrame(run_validation_functions(validation_functions, n_threads=n_threads))
+        assert list(results['validator']) == ['validate_adds_column', 'validate_has_no_new_column', 'validate_raises']
+        assert results['result'][0] == True
+        assert results['result'][2] is None
+        assert 'bad trials' in results['error'][2]
+        assert all(results['seconds'] >= 0)
+
+    # threaded validators get their own copies of the dataframes
+    trials = pd.DataFrame({'starttime': [0., 1., 2.]})
+    validation_functions = {validate_adds_column: (trials, ), validate_has_no_new_column: (trials, )}
+    results = pd.DataFrame(run_validation_functions(validation_functions, n_threads=2))
+    assert all(results['result'])
+    assert 'new_column' not in trials.columns
+
+    results['session'] = 'session_0'
+    timing = get_validator_timing(results)
+    assert timing.loc['validate_adds_column', 'n_passed'] == 1
+    assert set(timing.columns) == {'total_seconds', 'mean_seconds', 'max_seconds', 'n_passed', 'n_failed', 'n_errors'}
+
+
+def test_generate_qc_reports_records_session_errors(monkeypatch):
+    from visual_behavior.validation import qc
+
+    def load_core_data(pkl_path, camstim_type='foraging2'):
+        if pkl_path == 'missing.pkl':
+            raise IOError('no such file')
+        # a malformed session, the extended dataframe can not be created
+        return {'metadata': {}}
+
+    monkeypatch.setattr(qc, 'load_core_data', load_core_data)
+    results = qc.generate_qc_reports(['malformed.pkl', 'missing.pkl'], n_workers=1)
+
+    # every session has a row, with the error that stopped it from being validated
+    assert list(results['session']) == ['malformed.pkl', 'malformed.pkl', 'missing.pkl']
+    assert list(results['validator']) == ['load_core_data', 'get_shared_inputs', 'load_core_data']
+    assert results['error'][0] is None
+    assert results['error'][1] is not None
+    assert 'no such file' in results['error'][2]
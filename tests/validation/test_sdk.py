@@ -0,0 +1,50 @@
+from unittest import mock
+from pymongo import UpdateOne
+
+from visual_behavior.validation import sdk
+
+
+def _mock_validate_session(behavior_session_id, validate_only_failed=False):
+    document = {'behavior_session_id': behavior_session_id, 'licks': 1, 'trials': behavior_session_id % 2}
+    error_log_entries = [{'behavior_session_id': behavior_session_id, 'failed_attribute': 'trials'}] if behavior_session_id % 2 == 0 else []
+    return document, error_log_entries
+
+
+def _mock_database(monkeypatch):
+    conn = mock.MagicMock()
+    monkeypatch.setattr(sdk, '_validate_session', _mock_validate_session)
+    monkeypatch.setattr(sdk.db, 'Database', lambda database: conn)
+    return conn['sdk_validation']['error_logs'], conn['sdk_validation']['validation_results']
+
+
+def test_validate_sessions_bulk_writes(monkeypatch):
+    error_logs, validation_results = _mock_database(monkeypatch)
+    results = sdk.validate_sessions([3, 2, 4], n_workers=1)
+
+    # one insert for all error logs, one bulk upsert for all results
+    error_logs.insert_many.assert_called_once()
+    assert [entry['behavior_session_id'] for entry in error_logs.insert_many.call_args[0][0]] == [2, 4]
+    error_logs.insert_one.assert_not_called()
+
+    validation_results.bulk_write.assert_called_once()
+    requests = validation_results.bulk_write.call_args[0][0]
+    assert requests == [
+        UpdateOne({'behavior_session_id': behavior_session_id}, {'$set': _mock_validate_session(behavior_session_id)[0]}, upsert=True)
+        for behavior_session_id in [3, 2, 4]
+    ]
+    validation_results.insert_one.assert_not_called()
+    validation_results.update_one.assert_not_called()
+
+    assert list(results.index) == [3, 2, 4]
+    assert list(results['trials']) == [1, 0, 0]
+
+
+def test_validate_sessions_writes_in_chunks(monkeypatch):
+    error_logs, validation_results = _mock_database(monkeypatch)
+    results = sdk.validate_sessions([1, 2, 3, 4, 5], n_workers=1, chunk_size=2)
+
+    assert validation_results.bulk_write.call_count == 3
+    assert [len(call[0][0]) for call in validation_results.bulk_write.call_args_list] == [2, 2, 1]
+    # chunks without errors do not write to the error log
+    assert error_logs.insert_many.call_count == 2
+    assert list(results.index) == [1, 2, 3, 4, 5]